@@ -1,5 +1,37 @@
 __all__ = ['windspeed', 'time_downsample', 'aggregate_files',
-            'download_ERA5_hourly', 'dowload_ERA5_monthly']
+            'download_ERA5_hourly', 'dowload_ERA5_monthly',
+            'FileReductionError', 'StreamingResampler', 'ReductionTree',
+            'multi_resolution_downsample', 'MultiResolutionWriter',
+            'retrieve_all', 'RetrieveError', 'plan_hourly_requests', 
+            'valid_dates', 'DownloadManifest', 'run_pipeline', 
+            'ENCODING_PRESETS', 'build_encoding', 'reshape_reduce',
+            'DERIVED_VARIABLES', 'register_derived_variable', 'derived_reduce',
+            'Reducer', 'REDUCERS', 'register_reducer', 'resample_reduce',
+            'QuantileSketch', 'Quantile', 'subset_dataset', 'cds_area',
+            'ResultCache', 'ClimatologyStore', 'generate_era5',
+            'instrument', 'add_hook', 'remove_hook', 'StageTotals',
+            'JsonLinesWriter', 'ChromeTraceWriter', 'run_spec', 'PipelineError',
+            'FileCatalog', 'catalog_files', 'PrefetchReader',
+            'packed_resample', 'coarsen_dataset']
 from netcdf_time_downsample import *
 from download_ERA5_hourly import *
 from download_ERA5_monthly import *
+from streaming_resample import *
+from cds_retrieve import *
+from cds_request_plan import *
+from download_manifest import *
+from download_pipeline import *
+from netcdf_encoding import *
+from derived_variables import *
+from reducers import *
+from quantile_sketch import *
+from spatial_subset import *
+from result_cache import *
+from climatology_store import *
+from synthetic_era5 import *
+from instrumentation import *
+from pipeline_runner import *
+from file_catalog import *
+from prefetch_reader import *
+from packed_reduce import *
+from spatial_coarsen import *
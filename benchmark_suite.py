@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This script benchmarks the reduction paths of `time_downsample`,
+`aggregate_files` and `multi_resolution_downsample` on synthetic ERA5-like
+files (see synthetic_era5.py), so that it runs anywhere without CDS
+downloads.
+
+Each case runs in a fresh process, so that its peak resident memory (RSS)
+is measured on its own. For each case, the wall time, CPU time, files/s,
+MB/s of input and peak RSS are reported. The results are saved as JSON
+with the commit and library versions, and `compare_benchmarks` lists the
+cases that got slower or use more memory between two result files, e.g.:
+
+    python benchmark_suite.py --output new.json --compare old.json
+
+The reshape fast path used for regular time axes (`reshape_reduce`) is also
+timed against xarray's generic resample path on an in-memory array
+(`benchmark_reshape_reduce`).
+
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from netcdf_time_downsample import (_resample, aggregate_files, time_downsample,
+                                    multi_resolution_downsample)
+from synthetic_era5 import generate_era5
+
+# Variables, reductions and output resolution of the downsample cases
+VAR = ['u10', 'tp']
+OP = ['max', 'sum']
+TIME_RES = '1D'
+
+
+def _aggregate(input_dir, files, output_dir):
+    aggregate_files(input_dir, files, output_dir + 'aggregate.nc')
+
+
+def _aggregate_streaming(input_dir, files, output_dir):
+    aggregate_files(input_dir, files, output_dir + 'aggregate.nc',
+                    streaming = True)
+
+
+def _downsample(input_dir, files, output_dir):
+    time_downsample(input_dir, files, VAR, OP, TIME_RES, output_dir)
+
+
+def _downsample_coarsen(input_dir, files, output_dir):
+    time_downsample(input_dir, files, VAR, OP, TIME_RES, output_dir,
+                    coarsen = 4)
+
+
+def _downsample_lazy(input_dir, files, output_dir):
+    time_downsample(input_dir, files, VAR, OP, TIME_RES, output_dir,
+                    chunk_size = '64MiB')
+
+
+def _downsample_packed(input_dir, files, output_dir):
+    time_downsample(input_dir, files, VAR, OP, TIME_RES, output_dir,
+                    packed = True)
+
+
+def _downsample_parallel(input_dir, files, output_dir):
+    time_downsample(input_dir, files, VAR, OP, TIME_RES, output_dir,
+                    workers = 2)
+
+
+def _downsample_prefetch(input_dir, files, output_dir):
+    time_downsample(input_dir, files, VAR, OP, TIME_RES, output_dir,
+                    prefetch = 2)
+
+
+def _downsample_streaming(input_dir, files, output_dir):
+    time_downsample(input_dir, files, VAR, OP, TIME_RES, output_dir,
+                    streaming = True)
+
+
+def _downsample_wind_speed(input_dir, files, output_dir):
+    time_downsample(input_dir, files, [['u10', 'v10'], 'tp'], OP, TIME_RES,
+                    output_dir, wind_speed = True)
+
+
+def _multi_resolution(input_dir, files, output_dir):
+    multi_resolution_downsample(input_dir, files, VAR, OP, ['6h', '1D'],
+                                [output_dir, output_dir])
+
+
+# Benchmark cases: {name: function(input_dir, input_files, output_dir)}
+CASES = {
+    'aggregate': _aggregate,
+    'aggregate_streaming': _aggregate_streaming,
+    'downsample': _downsample,
+    'downsample_coarsen': _downsample_coarsen,
+    'downsample_lazy': _downsample_lazy,
+    'downsample_packed': _downsample_packed,
+    'downsample_parallel': _downsample_parallel,
+    'downsample_prefetch': _downsample_prefetch,
+    'downsample_streaming': _downsample_streaming,
+    'downsample_wind_speed': _downsample_wind_speed,
+    'multi_resolution': _multi_resolution,
+}
+
+
+def _peak_rss():
+    ''' Peak RSS in bytes of this process and of its finished children. '''
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _measure(name, input_dir, files, repeat, conn):
+    ''' Run a case `repeat` times (in a fresh process); send its timings. '''
+    try:
+        # Memory after the imports, before any data is read
+        baseline = _peak_rss()
+        wall, cpu = np.inf, np.inf
+        for _ in range(repeat):
+            output_dir = tempfile.mkdtemp(prefix = 'benchmark_') + os.sep
+            try:
+                start, start_cpu = time.perf_counter(), os.times()
+                CASES[name](input_dir, files, output_dir)
+                end, end_cpu = time.perf_counter(), os.times()
+            finally:
+                shutil.rmtree(output_dir, ignore_errors = True)
+            # CPU time includes worker processes
+            used = sum(end_cpu[:4]) - sum(start_cpu[:4])
+            if end - start < wall:
+                wall, cpu = end - start, used
+        conn.send({'wall_s': wall, 'cpu_s': cpu, 'peak_rss_bytes': _peak_rss(),
+                   'import_rss_bytes': baseline})
+    except Exception as e:
+        conn.send({'error': '{}: {}'.format(type(e).__name__, e)})
+    finally:
+        conn.close()
+
+
+def run_case(name, input_dir, files, repeat = 1):
+    '''
+    Run a benchmark case in a new process and return its timings: wall and
+    CPU time in seconds of the fastest run, files/s, MB/s of input, the
+    peak RSS in bytes (the largest of the process and its workers) and the
+    RSS after the imports.
+    '''
+    context = multiprocessing.get_context('spawn')
+    receive, send = context.Pipe(duplex = False)
+    process = context.Process(target = _measure,
+                              args = (name, input_dir, files, repeat, send))
+    process.start()
+    send.close()
+    try:
+        result = receive.recv()
+    except EOFError:
+        result = {'error': 'Process exited with code {}'.format(
+            process.exitcode)}
+    process.join()
+    if 'error' not in result:
+        size = sum(os.path.getsize(os.path.join(input_dir, f)) for f in files)
+        result['files_per_s'] = len(files) / result['wall_s']
+        result['mb_per_s'] = size / 1e6 / result['wall_s']
+    return result
+
+
+def benchmark_reshape_reduce(n_days = 31, nlat = 181, nlon = 360, time_res = '1D',
+                             ops = ('sum', 'max', 'mean'), repeat = 3):
+    '''
+    Time both resample paths for each reduction operation.
+
+    Parameters
+    ----------
+    n_days : int
+        Days of hourly data.
+    nlat, nlon : int
+        Grid size.
+    time_res : str
+        New time resolution in Pandas datetime syntax.
+    ops : list of strings
+        Reduction operations to time.
+    repeat : int
+        Number of runs of each path; the fastest is reported.
+
+    Returns
+    -------
+    dict of {op: {'fast': seconds, 'resample': seconds, 'speedup': ratio}}
+
+    '''
+    times = pd.date_range('2000-01-01', periods = 24 * n_days, freq = 'h')
+    rng = np.random.default_rng(0)
+    da = xr.DataArray(rng.standard_normal((len(times), nlat, nlon), dtype = 'f4'),
+                      dims = ('time', 'latitude', 'longitude'),
+                      coords = {'time': times,
+                                'latitude': np.linspace(90, -90, nlat),
+                                'longitude': np.linspace(0, 360, nlon,
+                                                         endpoint = False)})
+
+    results = {}
+    for op in ops:
+        timings = {}
+        for name, fast in (('fast', True), ('resample', False)):
+            best = np.inf
+            for _ in range(repeat):
+                start = time.perf_counter()
+                _resample(da, op, time_res, fast = fast)
+                best = min(best, time.perf_counter() - start)
+            timings[name] = best
+        timings['speedup'] = timings['resample'] / timings['fast']
+        results[op] = timings
+        print('{:5s} fast {:8.4f} s   resample {:8.4f} s   speedup {:6.1f}x'
+              .format(op, timings['fast'], timings['resample'],
+                      timings['speedup']))
+    return results
+
+
+def _environment():
+    ''' Commit, platform and library versions, to label a result file. '''
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd = here,
+                                capture_output = True, text = True,
+                                check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    versions = {}
+    for module in ('numpy', 'pandas', 'xarray', 'netCDF4', 'dask'):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return {'commit': commit, 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'versions': versions}
+
+
+def run_benchmarks(output_path = None, cases = None, n_days = 7, nlat = 181,
+                   nlon = 360, packed = True, chunks = None, repeat = 1,
+                   kernels = True, work_dir = None):
+    '''
+    Generate synthetic files and time each reduction path on them.
+
+    Parameters
+    ----------
+    output_path : str (optional)
+        JSON file for the results.
+    cases : list of strings (optional)
+        Names of the cases to run, from CASES. All by default.
+    n_days, nlat, nlon, packed, chunks :
+        Synthetic input: days of hourly data (one file per day), grid size,
+        int16 packing and netCDF chunking, see `generate_era5`.
+    repeat : int
+        Number of runs of each case; the fastest is reported.
+    kernels : boolean
+        Also time `reshape_reduce` against xarray resample in memory.
+    work_dir : str (optional)
+        Directory for the synthetic files; a temporary directory (removed
+        afterwards) by default.
+
+    Returns
+    -------
+    dict of {'environment': ..., 'config': ..., 'cases': {name: timings},
+             'reshape_reduce': ...}
+
+    '''
+    config = {'n_days': n_days, 'nlat': nlat, 'nlon': nlon, 'packed': packed,
+              'chunks': chunks, 'repeat': repeat, 'var': VAR, 'op': OP,
+              'time_res': TIME_RES}
+    results = {'environment': _environment(), 'config': config, 'cases': {}}
+
+    input_dir = work_dir or tempfile.mkdtemp(prefix = 'synthetic_era5_')
+    input_dir = os.path.join(input_dir, '')
+    try:
+        files = generate_era5(input_dir, n_days, nlat, nlon,
+                              var = ('u10', 'v10', 'tp'), packed = packed,
+                              chunks = chunks)
+        for name in cases or CASES:
+            result = run_case(name, input_dir, files, repeat)
+            results['cases'][name] = result
+            if 'error' in result:
+                print('{:22s} failed: {}'.format(name, result['error']))
+            else:
+                print('{:22s} {:8.2f} s  {:7.1f} files/s  {:8.1f} MB/s  '
+                      '{:8.1f} MiB peak'.format(name, result['wall_s'],
+                                               result['files_per_s'],
+                                               result['mb_per_s'],
+                                               result['peak_rss_bytes'] / 2**20))
+    finally:
+        if work_dir is None:
+            shutil.rmtree(input_dir, ignore_errors = True)
+
+    if kernels:
+        results['reshape_reduce'] = benchmark_reshape_reduce(n_days, nlat, nlon)
+
+    if output_path is not None:
+        with open(output_path, 'w') as f:
+            json.dump(results, f, indent = 2)
+    return results
+
+
+def compare_benchmarks(baseline, new, tolerance = 0.1):
+    '''
+    Cases of `new` that are slower or use more memory than in `baseline`
+    (result dicts or JSON file paths) by more than `tolerance` (a fraction).
+
+    Returns a list of (case, metric, baseline value, new value) tuples.
+    '''
+    if isinstance(baseline, str):
+        with open(baseline) as f:
+            baseline = json.load(f)
+    if isinstance(new, str):
+        with open(new) as f:
+            new = json.load(f)
+
+    regressions = []
+    for name, result in new['cases'].items():
+        old = baseline['cases'].get(name, {})
+        for metric in ('wall_s', 'peak_rss_bytes'):
+            if metric in old and metric in result and \
+                    result[metric] > old[metric] * (1 + tolerance):
+                regressions.append((name, metric, old[metric], result[metric]))
+                print('{:22s} {:15s} {:12.4g} -> {:12.4g} ({:+.0%})'.format(
+                    name, metric, old[metric], result[metric],
+                    result[metric] / old[metric] - 1))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the reduction '
+                                     'paths on synthetic ERA5-like files.')
+    parser.add_argument('--output', help = 'JSON file for the results')
+    parser.add_argument('--compare', help = 'JSON results to compare against')
+    parser.add_argument('--tolerance', type = float, default = 0.1)
+    parser.add_argument('--cases', nargs = '+', choices = sorted(CASES))
+    parser.add_argument('--days', type = int, default = 7)
+    parser.add_argument('--nlat', type = int, default = 181)
+    parser.add_argument('--nlon', type = int, default = 360)
+    parser.add_argument('--repeat', type = int, default = 1)
+    parser.add_argument('--unpacked', action = 'store_true')
+    parser.add_argument('--no-kernels', action = 'store_true')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.output, args.cases, args.days, args.nlat,
+                             args.nlon, packed = not args.unpacked,
+                             repeat = args.repeat,
+                             kernels = not args.no_kernels)
+    if args.compare:
+        regressions = compare_benchmarks(args.compare, results, args.tolerance)
+        sys.exit(1 if regressions else 0)
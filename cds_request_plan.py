@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains functions to plan CDS API retrievals of hourly ERA5 data.
+Invalid calendar dates (e.g. 02-31) are dropped, and the days of each month
+are grouped into the largest requests that stay under a size limit, counted
+in fields (days x hours x variables). Fewer, larger requests spend less time
+waiting in the CDS queue.
+
+The plan is a list of (dataset name, request dict, target file path) tuples,
+which `cds_retrieve.retrieve_all` executes.
+
+"""
+
+import datetime
+import itertools
+import os
+
+HOURS = ['{:02d}:00'.format(h) for h in range(24)]
+
+
+def valid_dates(years, months, days):
+    '''
+    Dates for every valid combination of the years, months and days, in time
+    order. Combinations that are not calendar dates (e.g. 2001-02-29) are
+    dropped.
+
+    Parameters
+    ----------
+    years, months, days : lists of strings
+        'YYYY', 'MM' and 'DD' strings, as passed to `download_ERA5_hourly`.
+
+    '''
+    dates = []
+    for year, month, day in itertools.product(years, months, days):
+        try:
+            dates.append(datetime.date(int(year), int(month), int(day)))
+        except ValueError:
+            continue
+    return sorted(set(dates))
+
+
+def dates_in_range(start_date, end_date):
+    ''' Every date from start_date to end_date (inclusive, 'YYYY-MM-DD'). '''
+    start = datetime.date.fromisoformat(str(start_date))
+    end = datetime.date.fromisoformat(str(end_date))
+    return [start + datetime.timedelta(days = n)
+            for n in range((end - start).days + 1)]
+
+
+def plan_hourly_requests(varnames, start_date, end_date, output_dir, area = None,
+                         max_fields = None, variable_groups = None,
+                         filename_suffix = None, dataset = 'reanalysis-era5-land',
+                         times = HOURS):
+    '''
+    Plan the retrievals for hourly data from start_date to end_date.
+
+    Parameters
+    ----------
+    varnames : list of strings
+        ERA5 variable names.
+    start_date, end_date : str
+        First and last day, in 'YYYY-MM-DD' format.
+    output_dir : str
+        Directory for the downloaded files.
+    area : list of 4 numbers (optional)
+        CDS 'area' sub-region as [north, west, south, east].
+    max_fields : int (optional)
+        Largest request size, in fields (days x hours x variables). Days of
+        the same month are grouped up to this limit. If a single day of every
+        variable is larger, the variables are split into groups. By default,
+        there is one request per day.
+    variable_groups : list of lists of strings (optional)
+        Variables to request together. Defaults to one group with every
+        variable (split further if needed to stay under max_fields).
+    filename_suffix : str (optional)
+        String to add to the end of each filename.
+    dataset : str
+        CDS dataset name.
+    times : list of strings
+        Hours to request on each day, 'HH:MM'.
+
+    Returns
+    -------
+    List of (dataset, request, target) tuples, in time order.
+
+    '''
+    return plan_requests_for_dates(varnames, dates_in_range(start_date, end_date),
+                                   output_dir, area, max_fields, variable_groups,
+                                   filename_suffix, dataset, times)
+
+
+def plan_requests_for_dates(varnames, dates, output_dir, area = None,
+                            max_fields = None, variable_groups = None,
+                            filename_suffix = None,
+                            dataset = 'reanalysis-era5-land', times = HOURS):
+    '''
+    Plan the retrievals for hourly data on the given dates (datetime.date
+    objects). See `plan_hourly_requests` for the other parameters.
+    '''
+    if variable_groups is None:
+        variable_groups = [list(varnames)]
+    if max_fields is not None:
+        # Split variable groups so that one day fits in a request
+        vars_per_request = max(1, max_fields // len(times))
+        variable_groups = [group[i:i + vars_per_request]
+                           for group in variable_groups
+                           for i in range(0, len(group), vars_per_request)]
+
+    fn_suffix = '' if filename_suffix is None else '_' + filename_suffix
+
+    plan = []
+    dates = sorted(dates)
+    for (year, month), month_dates in itertools.groupby(
+            dates, key = lambda d: (d.year, d.month)):
+        month_dates = list(month_dates)
+        for g, group in enumerate(variable_groups):
+            if max_fields is None:
+                days_per_request = 1
+            else:
+                days_per_request = max(1, max_fields // (len(times) * len(group)))
+            group_suffix = '' if len(variable_groups) == 1 else '_group{}'.format(g)
+
+            for i in range(0, len(month_dates), days_per_request):
+                request_dates = month_dates[i:i + days_per_request]
+                request = {
+                    'format': 'netcdf',
+                    'variable': list(group),
+                    'year': '{:04d}'.format(year),
+                    'month': '{:02d}'.format(month),
+                    'day': ['{:02d}'.format(d.day) for d in request_dates],
+                    'time': list(times),
+                }
+                if area is not None:
+                    request['area'] = list(area)
+
+                filename = '{}_ERA5_hourly{}{}.nc'.format(
+                    _date_span(request_dates), group_suffix, fn_suffix)
+                plan.append((dataset, request, os.path.join(output_dir, filename)))
+    return plan
+
+
+def request_fields(request):
+    ''' Number of fields (days x hours x variables) in a planned request. '''
+    return len(request['day']) * len(request['time']) * len(request['variable'])
+
+
+def _date_span(dates):
+    ''' 'YYYY-MM-DD' for one day, 'YYYY-MM' for a whole month, else first_last. '''
+    first, last = dates[0], dates[-1]
+    if first == last:
+        return first.isoformat()
+    next_day = last + datetime.timedelta(days = 1)
+    whole = len(dates) == (last - first).days + 1
+    if whole and first.day == 1 and next_day.month != last.month:
+        return first.strftime('%Y-%m')
+    return '{}_{}'.format(first.isoformat(), last.isoformat())
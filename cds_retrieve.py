@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains a function to run many CDS API retrievals concurrently,
+with a bounded number of requests in flight, exponential backoff on failed
+attempts and a per-request timeout. It is used by the ERA5 download functions.
+
+The client can be injected: any object with a cdsapi-style
+`retrieve(name, request, target)` method works, e.g. a fake client that serves
+local files for testing throughput and failure handling offline.
+
+"""
+
+import concurrent.futures
+import functools
+import glob
+import os
+import random
+import threading
+import time
+
+import cdsapi
+
+from download_manifest import request_key
+from instrumentation import stage, file_size
+
+class RetrieveError(RuntimeError):
+    '''
+    Raised by `retrieve_all` when some requests still failed after retrying.
+    The other requests are completed before this is raised.
+
+    failures: dict of {target filename: exception from the last attempt}
+    '''
+    def __init__(self, failures):
+        self.failures = failures
+        msg = '{} request(s) failed: {}'.format(
+            len(failures), ', '.join('{} ({!r})'.format(t, e)
+                                     for t, e in failures.items()))
+        super().__init__(msg)
+
+    def __reduce__(self):
+        # Picklable, e.g. when raised in a worker process
+        return (type(self), (self.failures,))
+
+
+def retrieve_all(requests, workers = 1, retries = 3, backoff = 10,
+                 max_backoff = 600, timeout = None, client = None, 
+                 manifest = None):
+    '''
+    Run CDS API retrievals, with up to `workers` requests in flight.
+
+    Parameters
+    ----------
+    requests : list of (name, request, target) tuples
+        CDS dataset name, request dict and output file path for each
+        retrieval.
+    workers : int
+        Number of requests in flight at the same time.
+    retries : int
+        Number of times a failed request is retried.
+    backoff : float
+        Seconds to wait before the first retry. The wait doubles for each
+        further retry (with random jitter), up to `max_backoff`.
+    max_backoff : float
+        Longest wait between two attempts, in seconds.
+    timeout : float (optional)
+        Seconds after which an attempt is abandoned and counted as failed.
+        The abandoned call cannot be cancelled: it runs on in the background
+        and its temporary file is removed when it returns, so it never
+        becomes the target.
+    client : object (optional)
+        Client with a cdsapi-style `retrieve(name, request, target)` method,
+        shared by all workers. By default each worker thread creates its own
+        `cdsapi.Client()`.
+    manifest : DownloadManifest (optional)
+        Requests recorded as complete in the manifest, with their file still
+        intact, are skipped. Each completed request is recorded.
+
+    Returns
+    -------
+    List of the target file paths, in request order. Each attempt writes to a
+    temporary file that is renamed to the target only when it completes.
+    RetrieveError is raised if any request failed on every attempt.
+
+    '''
+    local = threading.local()
+
+    def get_client():
+        if client is not None:
+            return client
+        if not hasattr(local, 'client'):
+            local.client = cdsapi.Client()
+        return local.client
+
+    def retrieve(name, request, target):
+        key = request_key(name, request)
+        if manifest is not None and manifest.is_complete(target, key):
+            return target
+        # Remove partial files left by an interrupted run
+        _remove_parts(target)
+
+        for attempt in range(retries + 1):
+            part = '{}.{}.part'.format(target, attempt)
+            try:
+                with stage('cds_retrieve', file = os.path.basename(target), 
+                           attempt = attempt) as s:
+                    _call_with_timeout(get_client().retrieve, 
+                                       (name, request, part), timeout,
+                                       on_abandon = functools.partial(
+                                           _remove_file, part))
+                    s.add(bytes_written = file_size(part), files = 1)
+                os.replace(part, target)
+                if manifest is not None:
+                    manifest.record(target, key)
+                return target
+            except Exception:
+                _remove_file(part)
+                if attempt == retries:
+                    raise
+                delay = min(max_backoff, backoff * 2 ** attempt)
+                with stage('cds_backoff', file = os.path.basename(target)):
+                    time.sleep(random.uniform(delay / 2, delay))
+
+    failures = {}
+    with stage('retrieve_all', requests = len(requests), workers = workers), \
+         concurrent.futures.ThreadPoolExecutor(max_workers = workers) as pool:
+        futures = {pool.submit(retrieve, *req): req[2] for req in requests}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as err:
+                failures[futures[future]] = err
+    # Remove what the failed attempts left behind (calls abandoned after a
+    # timeout also remove their own file once they return)
+    for req in requests:
+        _remove_parts(req[2])
+
+    if failures:
+        raise RetrieveError(failures)
+    return [req[2] for req in requests]
+
+
+def _remove_file(path):
+    ''' Remove a file if it exists. '''
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _remove_parts(target):
+    ''' Remove the temporary files of the attempts at a target. '''
+    for part in glob.glob(glob.escape(target) + '.*.part'):
+        _remove_file(part)
+
+
+def _call_with_timeout(fn, args, timeout, on_abandon = None):
+    '''
+    Call fn(*args), raising TimeoutError if it takes longer than `timeout`
+    seconds. The call is then abandoned: it is left to finish in a background
+    thread, which calls on_abandon() (if given) once it has returned, e.g. to
+    remove what it wrote.
+    '''
+    if timeout is None:
+        return fn(*args)
+
+    result = {}
+    lock = threading.Lock()
+    def run():
+        try:
+            result['value'] = fn(*args)
+        except BaseException as err:
+            result['error'] = err
+        with lock:
+            result['done'] = True
+            abandoned = result.get('abandoned', False)
+        if abandoned and on_abandon is not None:
+            on_abandon()
+
+    thread = threading.Thread(target = run, daemon = True)
+    thread.start()
+    thread.join(timeout)
+    with lock:
+        if not result.get('done'):
+            result['abandoned'] = True
+            raise TimeoutError('CDS request timed out after {} s'.format(
+                timeout))
+    if 'error' in result:
+        raise result['error']
+    return result.get('value')
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains a climatology store: per-pixel sufficient statistics of
+a variable over many years (sum, sum of squares, count, minimum, maximum),
+kept in one netCDF file. Years are added or removed one at a time, and the
+long-term mean, variance and extremes are computed from the totals, without
+reading the per-year files again.
+
+The sums are of the values minus a per-pixel shift (the first value added),
+so that the variance stays accurate when the mean is large compared to the
+spread. Each year's contribution is also stored, so that a year can be
+removed (e.g. replaced by a revised version) without its data, and so that
+the year of the minimum and maximum is known.
+
+"""
+import os
+
+import numpy as np
+import xarray as xr
+
+# Statistics kept for each year and as totals over the years
+_STATS = ('sum', 'sumsq', 'count', 'min', 'max')
+
+# Year of the extremes of pixels without any data
+_YEAR_FILL = np.iinfo(np.int32).min
+
+
+def _name(v, stat, year = False):
+    return '{}__{}{}'.format(v, 'year_' if year else '', stat)
+
+
+class ClimatologyStore:
+    '''
+    Per-pixel climatology of the variables of per-year data.
+
+    Parameters
+    ----------
+    path : str
+        netCDF file holding the store. It is read if it exists, and written
+        by `save`.
+
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.ds = xr.load_dataset(path) if os.path.exists(path) else None
+
+    @property
+    def years(self):
+        ''' Years in the store. '''
+        if self.ds is None:
+            return []
+        return [int(y) for y in self.ds['year'].values]
+
+    @property
+    def variables(self):
+        ''' Variables in the store. '''
+        if self.ds is None:
+            return []
+        return [name[:-len('__shift')] for name in self.ds.data_vars
+                if name.endswith('__shift')]
+
+    def add(self, ds, year = None, var = None, replace = False):
+        '''
+        Add one year of data.
+
+        Parameters
+        ----------
+        ds : xarray Dataset
+            Data of the year, with a 'time' dimension (e.g. one yearly value,
+            or every hour of the year).
+        year : int (optional)
+            Year of the data; by default the year of its first time step.
+        var : list of strings (optional)
+            Variables to add; by default those already in the store, or
+            every variable with a time dimension for a new store.
+        replace : boolean
+            Replace the year if it is already in the store, instead of
+            raising a ValueError.
+
+        '''
+        if year is None:
+            year = int(np.asarray(ds.time.values[0], dtype = 'datetime64[Y]')
+                       .astype(int) + 1970)
+        year = int(year)
+        if year in self.years:
+            if not replace:
+                raise ValueError('{} is already in the store'.format(year))
+            self.remove(year)
+        if var is None:
+            var = self.variables or [v for v in ds.data_vars
+                                     if 'time' in ds[v].dims]
+
+        if self.ds is None:
+            self.ds = self._new_store(ds, var)
+        contribution = self._contribution(ds, var).expand_dims(year = [year])
+
+        per_year = xr.concat([self._per_year(), contribution], dim = 'year')
+        totals = {}
+        for v in var:
+            new = contribution.isel(year = 0)
+            for stat in ('sum', 'sumsq', 'count'):
+                totals[_name(v, stat)] = self.ds[_name(v, stat)] + \
+                    new[_name(v, stat, True)]
+            totals[_name(v, 'min')] = np.fmin(self.ds[_name(v, 'min')],
+                                              new[_name(v, 'min', True)])
+            totals[_name(v, 'max')] = np.fmax(self.ds[_name(v, 'max')],
+                                              new[_name(v, 'max', True)])
+        self._update(per_year.sortby('year'), totals)
+        return self
+
+    def remove(self, year):
+        ''' Remove a year from the store. '''
+        if year not in self.years:
+            raise ValueError('{} is not in the store'.format(year))
+        per_year = self._per_year()
+        old = per_year.sel(year = year)
+        per_year = per_year.drop_sel(year = year)
+        totals = {}
+        for v in self.variables:
+            for stat in ('sum', 'sumsq', 'count'):
+                totals[_name(v, stat)] = self.ds[_name(v, stat)] - \
+                    old[_name(v, stat, True)]
+            # Extremes cannot be subtracted: take them from the other years
+            totals[_name(v, 'min')] = per_year[_name(v, 'min', True)].min('year')
+            totals[_name(v, 'max')] = per_year[_name(v, 'max', True)].max('year')
+        self._update(per_year, totals)
+        return self
+
+    def mean(self):
+        ''' Long-term mean of each variable. '''
+        out = xr.Dataset()
+        for v in self.variables:
+            count = self.ds[_name(v, 'count')]
+            out[v] = (self.ds[_name(v, 'shift')] +
+                      self.ds[_name(v, 'sum')] / count).where(count > 0)
+            out[v].attrs = self.ds[_name(v, 'shift')].attrs
+        return out
+
+    def variance(self, ddof = 0):
+        ''' Long-term variance of each variable (ddof: delta degrees of freedom). '''
+        out = xr.Dataset()
+        for v in self.variables:
+            count = self.ds[_name(v, 'count')]
+            total = self.ds[_name(v, 'sum')]
+            m2 = (self.ds[_name(v, 'sumsq')] - total * total / count).clip(min = 0)
+            out[v] = (m2 / (count - ddof)).where(count > ddof)
+        return out
+
+    def std(self, ddof = 0):
+        ''' Long-term standard deviation of each variable. '''
+        return np.sqrt(self.variance(ddof))
+
+    def minimum(self):
+        ''' Smallest value of each variable over all years. '''
+        return self._extreme('min')
+
+    def maximum(self):
+        ''' Largest value of each variable over all years. '''
+        return self._extreme('max')
+
+    def year_of(self, stat):
+        '''
+        Year of the minimum ('min') or maximum ('max') of each pixel, as 
+        int32. Pixels without data in any year are set to _YEAR_FILL, which
+        is also their _FillValue (so they are masked when written).
+        '''
+        out = xr.Dataset()
+        years = self.ds['year'].values.astype(np.int32)
+        for v in self.variables:
+            da = self.ds[_name(v, stat, True)]
+            filled = da.fillna(np.inf if stat == 'min' else -np.inf)
+            index = filled.argmin('year') if stat == 'min' else \
+                filled.argmax('year')
+            year = index.copy(data = years[index.values])
+            out[v] = year.where(da.notnull().any('year'), _YEAR_FILL)
+            out[v].encoding['_FillValue'] = _YEAR_FILL
+        return out
+
+    def summary(self, ddof = 0):
+        ''' Dataset with the mean, std, min, max and count of each variable. '''
+        mean, std = self.mean(), self.std(ddof)
+        minimum, maximum = self.minimum(), self.maximum()
+        out = xr.Dataset()
+        for v in self.variables:
+            out[v + '_mean'] = mean[v]
+            out[v + '_std'] = std[v]
+            out[v + '_min'] = minimum[v]
+            out[v + '_max'] = maximum[v]
+            out[v + '_count'] = self.ds[_name(v, 'count')]
+        return out
+
+    def save(self):
+        ''' Write the store to its file. '''
+        tmp = self.path + '.part'
+        encoding = {name: {'zlib': True} for name in self.ds.data_vars}
+        self.ds.to_netcdf(tmp, mode = 'w', format = 'NETCDF4',
+                          encoding = encoding)
+        os.replace(tmp, self.path)
+        return self.path
+
+    def _extreme(self, stat):
+        out = xr.Dataset()
+        for v in self.variables:
+            out[v] = self.ds[_name(v, stat)]
+            out[v].attrs = self.ds[_name(v, 'shift')].attrs
+        return out
+
+    def _new_store(self, ds, var):
+        ''' Empty store, with the shift taken from the first time step. '''
+        store = xr.Dataset(coords = {'year': np.array([], dtype = int)})
+        for v in var:
+            da = ds[v]
+            first = da.isel(time = 0, drop = True)
+            # Pixels missing at the first time step fall back to their mean
+            shift = first.fillna(da.mean('time')).fillna(0).astype('f8')
+            shift.attrs = da.attrs
+            store[_name(v, 'shift')] = shift
+            zeros = xr.zeros_like(shift)
+            store[_name(v, 'sum')] = zeros
+            store[_name(v, 'sumsq')] = zeros
+            store[_name(v, 'count')] = zeros.astype('i8')
+            store[_name(v, 'min')] = zeros + np.nan
+            store[_name(v, 'max')] = zeros + np.nan
+            for stat in _STATS:
+                template = store[_name(v, stat)]
+                store[_name(v, stat, True)] = template.expand_dims(
+                    year = 0).copy()
+        return store
+
+    def _contribution(self, ds, var):
+        ''' Statistics of one year of data, as per-year variables. '''
+        out = xr.Dataset()
+        for v in var:
+            da = ds[v].astype('f8')
+            d = da - self.ds[_name(v, 'shift')]
+            out[_name(v, 'sum', True)] = d.sum('time')
+            out[_name(v, 'sumsq', True)] = (d * d).sum('time')
+            out[_name(v, 'count', True)] = d.count('time').astype('i8')
+            out[_name(v, 'min', True)] = da.min('time')
+            out[_name(v, 'max', True)] = da.max('time')
+        return out.drop_vars([c for c in out.coords if c not in out.dims and
+                              c not in self.ds.coords])
+
+    def _per_year(self):
+        names = [n for n in self.ds.data_vars if '__year_' in n]
+        return self.ds[names]
+
+    def _update(self, per_year, totals):
+        ds = self.ds.drop_vars(list(self._per_year().data_vars) + ['year'])
+        for name, da in totals.items():
+            ds[name] = da
+        self.ds = xr.merge([ds, per_year], join = 'outer',
+                           combine_attrs = 'override')
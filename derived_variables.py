@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains a registry of variables derived from ERA5 variables (wind
+speed, wind direction, gust factor, relative humidity) and a reduction that
+evaluates a derived variable a block of time steps at a time, fused with the
+time resample that follows. For example, the daily maximum wind speed is
+computed without ever holding the hourly wind speed field of a whole file:
+only one block of u, v and wind speed is in memory at a time.
+
+Each derived variable function takes the input arrays and an optional `out`
+array of the same shape, which is filled and returned, so that one buffer can
+be reused for every block.
+
+"""
+import numpy as np
+import xarray as xr
+
+from reducers import reduce_blocks
+
+
+def wind_speed(u, v, out = None):
+    ''' Wind speed from the u and v wind components. '''
+    return np.hypot(u, v, out = out)
+
+
+def wind_direction(u, v, out = None):
+    '''
+    Direction the wind blows from, in degrees clockwise from north, from the
+    u and v wind components.
+    '''
+    out = np.arctan2(u, v, out = out)
+    np.degrees(out, out = out)
+    out += 180
+    return np.mod(out, 360, out = out)
+
+
+def gust_factor(gust, u, v, out = None):
+    ''' Ratio of the wind gust to the wind speed from u and v. '''
+    out = np.hypot(u, v, out = out)
+    return np.divide(gust, out, out = out)
+
+
+def relative_humidity(t, td, out = None):
+    '''
+    Relative humidity (%) from temperature and dewpoint temperature (K), with
+    the Magnus formula over water (Alduchov and Eskridge, 1996).
+    '''
+    a, b = 17.625, 243.04
+    out = np.subtract(td, 273.15, out = out)
+    np.divide(a * out, b + out, out = out)
+    tc = np.subtract(t, 273.15)
+    out -= a * tc / (b + tc)
+    np.exp(out, out = out)
+    out *= 100
+    return out
+
+
+# Registry of derived variables: the function computing each one from its
+# inputs, the number of inputs, and the attributes of the output variable.
+DERIVED_VARIABLES = {
+    'wind_speed': {'function': wind_speed, 'n_inputs': 2,
+                   'attrs': {'units': 'm s**-1', 'long_name': 'wind speed'}},
+    'wind_direction': {'function': wind_direction, 'n_inputs': 2,
+                       'attrs': {'units': 'degrees',
+                                 'long_name': 'wind direction (from)'}},
+    'gust_factor': {'function': gust_factor, 'n_inputs': 3,
+                    'attrs': {'units': '1', 'long_name': 'gust factor'}},
+    'relative_humidity': {'function': relative_humidity, 'n_inputs': 2,
+                          'attrs': {'units': '%',
+                                    'long_name': 'relative humidity'}},
+}
+
+
+def register_derived_variable(kind, function, n_inputs, attrs = None):
+    '''
+    Add a derived variable to the registry.
+
+    Parameters
+    ----------
+    kind : str
+        Name used to refer to the derived variable.
+    function : function
+        function(*inputs, out = None) computing the variable from NumPy arrays
+        of the same shape. It should fill and return `out` if it is given.
+    n_inputs : int
+        Number of input variables.
+    attrs : dict (optional)
+        Attributes of the output variable (e.g. units, long_name).
+
+    '''
+    DERIVED_VARIABLES[kind] = {'function': function, 'n_inputs': n_inputs,
+                               'attrs': attrs or {}}
+
+
+def _lookup(kind, inputs):
+    if kind not in DERIVED_VARIABLES:
+        raise ValueError('Unknown derived variable: {}'.format(kind))
+    entry = DERIVED_VARIABLES[kind]
+    if len(inputs) != entry['n_inputs']:
+        raise ValueError('{} needs {} input variables, got {}'
+                         .format(kind, entry['n_inputs'], len(inputs)))
+    return entry
+
+
+def derived_array(ds, kind, inputs):
+    '''
+    Derived variable as a DataArray, computed chunk by chunk if the inputs
+    are dask arrays.
+    '''
+    entry = _lookup(kind, inputs)
+    arrays = [ds[name] for name in inputs]
+    dtype = np.result_type(*[a.dtype for a in arrays], np.float32)
+    da = xr.apply_ufunc(entry['function'], *arrays,
+                        dask = 'parallelized', output_dtypes = [dtype])
+    da.attrs = dict(entry['attrs'])
+    return da
+
+
+def derived_reader(ds, kind, inputs):
+    '''
+    Function read(start, end) evaluating a derived variable for time steps
+    start to end of a Dataset, as a NumPy array shaped like its first input.
+    Only the inputs' block is read, and one output buffer is reused for
+    every block (a block's values are overwritten by the next read).
+    '''
+    function = _lookup(kind, inputs)['function']
+    das = [ds[name] for name in inputs]
+    buffer = []
+
+    def read(start, end):
+        block = [da.isel(time = slice(start, end)).values for da in das]
+        if not buffer or buffer[0].shape != block[0].shape:
+            buffer[:] = [np.empty(block[0].shape,
+                                  dtype = np.result_type(*block, np.float32))]
+        return function(*block, out = buffer[0])
+    return read
+
+
+def derived_attrs(kind):
+    ''' Attributes of a derived variable (e.g. units). '''
+    if kind not in DERIVED_VARIABLES:
+        raise ValueError('Unknown derived variable: {}'.format(kind))
+    return dict(DERIVED_VARIABLES[kind]['attrs'])
+
+
+def derived_reduce(ds, kind, inputs, op, time_res, block_steps = 24):
+    '''
+    Resample a derived variable by time without computing it for the whole
+    Dataset at once.
+
+    Parameters
+    ----------
+    ds : xarray Dataset
+        Dataset with the input variables, which are read a block at a time.
+    kind : str
+        Derived variable name in DERIVED_VARIABLES.
+    inputs : list of strings
+        Input variable names, in the order the function expects them.
+    op : str or Reducer, or a list of them
+        Reduction operation(s), see `reducers.REDUCERS`. Several operations
+        are computed from the same evaluation of each block.
+    time_res : str
+        New time resolution in Pandas datetime syntax.
+    block_steps : int
+        Largest number of time steps evaluated at once.
+
+    Returns
+    -------
+    DataArray with the same result as resampling the derived variable (a 
+    list of DataArrays if op is a list).
+
+    '''
+    entry = _lookup(kind, inputs)
+    read = derived_reader(ds, kind, inputs)
+    ops = op if isinstance(op, (list, tuple)) else [op]
+    out = reduce_blocks(read, ds[inputs[0]], ops, time_res, block_steps)
+    for da in out:
+        da.name = None
+        da.attrs = dict(entry['attrs'])
+    return out if isinstance(op, (list, tuple)) else out[0]
@@ -15,13 +15,20 @@ https://confluence.ecmwf.int/display/CKB/How+to+download+ERA5#HowtodownloadERA5-
 
 """
 
-import cdsapi
 import os
+from cds_request_plan import valid_dates, plan_requests_for_dates
+from cds_retrieve import retrieve_all
+from download_manifest import DownloadManifest
+from spatial_subset import cds_area
 
-def download_ERA5_hourly(varnames, years, months, days, output_dir, filename_suffix = None):
+def download_ERA5_hourly(varnames, years, months, days, output_dir, filename_suffix = None,
+                         workers = 1, retries = 3, timeout = None, client = None,
+                         max_fields = None, resume = True, verify = 'size',
+                         region = None):
     '''
     This script downloads ERA5 hourly data, with one file with 24 hours of data
-    for each day.
+    for each day (or for each group of days, see max_fields). Dates that do
+    not exist (e.g. 02-31) are skipped.
 
     Parameters
     ----------
@@ -38,44 +45,47 @@ def download_ERA5_hourly(varnames, years, months, days, output_dir, filename_suf
         filepath for output files
     filename_suffix: str (optional)
         optional string to add to the end of filename (e.g. describing variables)
+    workers : int (optional)
+        Number of CDS requests in flight at the same time.
+    retries : int (optional)
+        Number of times a failed request is retried, with exponential backoff.
+    timeout : float (optional)
+        Seconds after which a request attempt is abandoned and retried.
+    client : object (optional)
+        Client with a cdsapi-style `retrieve(name, request, target)` method
+        (e.g. a fake client for offline testing). Defaults to cdsapi.Client().
+    max_fields : int (optional)
+        Group the days of each month into requests of up to this many fields
+        (days x hours x variables), with one file per request, see
+        `cds_request_plan.plan_hourly_requests`. By default there is one 
+        request per day.
+    resume : boolean (optional)
+        Keep a manifest of completed downloads in the output directory and 
+        skip requests whose file was already downloaded and is intact. Files 
+        are written to a temporary name and renamed only when complete.
+    verify : str (optional)
+        'size' (default) or 'checksum': how files in the manifest are checked 
+        before being skipped.
+    region : list or dict (optional)
+        Download only this region: a bounding box [north, west, south, east]
+        or a mask, see `spatial_subset`. It is sent as the CDS 'area'.
 
     Returns
     -------
     ERA5 hourly data, with one file for each day, saved to the output directory.
+    The list of downloaded file paths, in time order, is returned.
 
     '''
-    os.chdir(output_dir)
-    c = cdsapi.Client()
+    dates = valid_dates(years, months, days)
+    requests = plan_requests_for_dates(varnames, dates, output_dir, 
+                                       area = cds_area(region),
+                                       max_fields = max_fields, 
+                                       filename_suffix = filename_suffix)
     
-    # File naming
-    if filename_suffix == None:
-        fn_suffix = ''
-    else:
-        fn_suffix = '_' + filename_suffix
-    
-    for year in years:
-        for month in months:
-            for day in days:
-                c.retrieve(
-                    'reanalysis-era5-land',
-                    {
-                        'format': 'netcdf',
-                        'time': [
-                            '00:00', '01:00', '02:00',
-                            '03:00', '04:00', '05:00',
-                            '06:00', '07:00', '08:00',
-                            '09:00', '10:00', '11:00',
-                            '12:00', '13:00', '14:00',
-                            '15:00', '16:00', '17:00',
-                            '18:00', '19:00', '20:00',
-                            '21:00', '22:00', '23:00',
-                        ],
-                        'day': day,
-                        
-                        'month': month,
-                        
-                        'year': year,
-                        
-                    'variable': varnames
-                    },
-                    '{}-{}-{}_ERA5_hourly{}.nc'.format(year, month, day, fn_suffix))
\ No newline at end of file
+    manifest = DownloadManifest.for_directory(output_dir, verify) if resume else None
+    try:
+        return retrieve_all(requests, workers = workers, retries = retries, 
+                     timeout = timeout, client = client, manifest = manifest)
+    finally:
+        if manifest is not None:
+            manifest.close()
@@ -15,10 +15,14 @@ https://confluence.ecmwf.int/display/CKB/How+to+download+ERA5#HowtodownloadERA5-
 
 """
 
-import cdsapi
 import os
+from cds_retrieve import retrieve_all
+from download_manifest import DownloadManifest
+from spatial_subset import cds_area
 
-def download_ERA5_monthly(varnames, years, output_dir, filename_suffix = None):
+def download_ERA5_monthly(varnames, years, output_dir, filename_suffix = None,
+                          workers = 1, retries = 3, timeout = None, client = None,
+                          resume = True, verify = 'size', region = None):
     '''
     This script downloads ERA5 monthly data, with one file for each year.
 
@@ -33,18 +37,24 @@ def download_ERA5_monthly(varnames, years, output_dir, filename_suffix = None):
         filepath for output files
     filename_suffix: str (optional)
         optional string to add to the end of filename (e.g. describing variables)
+    workers, retries, timeout, client : optional
+        Concurrency, retry and client settings, see `download_ERA5_hourly`.
+    resume, verify : optional
+        Skip downloads already recorded in the output directory's manifest,
+        see `download_ERA5_hourly`.
+    region : list or dict (optional)
+        Download only this region, see `download_ERA5_hourly`.
 
     Returns
     -------
     ERA5 downloads, with one file for each year, saved to the output directory.
 
     '''
-    os.chdir(output_dir)
-    c = cdsapi.Client()
-    
+    area = cds_area(region)
+    requests = []
     for year in years:
 
-        c.retrieve(
+        requests.append((
             'reanalysis-era5-single-levels-monthly-means',
             {
                 'format': 'netcdf',
@@ -61,4 +71,14 @@ def download_ERA5_monthly(varnames, years, output_dir, filename_suffix = None):
                 ],
                 'time': '00:00',
             },
-           '{}_ERA5_monthly_{}.nc'.format(year, filename_suffix))
\ No newline at end of file
+           os.path.join(output_dir, '{}_ERA5_monthly_{}.nc'.format(year, filename_suffix))))
+        if area is not None:
+            requests[-1][1]['area'] = area
+
+    manifest = DownloadManifest.for_directory(output_dir, verify) if resume else None
+    try:
+        retrieve_all(requests, workers = workers, retries = retries, 
+                     timeout = timeout, client = client, manifest = manifest)
+    finally:
+        if manifest is not None:
+            manifest.close()
\ No newline at end of file
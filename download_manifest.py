@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains a manifest of completed downloads, kept as a sqlite file in
+the download directory. Each completed request is recorded with its target
+file, size and SHA-256 checksum, so that a rerun of a download function can
+skip every request whose file is still there and intact.
+
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+MANIFEST_NAME = '.era5_download_manifest.sqlite'
+
+
+def request_key(name, request):
+    ''' Stable key for a CDS request (dataset name and request dict). '''
+    text = json.dumps([name, request], sort_keys = True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def file_checksum(path, block_size = 1 << 20):
+    ''' SHA-256 checksum of a file, as a hex string. '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DownloadManifest:
+    '''
+    Record of completed downloads, stored in a sqlite file. Safe to share
+    between threads.
+
+    Parameters
+    ----------
+    path : str
+        Path of the sqlite file. Created if it does not exist.
+    verify : str ('size' or 'checksum')
+        How `is_complete` checks that a recorded file is intact: by comparing
+        its size (fast), or its size and SHA-256 checksum (reads the file).
+
+    '''
+    def __init__(self, path, verify = 'size'):
+        if verify not in ('size', 'checksum'):
+            raise ValueError('verify must be "size" or "checksum"')
+        self.path = path
+        self.verify = verify
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread = False)
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS downloads ('
+                               'target TEXT PRIMARY KEY, request_key TEXT, '
+                               'size INTEGER, sha256 TEXT, completed REAL)')
+
+    @classmethod
+    def for_directory(cls, output_dir, verify = 'size'):
+        ''' The manifest kept in a download directory. '''
+        return cls(os.path.join(output_dir, MANIFEST_NAME), verify)
+
+    def is_complete(self, target, key = None):
+        '''
+        True if the target was recorded as downloaded (for the request `key`,
+        if given) and the file on disk still matches the record.
+        '''
+        with self._lock:
+            row = self._conn.execute('SELECT request_key, size, sha256 FROM '
+                                     'downloads WHERE target = ?',
+                                     (os.path.abspath(target),)).fetchone()
+        if row is None:
+            return False
+        recorded_key, size, checksum = row
+        if key is not None and key != recorded_key:
+            return False
+        if not os.path.isfile(target) or os.path.getsize(target) != size:
+            return False
+        if self.verify == 'checksum' and file_checksum(target) != checksum:
+            return False
+        return True
+
+    def record(self, target, key = None):
+        ''' Record a completed download of target. '''
+        size = os.path.getsize(target)
+        checksum = file_checksum(target)
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO downloads VALUES '
+                               '(?, ?, ?, ?, ?)',
+                               (os.path.abspath(target), key, size, checksum,
+                                time.time()))
+
+    def forget(self, target):
+        ''' Remove the record for target. '''
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM downloads WHERE target = ?',
+                               (os.path.abspath(target),))
+
+    def close(self):
+        self._conn.close()
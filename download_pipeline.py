@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains a producer-consumer pipeline that downloads the next 
+period of data while the current one is being reduced. The two stages are 
+connected by a bounded queue, and a disk-space budget for the raw downloads 
+makes the downloader wait until enough consumed files have been deleted. The
+total run time is then close to the longer of the download and the reduction 
+time, instead of their sum.
+
+"""
+
+import os
+import queue
+import threading
+
+_DONE = object()
+
+
+class _DiskBudget:
+    ''' Bytes of raw files on disk that have not been consumed yet. '''
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.last = 0
+        self._cond = threading.Condition()
+
+    def wait(self, stop):
+        '''
+        Block until another download (assumed to be as large as the last one)
+        fits in the budget. Always lets a download start when nothing is 
+        pending, so a budget smaller than one download cannot deadlock.
+        '''
+        if self.limit is None:
+            return
+        with self._cond:
+            while (self.used > 0 and self.used + self.last > self.limit 
+                   and not stop.is_set()):
+                self._cond.wait(timeout = 1)
+
+    def add(self, nbytes):
+        with self._cond:
+            self.used += nbytes
+            self.last = nbytes
+
+    def release(self, nbytes):
+        with self._cond:
+            self.used -= nbytes
+            self._cond.notify_all()
+
+
+def run_pipeline(tasks, download, reduce, queue_size = 1, disk_budget = None,
+                 delete = True):
+    '''
+    Download and reduce a sequence of tasks (e.g. (year, month) pairs), with
+    the download of later tasks overlapping the reduction of earlier ones.
+
+    Parameters
+    ----------
+    tasks : list
+        Work items, in the order they should be reduced.
+    download : function
+        download(task) downloads the raw data for a task and returns the list
+        of downloaded file paths. Runs on a background thread.
+    reduce : function
+        reduce(task, files) consumes the downloaded files. Runs on the calling
+        thread, in task order.
+    queue_size : int
+        Number of downloaded tasks that can wait to be reduced.
+    disk_budget : int (optional)
+        Largest number of bytes of raw, not yet reduced files on disk. The 
+        downloader waits before starting a task that would exceed it.
+    delete : boolean
+        Delete the raw files of each task as soon as it has been reduced.
+
+    Returns
+    -------
+    None. An exception from either stage stops the pipeline and is raised.
+
+    '''
+    ready = queue.Queue(maxsize = queue_size)
+    budget = _DiskBudget(disk_budget)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up if the consumer stopped, rather than block forever
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout = 1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for task in tasks:
+                budget.wait(stop)
+                if stop.is_set():
+                    return
+                files = download(task)
+                budget.add(sum(os.path.getsize(f) for f in files))
+                put((task, files, None))
+        except BaseException as err:
+            put((None, None, err))
+            return
+        put(_DONE)
+
+    producer = threading.Thread(target = produce, daemon = True)
+    producer.start()
+    try:
+        while True:
+            item = ready.get()
+            if item is _DONE:
+                break
+            task, files, err = item
+            if err is not None:
+                raise err
+            reduce(task, files)
+            nbytes = sum(os.path.getsize(f) for f in files)
+            if delete:
+                for f in files:
+                    os.remove(f)
+            budget.release(nbytes)
+    finally:
+        stop.set()
+    producer.join()
@@ -48,7 +48,9 @@ def downsample_hourly():
                         '2020_wind_extremes/Data/ERA5/unaggregated/'
 
 
-    download_ERA5_hourly(varnames, years, months, days, output_dir = ERA5_download_dir)
+    # One request (and one file) per month
+    download_ERA5_hourly(varnames, years, months, days, output_dir = ERA5_download_dir,
+                         max_fields = 31 * 24 * len(varnames))
 
     var_lst = [['u10', 'v10'], 'tp']
     op_lst = ['max', 'sum']
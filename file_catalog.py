@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains a catalog of the netCDF files in a directory, kept as a
+sqlite file next to them, so that input files are found from their time
+contents rather than from their names.
+
+For each file, the catalog records its time range (first and last time
+step), number of time steps and step, its variables with their dimensions,
+dtype and encoding attributes, and its latitude/longitude grid. These are
+read from the file headers and time axis only (no data is read), and
+only for files that are new or changed since the last update (by size and
+modification time), so planning a run over decades of daily files takes a
+few milliseconds once the catalog is built.
+
+`query` returns the files of a time range in time order. Files overlapping
+each other in time, and files only partly inside the range, raise a
+ValueError, so that consecutive ranges never miss or double count a time
+step; so do files without the requested variables whose time steps no other
+file holds. `time_downsample` and `aggregate_files` accept a `time_range` in
+place of the file list.
+
+"""
+import json
+import os
+import sqlite3
+import threading
+
+import netCDF4
+import numpy as np
+
+from spatial_subset import LAT_NAMES, LON_NAMES
+
+CATALOG_NAME = '.era5_file_catalog.sqlite'
+
+# Attributes that determine how a variable's values are encoded on disk
+_ENCODING_ATTRS = ('scale_factor', 'add_offset', '_FillValue', 'missing_value',
+                   'units')
+
+
+def _datetime64(value):
+    ''' np.datetime64 in nanoseconds (from a string, date or datetime64). '''
+    return np.datetime64(value, 'ns')
+
+
+def file_metadata(path, dim = 'time'):
+    '''
+    Metadata of a netCDF file, from its header and time axis: time range
+    (first and last time step, in ns since the epoch), number of time steps,
+    step in ns (None if irregular), variables and grid.
+    '''
+    with netCDF4.Dataset(path) as nc:
+        # Files without a time axis (e.g. a land-sea mask) have no time range
+        n, ns, step = 0, [], None
+        if dim in nc.variables:
+            times = nc.variables[dim]
+            n = len(times)
+            dates = netCDF4.num2date(times[:], times.units,
+                                     getattr(times, 'calendar', 'standard'),
+                                     only_use_cftime_datetimes = False,
+                                     only_use_python_datetimes = True)
+            ns = np.array(dates, dtype = 'datetime64[ns]').astype('i8')
+            diffs = np.diff(ns)
+            if n > 1 and (diffs == diffs[0]).all():
+                step = int(diffs[0])
+
+        variables = {}
+        for name, var in nc.variables.items():
+            if name in nc.dimensions:
+                continue
+            variables[name] = {'dims': list(var.dimensions),
+                               'dtype': str(var.dtype)}
+            variables[name].update({a: np.asarray(var.getncattr(a)).tolist()
+                                    for a in _ENCODING_ATTRS
+                                    if a in var.ncattrs()})
+        grid = {}
+        for names in (LAT_NAMES, LON_NAMES):
+            for name in names:
+                if name in nc.variables:
+                    coord = nc.variables[name][:]
+                    grid[name] = [float(coord[0]), float(coord[-1]), len(coord)]
+                    break
+
+    return {'first': int(ns[0]) if n else None,
+            'last': int(ns[-1]) if n else None,
+            'n_times': n, 'step': step, 'variables': variables, 'grid': grid}
+
+
+class FileCatalog:
+    '''
+    Catalog of the netCDF files in a directory, stored in a sqlite file.
+    Safe to share between threads.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the netCDF files.
+    path : str (optional)
+        Path of the sqlite file; CATALOG_NAME in the directory by default.
+    dim : str
+        Name of the time dimension.
+
+    '''
+    def __init__(self, directory, path = None, dim = 'time'):
+        self.directory = directory
+        self.dim = dim
+        self.path = path or os.path.join(directory, CATALOG_NAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread = False)
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                               'name TEXT PRIMARY KEY, size INTEGER, '
+                               'mtime INTEGER, first INTEGER, last INTEGER, '
+                               'n_times INTEGER, step INTEGER, '
+                               'variables TEXT, grid TEXT)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS files_time ON '
+                               'files (first, last)')
+
+    def update(self):
+        '''
+        Add the new and changed files of the directory to the catalog and
+        remove the files that are gone. Returns the names of the files read.
+        '''
+        with self._lock:
+            known = {name: (size, mtime) for name, size, mtime in
+                     self._conn.execute('SELECT name, size, mtime FROM files')}
+        on_disk = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.nc') and entry.is_file():
+                    st = entry.stat()
+                    on_disk[entry.name] = (st.st_size, st.st_mtime_ns)
+
+        changed = [name for name, key in on_disk.items()
+                   if known.get(name) != key]
+        rows = []
+        for name in changed:
+            meta = file_metadata(os.path.join(self.directory, name), self.dim)
+            rows.append((name,) + on_disk[name] +
+                        (meta['first'], meta['last'], meta['n_times'],
+                         meta['step'], json.dumps(meta['variables']),
+                         json.dumps(meta['grid'])))
+        gone = [(name,) for name in known if name not in on_disk]
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO files VALUES '
+                                   '(?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self._conn.executemany('DELETE FROM files WHERE name = ?', gone)
+        return sorted(changed)
+
+    def query(self, time_range = None, variables = None, partial = False):
+        '''
+        Names of the files holding the time steps in a time range, in time
+        order.
+
+        Parameters
+        ----------
+        time_range : (start, end) (optional)
+            Start (included) and end (excluded) as strings or datetimes,
+            e.g. ('2000-01-01', '2001-01-01') or ('2000', '2001'). Either
+            may be None for an open end. All the files by default.
+        variables : list of strings (optional)
+            Only files holding all these variables. Files without them are
+            skipped if other files in the range hold their time steps (e.g.
+            one file per variable), else they are a gap in the data.
+        partial : boolean
+            Also select the files only partly inside the range, so that a
+            file crossing an end of the range belongs to both ranges (e.g.
+            monthly partitions, each keeping its own time steps of the file).
+
+        Raises ValueError if a file is only partly inside the range (unless
+        partial is True), if two of the files overlap in time, or if a file
+        without the variables leaves a gap.
+        '''
+        start, end = (None, None) if time_range is None else time_range
+        lo = None if start is None else int(_datetime64(start).astype('i8'))
+        hi = None if end is None else int(_datetime64(end).astype('i8'))
+        sql = 'SELECT name, first, last, variables FROM files WHERE ' \
+            'first IS NOT NULL'
+        args = []
+        if lo is not None:
+            sql += ' AND last >= ?'
+            args.append(lo)
+        if hi is not None:
+            sql += ' AND first < ?'
+            args.append(hi)
+        with self._lock:
+            rows = self._conn.execute(sql + ' ORDER BY first, name',
+                                      args).fetchall()
+
+        files = []
+        spans = []
+        skipped = []
+        previous = None
+        for name, first, last, names in rows:
+            missing = [] if variables is None else \
+                sorted(set(variables) - set(json.loads(names)))
+            if missing:
+                skipped.append((name, first, last, missing))
+                continue
+            if not partial and ((lo is not None and first < lo) or 
+                                (hi is not None and last >= hi)):
+                raise ValueError('{} is only partly inside the time range {}'
+                                 .format(name, list(time_range)))
+            if previous is not None and first <= previous[1]:
+                raise ValueError('{} and {} overlap in time'
+                                 .format(previous[0], name))
+            previous = (name, last)
+            files.append(name)
+            spans.append((first, last))
+
+        for name, first, last, missing in skipped:
+            if not any(f <= last and first <= l for f, l in spans):
+                raise ValueError('{} does not hold {}, and no other file holds '
+                                 'its time steps'.format(name, missing))
+        return files
+
+    def metadata(self, name):
+        ''' Recorded metadata of a file (see `file_metadata`), or None. '''
+        with self._lock:
+            row = self._conn.execute('SELECT first, last, n_times, step, '
+                                     'variables, grid FROM files WHERE '
+                                     'name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        return {'first': row[0], 'last': row[1], 'n_times': row[2],
+                'step': row[3], 'variables': json.loads(row[4]),
+                'grid': json.loads(row[5])}
+
+    def close(self):
+        self._conn.close()
+
+
+def catalog_files(input_dir, time_range = None, variables = None):
+    '''
+    Update the catalog of a directory and return the names of its files in a
+    time range (see `FileCatalog.query`).
+    '''
+    catalog = FileCatalog(input_dir)
+    try:
+        catalog.update()
+        return catalog.query(time_range, variables)
+    finally:
+        catalog.close()
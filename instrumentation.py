@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains the instrumentation of the download and reduction
+functions: each stage of a run (CDS retrievals, reading and decoding input
+files, resampling, writing) reports its wall time, CPU time, bytes read and
+written, file count and the peak memory of the process to the registered
+hooks.
+
+A hook is any callable taking an event dict. Register it with `add_hook`, or
+for the duration of a block with `instrument`:
+
+    totals = StageTotals()
+    with instrument(totals, JsonLinesWriter('run.jsonl'),
+                    ChromeTraceWriter('run.trace.json')):
+        time_downsample(...)
+    totals.report()
+
+The Chrome trace opens in chrome://tracing or https://ui.perfetto.dev. With
+the environment variable ERA5_TRACE_JSONL set to a path, every process
+(including the worker processes of `time_downsample(workers = ...)`) appends
+its events to that file.
+
+With no hook registered, `stage` returns a shared object that does nothing,
+so the instrumentation costs well under a microsecond per stage and can stay
+in place in production.
+
+An event has the keys:
+    stage:          name of the stage (e.g. 'read', 'resample', 'write').
+    start:          start time, in seconds since the epoch.
+    wall_s, cpu_s:  wall time and process CPU time of the stage, in seconds.
+    peak_rss_bytes: peak resident memory of the process so far.
+    pid, thread:    process and thread ids.
+    parent, depth:  enclosing stage in the same thread, and nesting depth.
+    error:          exception type, if the stage raised one.
+and the counters added by the stage (bytes_read, bytes_written, files) and
+its details (e.g. file, var, op).
+
+"""
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import warnings
+
+_hooks = []
+_local = threading.local()
+
+
+def add_hook(hook):
+    ''' Register a callable that receives each stage event. '''
+    _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    ''' Unregister a hook. '''
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def enabled():
+    ''' True if a hook is registered. '''
+    return bool(_hooks)
+
+
+@contextlib.contextmanager
+def instrument(*hooks):
+    '''
+    Register hooks for the duration of a block, then close the ones with a
+    `close` method (e.g. to write a Chrome trace).
+    '''
+    for hook in hooks:
+        add_hook(hook)
+    try:
+        yield hooks[0] if len(hooks) == 1 else hooks
+    finally:
+        for hook in hooks:
+            remove_hook(hook)
+            if hasattr(hook, 'close'):
+                hook.close()
+
+
+def peak_rss():
+    ''' Peak resident memory of the process, in bytes. '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _NullStage:
+    ''' Stage used when no hook is registered: does nothing. '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, **counts):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, name, details):
+        self.name = name
+        self.event = details
+        self.counts = {}
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault('stack', [])
+        self.parent = stack[-1].name if stack else None
+        self.depth = len(stack)
+        stack.append(self)
+        self.start = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        _local.stack.pop()
+        event = {'stage': self.name, 'start': self.start, 'wall_s': wall,
+                 'cpu_s': cpu, 'peak_rss_bytes': peak_rss(),
+                 'pid': os.getpid(), 'thread': threading.get_ident(),
+                 'parent': self.parent, 'depth': self.depth}
+        if exc_type is not None:
+            event['error'] = exc_type.__name__
+        event.update(self.counts)
+        event.update(self.event)
+        emit(event)
+        return False
+
+    def add(self, **counts):
+        ''' Add to the stage's counters (e.g. bytes_read = n, files = 1). '''
+        for name, n in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + n
+
+
+def stage(name, **details):
+    '''
+    Context manager timing a stage of a run. Details (e.g. file = name) are
+    added to its event; counters are added with `.add(...)` on the object
+    returned by `with`.
+    '''
+    if not _hooks:
+        return _NULL_STAGE
+    return _Stage(name, details)
+
+
+def emit(event):
+    ''' Send an event to every hook. A failing hook only raises a warning. '''
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception as err:
+            warnings.warn('Instrumentation hook {!r} failed: {!r}'
+                          .format(hook, err))
+
+
+def file_size(path):
+    ''' Size of a file in bytes, or 0 if it cannot be read. '''
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class JsonLinesWriter:
+    ''' Hook appending each event to a file as one line of JSON. '''
+    def __init__(self, path, mode = 'a'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, mode)
+
+    def __call__(self, event):
+        line = json.dumps(event, default = str) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ChromeTraceWriter:
+    '''
+    Hook collecting the events into a Chrome trace (Trace Event Format) file,
+    written by `close`.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        args = {k: v for k, v in event.items() if k not in
+                ('stage', 'start', 'wall_s', 'pid', 'thread')}
+        trace = {'name': event['stage'], 'cat': 'era5', 'ph': 'X',
+                 'ts': event['start'] * 1e6, 'dur': event['wall_s'] * 1e6,
+                 'pid': event['pid'], 'tid': event['thread'], 'args': args}
+        with self._lock:
+            self.events.append(trace)
+
+    def close(self):
+        with self._lock, open(self.path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f,
+                      default = str)
+
+
+class StageTotals:
+    ''' Hook adding up the time, bytes and files of each stage. '''
+    COUNTERS = ('wall_s', 'cpu_s', 'bytes_read', 'bytes_written', 'files')
+
+    def __init__(self):
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            total = self.totals.setdefault(event['stage'],
+                                           dict.fromkeys(('count',) +
+                                                         self.COUNTERS, 0))
+            total['count'] += 1
+            for name in self.COUNTERS:
+                total[name] += event.get(name, 0)
+            total['peak_rss_bytes'] = max(total.get('peak_rss_bytes', 0),
+                                          event['peak_rss_bytes'])
+
+    def report(self):
+        ''' Print the totals, slowest stage first. '''
+        print('{:22s} {:>6s} {:>10s} {:>10s} {:>10s} {:>10s} {:>6s}'.format(
+            'stage', 'count', 'wall s', 'cpu s', 'MB read', 'MB written',
+            'files'))
+        for name, t in sorted(self.totals.items(),
+                              key = lambda item: -item[1]['wall_s']):
+            print('{:22s} {:6d} {:10.3f} {:10.3f} {:10.1f} {:10.1f} {:6d}'
+                  .format(name, t['count'], t['wall_s'], t['cpu_s'],
+                          t['bytes_read'] / 1e6, t['bytes_written'] / 1e6,
+                          t['files']))
+        return self.totals
+
+
+if os.environ.get('ERA5_TRACE_JSONL'):
+    add_hook(JsonLinesWriter(os.environ['ERA5_TRACE_JSONL']))
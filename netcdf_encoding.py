@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains encoding profiles for the netCDF files written by
+`time_downsample`, `aggregate_files` and `yearly_mean`: compression (zlib or
+zstd) and level, byte shuffle, chunk shape, and optional int16 packing with a
+`scale_factor`/`add_offset` computed from the data range.
+
+Two presets are provided:
+    'map':        one chunk per time step over the whole grid, for reading
+                  maps (all pixels at one time).
+    'timeseries': long time chunks over small spatial tiles, for reading the
+                  time series of one pixel or region.
+
+"""
+
+import numpy as np
+
+ENCODING_PRESETS = {
+    'map': {'compression': 'zlib', 'complevel': 4, 'shuffle': True,
+            'chunks': {'time': 1}, 'pack': False},
+    'timeseries': {'compression': 'zlib', 'complevel': 4, 'shuffle': True,
+                   'chunks': {'time': 8760, 'latitude': 32, 'longitude': 32},
+                   'pack': False},
+}
+
+# Fill value of packed variables; the other int16 values hold data
+PACKED_FILL = np.int16(-32768)
+
+
+def resolve_profile(profile):
+    '''
+    Turn a profile into a dict of settings. A profile is a preset name, or a
+    dict of settings, optionally with a 'preset' key naming the preset it
+    starts from. Settings:
+
+    compression: None, 'zlib' or 'zstd'.
+    complevel:   int, compression level.
+    shuffle:     boolean, byte shuffle before compression.
+    chunks:      dict of {dimension: chunk length}; dimensions that are not
+                 listed are not split. Lengths are capped at the dimension size.
+    pack:        boolean, store floating-point variables as int16 with a
+                 scale_factor/add_offset computed from their range.
+    variables:   dict of {variable: settings} overriding the above for single
+                 variables.
+    '''
+    if isinstance(profile, str):
+        if profile not in ENCODING_PRESETS:
+            raise ValueError('Unknown encoding preset: {}'.format(profile))
+        return dict(ENCODING_PRESETS[profile])
+    settings = dict(ENCODING_PRESETS.get(profile.get('preset'), {}))
+    settings.update({k: v for k, v in profile.items() if k != 'preset'})
+    return settings
+
+
+def build_encoding(ds, profile):
+    '''
+    Build the `encoding` argument of `Dataset.to_netcdf` for a profile.
+
+    Parameters
+    ----------
+    ds : xarray Dataset
+        The Dataset that will be written.
+    profile : str or dict
+        Encoding profile, see `resolve_profile`.
+
+    Returns
+    -------
+    dict of {variable name: encoding dict} for the data variables.
+
+    '''
+    settings = resolve_profile(profile)
+    overrides = settings.pop('variables', {})
+    encoding = {}
+    for name, da in ds.data_vars.items():
+        s = dict(settings)
+        s.update(overrides.get(name, {}))
+        encoding[name] = variable_encoding(da, s)
+    return encoding
+
+
+def variable_encoding(da, settings):
+    ''' Encoding dict for one DataArray, from resolved profile settings. '''
+    enc = {}
+    compression = settings.get('compression')
+    if compression == 'zlib':
+        enc['zlib'] = True
+    elif compression is not None:
+        enc['compression'] = compression
+    if compression is not None:
+        enc['complevel'] = settings.get('complevel', 4)
+        enc['shuffle'] = settings.get('shuffle', True)
+
+    chunks = settings.get('chunks')
+    if chunks is not None and da.ndim > 0:
+        enc['chunksizes'] = tuple(
+            max(1, min(int(chunks.get(dim, size)), size)) if size else 1
+            for dim, size in zip(da.dims, da.shape))
+
+    if settings.get('pack') and np.issubdtype(da.dtype, np.floating):
+        enc.update(packing(da))
+    return enc
+
+
+def packing(da):
+    '''
+    int16 packing attributes for a DataArray: scale_factor and add_offset map
+    the data range onto -32767..32767, and -32768 marks missing values.
+    '''
+    vmin = float(da.min(skipna = True))
+    vmax = float(da.max(skipna = True))
+    if not np.isfinite(vmin) or not np.isfinite(vmax):
+        vmin = vmax = 0.0
+    add_offset = (vmax + vmin) / 2
+    scale_factor = (vmax - vmin) / (2 * 32767) or 1.0
+    return {'dtype': 'int16', 'scale_factor': scale_factor,
+            'add_offset': add_offset, '_FillValue': PACKED_FILL}
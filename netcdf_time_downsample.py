@@ -15,12 +15,52 @@ import numpy as np
 import os
 import netCDF4
 import datetime
+import contextlib
+import concurrent.futures
+import warnings
+from streaming_resample import StreamingResampler, ReductionTree, bin_labels, \
+    fixed_step
+from netcdf_encoding import build_encoding, resolve_profile
+from derived_variables import derived_array, derived_reduce
+from reducers import reduction_specs, resample_reduce
+from spatial_subset import subset_dataset, resolve_region, subset_indexers, \
+    align_mask, grid_names
+from result_cache import ResultCache
+from instrumentation import stage, file_size
+from file_catalog import catalog_files
+from prefetch_reader import PrefetchReader
+from packed_reduce import packed_resample
+from spatial_coarsen import coarsen_dataset, resolve_coarsening
+
+class FileReductionError(RuntimeError):
+    '''
+    Raised by `time_downsample` when some input files could not be reduced.
+    The files that were reduced are still written to `output_filepath`.
+
+    failures:        dict of {input filename: exception raised for the file}
+    output_filepath: str, path of the file written from the other inputs, or
+                     None if no input file was reduced.
+    '''
+    def __init__(self, failures, output_filepath = None):
+        self.failures = failures
+        self.output_filepath = output_filepath
+        msg = '{} input file(s) failed: {}'.format(
+            len(failures), ', '.join('{} ({!r})'.format(f, e) 
+                                     for f, e in failures.items()))
+        super().__init__(msg)
+
+    def __reduce__(self):
+        # Picklable, e.g. when raised in a worker process
+        return (type(self), (self.failures, self.output_filepath))
 
 def windspeed(u, v):
     ''' Calculate wind speed from u and v directions. '''
-    return np.sqrt(u**2 + v**2)
+    return np.hypot(u, v)
 
-def aggregate_files(input_dir, input_files, output_filepath):
+def aggregate_files(input_dir, input_files, output_filepath, streaming = False,
+                    encoding = None, zarr_store = None, region = None, 
+                    cache = None, time_range = None, prefetch = None, 
+                    prefetch_memory = None):
     '''
     Concatenate files by time, creating a longer timespan in each individual 
     file.  
@@ -31,28 +71,325 @@ def aggregate_files(input_dir, input_files, output_filepath):
         Input file directory.
     input_files : list of strings
         Input netCDF files to concatenate by time. Filenames must be a sequence in
-        chronological order.
+        chronological order. Can be None with time_range.
     output_dir: str
         File path for output directory.
+    streaming: boolean (optional)
+        Create the output with an unlimited time dimension and append each 
+        input's records in turn, a block at a time, instead of concatenating 
+        every input in memory. Variables that are stored the same way in 
+        every input (same dtype and packing) are copied as encoded values 
+        without decoding. The inputs must have the same variables and grid.
+    encoding: str or dict (optional)
+        On-disk encoding profile for the output (compression, chunking, 
+        int16 packing), e.g. 'map' or 'timeseries'. See 
+        `netcdf_encoding.resolve_profile`. Packing is not supported with 
+        streaming.
+    zarr_store: str (optional)
+        Write to this Zarr store instead of output_filepath, one input file 
+        at a time, each into its time region of the store. The store must 
+        have been created for the whole period with 
+        `zarr_output.init_zarr_store` (see `zarr_output`).
+    region: list or dict (optional)
+        Keep only this region: a bounding box [north, west, south, east] or
+        a mask, see `spatial_subset`. Only the region is read from the 
+        inputs.
+    cache: ResultCache or str (optional)
+        Result cache (or its directory), see `result_cache`. If the same 
+        inputs were aggregated with the same settings before, the stored 
+        output is copied to output_filepath without reading the inputs.
+    time_range: (start, end) (optional)
+        Use the files of input_dir holding the time steps from start 
+        (included) to end (excluded), found in the directory's file catalog
+        (see `file_catalog`), in place of input_files. E.g. ('2000', '2001').
+    prefetch: int (optional)
+        Read and decode this many input files ahead on background threads
+        while the current one is concatenated (see `prefetch_reader`). Not 
+        used with streaming or zarr_store.
+    prefetch_memory: int (optional)
+        Bytes of decoded input that can be read ahead with prefetch. This 
+        only limits the files waiting to be used: the in-memory 
+        concatenation keeps every file, so it needs the decoded size of all
+        the inputs whatever the budget. Use streaming (without prefetch) to
+        bound the memory.
 
     Returns
     -------
     Concatenated netCDF written to file.
 
+    '''
+    if time_range is not None:
+        input_files = catalog_files(input_dir, time_range)
+    if prefetch and (streaming or zarr_store is not None):
+        raise ValueError('prefetch is not used with streaming or zarr_store')
+    with stage('aggregate_files', streaming = streaming) as s:
+        s.add(files = len(input_files))
+        if zarr_store is not None:
+            _aggregate_zarr(input_dir, input_files, zarr_store, region)
+            return
+        cache = ResultCache.resolve(cache)
+        if cache is not None:
+            key = cache.key('aggregate_files', 
+                            [input_dir + f for f in input_files],
+                            {'streaming': streaming, 'encoding': encoding, 
+                             'region': region})
+            if cache.get(key, output_filepath = output_filepath) is not None:
+                return
+        if streaming:
+            _append_files(input_dir, input_files, output_filepath, encoding, 
+                          region = region)
+        else:
+            _concat_files(input_dir, input_files, output_filepath, encoding, 
+                          region, prefetch, prefetch_memory)
+        s.add(bytes_written = file_size(output_filepath))
+        if cache is not None:
+            cache.put(key, output_filepath)
+
+
+def _concat_files(input_dir, input_files, output_filepath, encoding = None, 
+                  region = None, prefetch = None, prefetch_memory = None):
+    '''
+    In-memory form of `aggregate_files`: concatenate and write. Every input
+    is held in memory, also with prefetch (prefetch_memory only limits the
+    files read ahead).
     '''
     agg_lst = []
-    for file in input_files:
-        ds = xr.open_dataset(input_dir + file)
-        agg_lst.append(ds)
-        del(ds)
+    if prefetch:
+        reader = PrefetchReader([input_dir + f for f in input_files], prefetch,
+                                prefetch_memory, region = region)
+        agg_lst = [ds for _, ds in reader]
+    else:
+        for file in input_files:
+            ds = subset_dataset(xr.open_dataset(input_dir + file), region)
+            agg_lst.append(ds)
+            del(ds)
     
     agg = xr.concat(agg_lst, dim = 'time')
     
-    agg.to_netcdf(output_filepath, mode = 'w', format = 'NETCDF4')
-    
+    # The inputs are read and decoded while the output is written (unless
+    # they were prefetched, and counted by the reader's 'read' stage)
+    with stage('write', file = os.path.basename(output_filepath)) as s:
+        if not prefetch:
+            s.add(bytes_read = sum(file_size(input_dir + f) 
+                                   for f in input_files))
+        agg.to_netcdf(output_filepath, mode = 'w', format = 'NETCDF4',
+                      encoding = _encoding(agg, encoding))
+
+
+# Attributes that determine how a variable's values are encoded on disk
+_ENCODING_ATTRS = ('scale_factor', 'add_offset', '_FillValue', 'missing_value', 
+                   'units', 'calendar')
+
+
+def _aggregate_zarr(input_dir, input_files, zarr_store, region = None):
+    ''' Write each input file into its time region of a Zarr store. '''
+    from zarr_output import write_region
+
+    for file in input_files:
+        with xr.open_dataset(input_dir + file) as ds:
+            write_region(subset_dataset(ds, region), zarr_store)
+
+
+def _encoding(ds, profile):
+    ''' to_netcdf encoding for an encoding profile (None keeps the default). '''
+    if profile is None:
+        return None
+    return build_encoding(ds, profile)
+
+
+def _encoding_signature(var):
+    ''' dtype and encoding attributes of a netCDF4 Variable. '''
+    attrs = tuple((a, np.asarray(var.getncattr(a)).tolist()) 
+                  for a in _ENCODING_ATTRS if a in var.ncattrs())
+    return (str(var.dtype), attrs)
+
+
+def _append_files(input_dir, input_files, output_filepath, encoding = None, 
+                  dim = 'time', block_bytes = 64 * 2**20, region = None):
+    '''
+    Streaming form of `aggregate_files`: append the records of each input to 
+    an output file with an unlimited time dimension, `block_bytes` at a time.
+    Only the region's grid cells are read, if a region is given.
+    '''
+    paths = [input_dir + file for file in input_files]
+    settings = None if encoding is None else resolve_profile(encoding)
+    if settings is not None and (settings.get('pack') or 
+                                 any(v.get('pack') for v in 
+                                     settings.get('variables', {}).values())):
+        raise ValueError('int16 packing is not supported with streaming')
+
+    # Read every header first, to find the variables that can be copied raw
+    signatures = {}
+    total = 0
+    for path in paths:
+        with netCDF4.Dataset(path) as src:
+            total += len(src.dimensions[dim])
+            for name, var in src.variables.items():
+                if dim in var.dimensions:
+                    signatures.setdefault(name, set()).add(_encoding_signature(var))
+    raw = {name for name, sig in signatures.items() if len(sig) == 1}
+
+    with netCDF4.Dataset(paths[0]) as first, \
+         netCDF4.Dataset(output_filepath, 'w', format = 'NETCDF4') as out:
+        index, keep = _region_index(first, region)
+        if keep is not None:
+            # Masked cells are written as the fill value, so variables 
+            # without one are decoded
+            raw = {name for name in raw 
+                   if '_FillValue' in first.variables[name].ncattrs()}
+        out.setncatts({a: first.getncattr(a) for a in first.ncattrs()})
+        for name, d in first.dimensions.items():
+            size = len(d)
+            if name in index:
+                size = len(np.arange(size)[index[name]])
+            out.createDimension(name, None if name == dim else size)
+
+        for name, var in first.variables.items():
+            attrs = {a: var.getncattr(a) for a in var.ncattrs()}
+            dtype = var.dtype
+            if name in signatures and name not in raw:
+                # Encoded differently between inputs: store decoded values
+                for a in ('scale_factor', 'add_offset', 'missing_value'):
+                    attrs.pop(a, None)
+                if name != dim:
+                    dtype = np.result_type(np.float32, 
+                                           var.getncattr('scale_factor') 
+                                           if 'scale_factor' in var.ncattrs() 
+                                           else var.dtype)
+                    attrs['_FillValue'] = netCDF4.default_fillvals[dtype.str[1:]]
+            fill = attrs.pop('_FillValue', None)
+
+            filters = var.filters() or {}
+            chunking = var.chunking()
+            options = {'zlib': bool(filters.get('zlib')), 
+                       'complevel': filters.get('complevel', 4),
+                       'shuffle': bool(filters.get('shuffle')),
+                       'chunksizes': None if chunking == 'contiguous' else chunking}
+            if settings is not None and var.dimensions:
+                s = dict(settings)
+                s.update(settings.get('variables', {}).get(name, {}))
+                sizes = {d: total if d == dim else len(first.dimensions[d]) 
+                         for d in var.dimensions}
+                options = _variable_options(s, var.dimensions, sizes)
+            out_var = out.createVariable(name, dtype, var.dimensions, 
+                                         fill_value = fill, **options)
+            out_var.setncatts(attrs)
+            if dim not in var.dimensions:
+                out_var[...] = var[tuple(index.get(d, slice(None)) 
+                                         for d in var.dimensions)]
+
+        start = 0
+        for path in paths:
+            with stage('append_file', file = os.path.basename(path)) as s, \
+                 netCDF4.Dataset(path) as src:
+                s.add(bytes_read = file_size(path), files = 1)
+                nrec = len(src.dimensions[dim])
+                for name, var in src.variables.items():
+                    if dim not in var.dimensions:
+                        continue
+                    _append_variable(var, out.variables[name], dim, start, nrec, 
+                                     name in raw, block_bytes, index, keep)
+            start += nrec
+
+
+def _variable_options(settings, dims, sizes):
+    ''' netCDF4 createVariable options for resolved encoding profile settings. '''
+    compression = settings.get('compression')
+    options = {}
+    if compression is not None:
+        options['compression'] = compression
+        options['complevel'] = settings.get('complevel', 4)
+        options['shuffle'] = settings.get('shuffle', True)
+    chunks = settings.get('chunks')
+    if chunks is not None:
+        options['chunksizes'] = tuple(max(1, min(int(chunks.get(d, sizes[d])), 
+                                                 sizes[d] or 1)) for d in dims)
+    return options
+
+
+def _region_index(nc, region):
+    '''
+    Indexers ({dimension: slice or index array}) of a region in a netCDF4 
+    Dataset, and the region's mask as (mask, latitude dimension, longitude 
+    dimension), or None if there is no mask.
+    '''
+    area, mask = resolve_region(region)
+    if area is None and mask is None:
+        return {}, None
+    lat_name, lon_name = grid_names(nc.variables)
+    lat = nc.variables[lat_name][:]
+    lon = nc.variables[lon_name][:]
+    index = {}
+    if area is not None:
+        index[lat_name], index[lon_name] = subset_indexers(lat, lon, area)
+        lat, lon = lat[index[lat_name]], lon[index[lon_name]]
+    if mask is None:
+        return index, None
+    return index, (align_mask(mask, lat, lon), lat_name, lon_name)
+
+
+def _mask_values(values, dims, keep, fill = None):
+    '''
+    Set the values outside a region's mask to missing: to `fill` for raw 
+    values, else masked.
+    '''
+    mask, lat_name, lon_name = keep
+    if lat_name not in dims or lon_name not in dims:
+        return values
+    lat_axis, lon_axis = dims.index(lat_name), dims.index(lon_name)
+    if lat_axis > lon_axis:
+        mask = mask.T
+    shape = [1] * len(dims)
+    shape[lat_axis], shape[lon_axis] = values.shape[lat_axis], values.shape[lon_axis]
+    outside = np.broadcast_to(~mask.reshape(shape), values.shape)
+    if fill is not None:
+        return np.where(outside, fill, values)
+    return np.ma.masked_where(outside, values)
+
+
+def _append_variable(src, dst, dim, start, nrec, raw, block_bytes, 
+                     region_index = None, keep = None):
+    '''
+    Copy the records of one variable into the output at record `start`. Raw 
+    copies move the encoded values; otherwise values are decoded and written 
+    in the output's encoding (times are converted to the output's units).
+    Only the region given by `region_index` and `keep` (see `_region_index`)
+    is copied.
+    '''
+    region_index = region_index or {}
+    axis = src.dimensions.index(dim)
+    src.set_auto_maskandscale(not raw)
+    dst.set_auto_maskandscale(not raw)
+    convert_time = (not raw and 'units' in dst.ncattrs() 
+                    and 'since' in str(dst.getncattr('units')))
+
+    record_bytes = max(1, src.dtype.itemsize * int(np.prod(src.shape)) // max(nrec, 1))
+    step = max(1, block_bytes // record_bytes)
+    for i in range(0, nrec, step):
+        index = [region_index.get(d, slice(None)) for d in src.dimensions]
+        index[axis] = slice(i, min(i + step, nrec))
+        values = src[tuple(index)]
+        if keep is not None:
+            values = _mask_values(values, src.dimensions, keep, 
+                                  src.getncattr('_FillValue') if raw else None)
+        if convert_time:
+            calendar = getattr(src, 'calendar', 'standard')
+            dates = netCDF4.num2date(values, src.units, calendar)
+            values = netCDF4.date2num(dates, dst.units, 
+                                      getattr(dst, 'calendar', calendar))
+            if np.issubdtype(dst.dtype, np.integer):
+                values = np.rint(values)
+        out_index = [slice(None)] * len(src.dimensions)
+        out_index[axis] = slice(start + i, start + min(i + step, nrec))
+        dst[tuple(out_index)] = values
 
 def time_downsample(input_dir, input_files, var, op, time_res, output_dir, varnames = None, 
-                    wind_speed = False):
+                    wind_speed = False, chunks = None, chunk_size = None, 
+                    workers = None, streaming = False, encoding = None, 
+                    zarr_store = None, skip_written = False, derived = None,
+                    region = None, cache = None, time_range = None, 
+                    prefetch = None, prefetch_memory = None, packed = False,
+                    coarsen = None):
     '''
     This function downsamples the time step within netCDF files and concatenates 
     the new downsampled data.
@@ -64,12 +401,18 @@ def time_downsample(input_dir, input_files, var, op, time_res, output_dir, varna
     input_dir:  str, File path to directory with input netCDF files.
     
     input_files:A list of strings, input netCDF filenames in the input directory.
+                Can be None with time_range.
     
     var:        list of strings, variable names in input netCDF files
     
     op:         list of strings ('sum', 'max', or 'mean'), reduction operations 
                 for each variable in ordered pairs (1st operation is performed 
-                on 1st variable, etc.)
+                on 1st variable, etc.). Any name in `reducers.REDUCERS` can be
+                used ('min', 'count', 'var', 'std', 'argmax_time', 
+                'count_above_<threshold>', or a registered reducer), or a 
+                Reducer. An element can also be a list of operations (e.g. 
+                ['max', 'mean', 'std']), computed together in one read of the
+                variable and written as '<variable>_<operation>'.
                 
     time_res:   str, Set desired new time resolution with Pandas datetime syntax 
                 (e.g. "1D" for daily resolution, "2H" for two-hour resolution) 
@@ -90,101 +433,637 @@ def time_downsample(input_dir, input_files, var, op, time_res, output_dir, varna
     wind_speed: boolean, whether to calculate wind speed from u and v 
                 directions.  If True, set the first element in the list var to 
                 be a nested list with two elements for [u,v] wind directions.
+
+    chunks:     dict or 'auto' (optional), open the input files lazily as 
+                dask arrays with these chunks (e.g. {'time': -1, 
+                'latitude': 500, 'longitude': 500}). The reductions are 
+                planned as a task graph and streamed to the output file chunk 
+                by chunk, so peak memory depends on the chunk size rather 
+                than the number of input files.
+
+    chunk_size: str (optional), memory budget for one dask chunk (e.g. 
+                '128MiB'). Setting this turns on the lazy mode; if chunks is 
+                not given, each chunk holds the whole time axis of a file 
+                over an 'auto'-sized spatial tile.
+
+    workers:    int (optional), reduce the input files in a process pool with
+                this many worker processes. Results are concatenated in input
+                file order. If some files fail, the others are still written 
+                and a FileReductionError listing the failures is raised.
+
+    streaming:  boolean, read the input files in time order and carry 
+                running statistics for bins that are still open across file 
+                boundaries (see `streaming_resample.StreamingResampler`). A 
+                bin that spans several files is then reduced once, instead of 
+                once per file, so the files do not need to be merged with 
+                `aggregate_files` first. Bins start at midnight of the first 
+                day, as without streaming (which restarts them at each file).
+                Cannot be combined with workers.
+
+    encoding:   str or dict (optional), on-disk encoding profile for the 
+                output file: compression, chunk shape and optional int16 
+                packing. Use a preset ('map' for reading maps, 'timeseries' 
+                for reading pixel time series) or a dict of settings, see 
+                `netcdf_encoding.resolve_profile`.
+
+    zarr_store: str (optional), write the output into this Zarr store 
+                instead of a netCDF file in output_dir. The store must have
+                been created for the whole period with 
+                `zarr_output.init_zarr_store`; the output is written into 
+                its time region, so several processes can fill one store at
+                the same time.
+
+    skip_written: boolean, with zarr_store, skip the input files whose output
+                time steps are all flagged as written in the store.
+
+    derived:    dict (optional), variables computed from input variables, as
+                {output name: (kind, [input names])} or {output name: (kind, 
+                [input names], attrs)}, where kind is a name in 
+                `derived_variables.DERIVED_VARIABLES` (e.g. 'wind_speed', 
+                'wind_direction', 'gust_factor', 'relative_humidity'). List 
+                the output names in var. A derived variable is evaluated a 
+                block of time steps at a time and reduced straight away, so 
+                the full-resolution field is never held in memory (with 
+                chunks, it is evaluated chunk by chunk in the task graph).
+                wind_speed = True is the same as {'ws10': ('wind_speed', 
+                ['u10', 'v10'])} for var[0] = ['u10', 'v10'].
+
+    region:     list or dict (optional), reduce only this region: a bounding
+                box [north, west, south, east] or a mask, see 
+                `spatial_subset`. It is applied as a lazy slice when each 
+                file is opened, so only the region is read and reduced.
+
+    cache:      ResultCache or str (optional), result cache (or its 
+                directory), see `result_cache`. If the same input files were
+                reduced with the same settings and code before, the stored 
+                output is copied to output_dir and returned without reading 
+                the inputs. Not used with zarr_store.
+
+    time_range: (start, end) (optional), use the files of input_dir holding
+                the time steps from start (included) to end (excluded) and
+                the input variables, found in the directory's file catalog 
+                (see `file_catalog`), in place of input_files. E.g. 
+                ('2000-01-01', '2000-02-01'). Files only partly inside the 
+                range, or overlapping each other, raise a ValueError.
+
+    prefetch:   int (optional), read and decode this many input files ahead 
+                on background threads while the current file is reduced (see
+                `prefetch_reader.PrefetchReader`). Only the input variables 
+                and the region are read. The time spent waiting for files 
+                and reducing them is reported to the instrumentation hooks 
+                ('io_wait' and 'prefetch' stages). Cannot be combined with 
+                workers or chunks.
+
+    prefetch_memory: int (optional), bytes of decoded input that can be held
+                by the files read ahead and the file being reduced. A file 
+                is only read ahead once it fits in the budget.
+
+    packed:     boolean, compute 'max', 'min', 'sum' and 'mean' on the packed
+                integers of variables stored with scale_factor/add_offset 
+                (see `packed_reduce`), without decoding every value. Max and
+                min are identical to the decoded results; sum and mean 
+                differ by floating point rounding only. Other variables and
+                operations are reduced as usual. Cannot be combined with 
+                streaming, chunks or prefetch.
+
+    coarsen:    int or dict (optional), also coarsen the output grid in the 
+                same pass: an int block factor (e.g. 4 for 0.25 to 1 
+                degree), or a dict with a block 'factor' or a target 'grid' 
+                for area-weighted regridding, and the 'op' for the cells of 
+                a block (see `spatial_coarsen`). Each file is coarsened right
+                after its time reduction (chunk by chunk with chunks), so 
+                the full-resolution output is never written.
+
+    Returns the output file path (or the Zarr store).
     '''
+    if time_range is not None:
+        input_files = catalog_files(input_dir, time_range, 
+                                    _source_variables(var, derived))
+    if streaming and workers:
+        raise ValueError('streaming and workers cannot be combined')
+    if prefetch and (workers or chunks is not None or chunk_size is not None):
+        raise ValueError('prefetch cannot be combined with workers or chunks')
+    if packed and (streaming or prefetch or chunks is not None or 
+                   chunk_size is not None):
+        raise ValueError('packed cannot be combined with streaming, chunks '
+                         'or prefetch')
+    coarsen = resolve_coarsening(coarsen)
+
+    if zarr_store is not None and skip_written:
+        input_files = _unwritten_files(input_dir, input_files, time_res, 
+                                       zarr_store)
+        if not input_files:
+            return zarr_store
+
+    cache = ResultCache.resolve(cache)
+    key = None
+    if cache is not None and zarr_store is None and input_files:
+        key = cache.key('time_downsample', [input_dir + f for f in input_files],
+                        {'var': var, 'op': op, 'time_res': time_res, 
+                         'varnames': varnames, 'wind_speed': wind_speed, 
+                         'streaming': streaming, 'encoding': encoding, 
+                         'derived': derived, 'region': region, 
+                         'packed': packed, 'coarsen': coarsen})
+        cached = cache.get(key, output_dir = output_dir)
+        if cached is not None:
+            return cached
 
     if input_files:
-        # Create aggregate data for the specified time resolution
-        agg_lst = []
+        if chunk_size is not None and chunks is None:
+            chunks = {'time': -1, 'latitude': 'auto', 'longitude': 'auto'}
+
+        with _chunk_budget(chunk_size), \
+             stage('time_downsample', time_res = time_res) as s:
+            s.add(files = len(input_files))
+            # Create aggregate data for the specified time resolution
+            failures = {}
+            if streaming:
+                agg_lst = _downsample_files_streaming(input_dir, input_files, 
+                                                      var, op, time_res, 
+                                                      wind_speed, chunks, 
+                                                      derived, region, 
+                                                      prefetch, 
+                                                      prefetch_memory, coarsen)
+            elif prefetch:
+                reader = PrefetchReader([input_dir + f for f in input_files], 
+                                        prefetch, prefetch_memory, 
+                                        _source_variables(var, derived), 
+                                        region)
+                agg_lst = [_downsample_file(path, var, op, time_res, 
+                                            wind_speed, derived = derived, 
+                                            ds = ds, coarsen = coarsen)
+                           for path, ds in reader]
+            elif workers:
+                agg_lst, failures = _downsample_files_parallel(
+                    input_dir, input_files, var, op, time_res, wind_speed, 
+                    chunks, workers, derived, region, packed, coarsen)
+            else:
+                agg_lst = []
+                for file in input_files:
+                    agg_lst.append(_downsample_file(input_dir + file, var, op, 
+                                                    time_res, wind_speed, chunks,
+                                                    derived = derived, 
+                                                    region = region, 
+                                                    packed = packed, 
+                                                    coarsen = coarsen))
+
+            if agg_lst and zarr_store is not None:
+                output_filepath = _write_zarr(agg_lst, zarr_store)
+            elif agg_lst:
+                output_filepath = _write_downsampled(agg_lst, time_res, 
+                                                     output_dir, varnames, 
+                                                     encoding)
+            else:
+                output_filepath = None
+
+        if failures:
+            raise FileReductionError(failures, output_filepath)
+        if key is not None and output_filepath is not None:
+            cache.put(key, output_filepath, output_filepath[len(output_dir):])
+        return output_filepath
+
+
+def multi_resolution_downsample(input_dir, input_files, var, op, time_res, 
+                                output_dir, varnames = None, wind_speed = False,
+                                file_res = None, chunks = None, encoding = None,
+                                derived = None, region = None):
+    '''
+    Downsample netCDF files to several time resolutions in one pass over the
+    data (e.g. hourly files to daily, monthly and yearly output), without 
+    writing and re-reading intermediate files.
+
+    input_dir, input_files, var, op, varnames, wind_speed, chunks, encoding,
+    derived, region: see `time_downsample`. Files must be in time order.
+
+    time_res:   list of strings, new time resolutions from finest to 
+                coarsest (e.g. ['1D', '1M', '1Y']).
+
+    output_dir: list of strings, output directory for each time resolution.
+                Use None for a resolution that should not be written.
+
+    file_res:   list (optional), for each time resolution, the period covered
+                by one output file (e.g. ['1M', '1Y', None] writes daily 
+                output in monthly files, monthly output in yearly files and 
+                all yearly output in one file). None writes one file.
+
+    Returns a dict of {time_res: list of output file paths}.
+    '''
+    writer = MultiResolutionWriter(var, op, time_res, output_dir, varnames, 
+                                   wind_speed, file_res, chunks, encoding, 
+                                   derived, region)
+    writer.add_files(input_dir, input_files)
+    return writer.close()
+
+
+class MultiResolutionWriter:
+    '''
+    Incremental form of `multi_resolution_downsample`: call `add_files` as 
+    input files become available (in time order), then `close` to write the
+    bins that are still open. Output files are written as soon as the period
+    they cover is complete.
+    '''
+    def __init__(self, var, op, time_res, output_dir, varnames = None, 
+                 wind_speed = False, file_res = None, chunks = None, 
+                 encoding = None, derived = None, region = None):
+        self.var = var
+        self.region = region
+        self.encoding = encoding
+        self.derived = _derived_specs(var, wind_speed, derived)
+        self.chunks = chunks
+        self.varnames = varnames
+        self.output_dir = dict(zip(time_res, output_dir))
+        self.file_res = dict(zip(time_res, file_res or [None] * len(time_res)))
+        self.tree = ReductionTree(_output_varnames(var, wind_speed), op, 
+                                  time_res, self.derived)
+        self.output_files = {tr: [] for tr in time_res}
+        self._buffers = {tr: [] for tr in time_res}
+        self._groups = {tr: None for tr in time_res}
+
+    def add_files(self, input_dir, input_files):
+        ''' Reduce the input files and write any output files completed. '''
         for file in input_files:
-            ds = xr.open_dataset(input_dir + file)
-    
-            for index, v in enumerate(var):
-                
-                # When index = 0, create a new aggregate Dataset
-                if index == 0:
-    
-                    if wind_speed == True:
-                        # Calculate wind speed and take time aggregates
-                        ws = 'ws' + v[0][1:]
-    
-                        ds[ws] = windspeed(ds[v[0]], ds[v[1]])
-    
-                        # Resample by time, using selected aggregation method
-                        if op[index] == 'max':
-                            ds_agg = ds[ws].resample(time = time_res).max()
-                            if type(ds_agg) == xr.core.dataarray.DataArray:
-                                ds_agg = ds_agg.to_dataset()
-                        elif op[index] == 'sum':
-                            ds_agg = ds[ws].resample(time = time_res).sum()
-                            if type(ds_agg) == xr.core.dataarray.DataArray:
-                                ds_agg = ds_agg.to_dataset()
-                        elif op[index] == 'mean':
-                            ds_agg = ds[ws].resample(time = time_res).mean()
-                            if type(ds_agg) == xr.core.dataarray.DataArray:
-                                ds_agg = ds_agg.to_dataset()
-                        
-                        ds_agg[ws].attrs['units'] = 'm s**-1'
-                        ds_agg[ws].attrs['long_name'] = v[0][1:] + '-meter wind speed'
+            with stage('reduce_file', file = file) as s, \
+                 xr.open_dataset(input_dir + file, chunks = self.chunks) as ds:
+                s.add(bytes_read = file_size(input_dir + file), files = 1)
+                closed = self.tree.update(subset_dataset(ds, self.region))
+            self._collect(closed)
+
+    def close(self):
+        ''' Write the remaining bins. Returns {time_res: output file paths}. '''
+        self._collect(self.tree.flush())
+        for tr in self._buffers:
+            self._write(tr)
+        return self.output_files
+
+    def _collect(self, closed):
+        for tr, ds_agg in closed.items():
+            if self.output_dir[tr] is None:
+                continue
+            if self.file_res[tr] is None:
+                self._buffers[tr].append(ds_agg)
+                continue
+            groups = bin_labels(ds_agg.time.values, self.file_res[tr], 
+                                self.tree.levels[0].origin)
+            for group in np.unique(groups):
+                if self._buffers[tr] and group != self._groups[tr]:
+                    self._write(tr)
+                self._groups[tr] = group
+                self._buffers[tr].append(ds_agg.isel(time = groups == group))
+
+    def _write(self, tr):
+        if self._buffers[tr]:
+            self.output_files[tr].append(_write_downsampled(
+                self._buffers[tr], tr, self.output_dir[tr], self.varnames,
+                self.encoding))
+        self._buffers[tr] = []
+
+
+def _write_zarr(agg_lst, zarr_store):
+    ''' Write the downsampled Datasets into their region of a Zarr store. '''
+    from zarr_output import write_region
+
+    agg = xr.concat(agg_lst, dim = 'time') if len(agg_lst) > 1 else agg_lst[0]
+    with stage('write', file = os.path.basename(zarr_store)):
+        write_region(agg, zarr_store)
+    return zarr_store
+
+
+def _unwritten_files(input_dir, input_files, time_res, zarr_store):
+    ''' Input files with output time steps not yet written to the store. '''
+    from zarr_output import written_times
+
+    written = written_times(zarr_store)
+    files = []
+    for file in input_files:
+        with xr.open_dataset(input_dir + file) as ds:
+            times = ds.time.resample(time = time_res).count().time.values
+        if not np.isin(times, written).all():
+            files.append(file)
+    return files
+
+
+def _chunk_budget(chunk_size):
+    ''' Context setting the dask chunk-size budget, if one is given. '''
+    if chunk_size is None:
+        return contextlib.nullcontext()
+    import dask
+    return dask.config.set({'array.chunk-size': chunk_size})
+
+
+def _downsample_files_streaming(input_dir, input_files, var, op, time_res, 
+                                wind_speed, chunks, derived = None, 
+                                region = None, prefetch = None, 
+                                prefetch_memory = None, coarsen = None):
+    '''
+    Reduce the input files with a StreamingResampler. Returns the closed bins
+    as a list of Datasets in time order.
+    '''
+    names = _output_varnames(var, wind_speed)
+    specs = _derived_specs(var, wind_speed, derived)
+    resampler = StreamingResampler(names, op, time_res, specs)
+    agg_lst = []
+    if prefetch:
+        inputs = PrefetchReader([input_dir + f for f in input_files], prefetch,
+                                prefetch_memory, 
+                                _source_variables(var, derived), region)
+    else:
+        inputs = _open_files(input_dir, input_files, chunks, region)
+    for path, ds in inputs:
+        file = os.path.basename(path)
+        with stage('reduce_file', file = file) as s:
+            if not prefetch:
+                # Prefetched files are counted by the reader's 'read' stage
+                s.add(bytes_read = file_size(path), files = 1)
+            closed = resampler.update(ds)
+        if closed is not None:
+            agg_lst.append(_coarsen(closed, coarsen))
+    closed = resampler.flush()
+    if closed is not None:
+        agg_lst.append(_coarsen(closed, coarsen))
+    return agg_lst
+
+
+def _coarsen(ds, coarsen):
+    ''' Coarsen the grid of a reduced Dataset, if a coarsening is given. '''
+    if coarsen is None:
+        return ds
+    with stage('coarsen'):
+        return coarsen_dataset(ds, coarsen)
+
+
+def _open_files(input_dir, input_files, chunks = None, region = None):
+    ''' Open the input files one at a time, as (path, Dataset) pairs. '''
+    for file in input_files:
+        with xr.open_dataset(input_dir + file, chunks = chunks) as ds:
+            yield input_dir + file, subset_dataset(ds, region)
+
+
+def _output_varnames(var, wind_speed = False):
+    ''' Output variable names, with the [u, v] pair replaced by wind speed. '''
+    names = list(var)
+    if wind_speed:
+        names[0] = 'ws' + var[0][0][1:]
+    return names
+
+
+def _source_variables(var, derived = None):
+    ''' Variables read from the input files, with the derived ones' inputs. '''
+    names = []
+    for v in var:
+        names.extend(v if isinstance(v, (list, tuple)) else [v])
+    for name, spec in (derived or {}).items():
+        if name in names:
+            names.remove(name)
+        names.extend(n for n in spec[1] if n not in names)
+    return names
+
+
+def _derived_specs(var, wind_speed = False, derived = None):
+    '''
+    Derived variables as {output name: (kind, [input names], attrs)}, with 
+    the wind speed from the [u, v] pair in var[0] if wind_speed is True.
+    '''
+    specs = {}
+    if wind_speed:
+        uv = var[0]
+        specs['ws' + uv[0][1:]] = ('wind_speed', list(uv), 
+                                   {'long_name': uv[0][1:] + '-meter wind speed'})
+    for name, spec in (derived or {}).items():
+        kind, inputs = spec[0], list(spec[1])
+        specs[name] = (kind, inputs, dict(spec[2]) if len(spec) > 2 else {})
+    return specs
+
+
+def _downsample_files_parallel(input_dir, input_files, var, op, time_res, 
+                               wind_speed, chunks, workers, derived = None, 
+                               region = None, packed = False, coarsen = None):
+    '''
+    Reduce each input file in a process pool.
 
+    Returns the reduced Datasets in input file order (skipping the files that
+    failed) and a dict of {filename: exception} for the files that failed.
+    '''
+    results = {}
+    failures = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = {pool.submit(_downsample_file, input_dir + file, var, op, 
+                               time_res, wind_speed, chunks, True, derived, 
+                               region, None, packed, coarsen): file 
+                   for file in input_files}
+        for future in concurrent.futures.as_completed(futures):
+            file = futures[future]
+            try:
+                results[file] = future.result()
+            except Exception as err:
+                failures[file] = err
+
+    agg_lst = [results[file] for file in input_files if file in results]
+    return agg_lst, failures
+
+
+def _downsample_file(filepath, var, op, time_res, wind_speed = False, 
+                     chunks = None, load = False, derived = None, 
+                     region = None, ds = None, packed = False, 
+                     coarsen = None):
+    '''
+    Downsample the variables of one input file to the new time resolution.
+    See `time_downsample` for the parameters. If `load` is True, the result 
+    is read into memory and the input file closed (used by worker processes).
+    `ds` is the file's Dataset if it was already read (e.g. prefetched); the
+    region is then assumed to be applied. If `packed` is True, the packed 
+    variables are reduced without decoding (see `packed_reduce`). The 
+    result is coarsened with `coarsen` (see `spatial_coarsen`).
+    '''
+    with stage('reduce_file', file = os.path.basename(filepath)) as s:
+        # Prefetched files are counted by the reader's 'read' stage
+        if ds is None:
+            s.add(bytes_read = file_size(filepath), files = 1)
+            ds = xr.open_dataset(filepath, chunks = chunks)
+            source = ds
+            ds = subset_dataset(ds, region)
+        else:
+            source = ds
+        raw = None
+        if packed:
+            raw = subset_dataset(xr.open_dataset(filepath, 
+                                                 mask_and_scale = False), 
+                                 region)
+        specs = _derived_specs(var, wind_speed, derived)
+
+        ds_agg = xr.Dataset()
+        for v, o in zip(_output_varnames(var, wind_speed), op):
+            outputs = reduction_specs([v], [o])
+            reducers = [reducer for _, _, reducer in outputs]
+            if v in specs:
+                # Calculate the derived variable fused with the time aggregates
+                # (its inputs are read a block at a time while reducing)
+                kind, inputs, attrs = specs[v]
+                with stage('resample', var = v):
+                    if chunks is None:
+                        results = derived_reduce(ds, kind, inputs, reducers, 
+                                                 time_res)
+                        source_attrs = dict(results[0].attrs)
                     else:
-                        # Resample by time, using selected aggregation method
-                        if op[index] == 'max':
-                            ds_agg = ds[v].resample(time = time_res).max()
-                            if type(ds_agg) == xr.core.dataarray.DataArray:
-                                ds_agg = ds_agg.to_dataset()
-                        elif op[index] == 'sum':
-                            ds_agg = ds[v].resample(time = time_res).sum().to_dataset()
-                            if type(ds_agg) == xr.core.dataarray.DataArray:
-                                ds_agg = ds_agg.to_dataset()
-                        elif op[index] == 'mean':
-                            ds_agg = ds[v].resample(time = time_res).mean().to_dataset()
-                            if type(ds_agg) == xr.core.dataarray.DataArray:
-                                ds_agg = ds_agg.to_dataset()
-    
-                        # Get attributes from original dataset
-                        ds_agg[v].attrs = ds[v].attrs
+                        da = derived_array(ds, kind, inputs)
+                        results = _resample_all(da, reducers, time_res)
+                        source_attrs = dict(da.attrs)
+                source_attrs.update(attrs)
+            else:
+                # Read the variable once for all of its aggregation methods.
+                # The built-in reductions read it all anyway; the others 
+                # read it a block at a time.
+                da = ds[v]
+                results = None
+                if raw is not None and all(r.name in _RESAMPLE_OPS 
+                                           for r in reducers):
+                    with stage('resample', var = v, packed = True):
+                        results = packed_resample(raw[v], [r.name for r in 
+                                                           reducers], time_res)
+                if results is None:
+                    if chunks is None and (len(reducers) > 1 or 
+                                           reducers[0].name in _RESAMPLE_OPS):
+                        with stage('read', var = v):
+                            da = da.load()
+                    with stage('resample', var = v):
+                        results = _resample_all(da, reducers, time_res)
+                # Get attributes from original dataset
+                source_attrs = ds[v].attrs
+            for (name, _, reducer), result in zip(outputs, results):
+                ds_agg[name] = result
+                ds_agg[name].attrs = reducer.attrs(source_attrs)
+        ds_agg = _coarsen(ds_agg, coarsen)
+
+        if load:
+            ds_agg.load()
+            source.close()
+            if raw is not None:
+                raw.close()
+    return ds_agg
+
+
+# Reductions with a reshape fast path and an xarray resample method
+_RESAMPLE_OPS = ('sum', 'max', 'min', 'mean')
+
+
+def _resample_all(da, reducers, time_res):
+    '''
+    Resample a DataArray with several Reducers: the built-in ones each with 
+    `_resample`, the others together in one pass with `resample_reduce`.
+    '''
+    generic = [r for r in reducers if r.name not in _RESAMPLE_OPS]
+    results = iter(resample_reduce(da, generic, time_res) if generic else [])
+    return [next(results) if r in generic else _resample(da, r.name, time_res) 
+            for r in reducers]
+
+
+def _resample(da, op, time_res, fast = True):
+    '''
+    Resample a DataArray by time with the reduction `op` ('sum', 'max', 'min'
+    or 'mean'). Regular inputs go through `reshape_reduce` unless `fast` is 
+    False; anything else through xarray's resample. Other operations (see 
+    `reducers.REDUCERS`) go through `reducers.resample_reduce`.
+    '''
+    if not isinstance(op, str) or op not in _RESAMPLE_OPS:
+        return resample_reduce(da, [op], time_res)[0]
+    if fast:
+        reduced = reshape_reduce(da, op, time_res)
+        if reduced is not None:
+            return reduced
+    return getattr(da.resample(time = time_res), op)()
+
+
+def reshape_reduce(da, op, time_res):
+    '''
+    Fast path for resampling a regular time axis. If the time steps are 
+    evenly spaced, the first step starts a bin and every bin is complete 
+    (e.g. 24 hourly steps per day), the data is viewed without copying as 
+    (..., n_bins, steps_per_bin, ...) and reduced with one NumPy call along
+    the steps axis. Returns None when the input does not qualify, so the 
+    caller can fall back to xarray's resample.
+
+    Only resolutions that divide a day evenly are handled, since their bins
+    start at midnight whatever resample origin is used. Results match 
+    `da.resample(time = time_res)` with the default skipna behaviour.
+    '''
+    step = fixed_step(time_res)
+    day = np.timedelta64(1, 'D').astype('timedelta64[ns]')
+    if step is None or step > day or day % step:
+        return None
+    if 'time' not in da.dims or da.sizes['time'] < 2 or da.chunks is not None:
+        return None
+
+    times = da.time.values.astype('datetime64[ns]')
+    dt = times[1] - times[0]
+    if dt <= np.timedelta64(0, 'ns') or step % dt or \
+            (np.diff(times) != dt).any():
+        return None
+    steps_per_bin = int(step // dt)
+    since_midnight = times[0] - times[0].astype('datetime64[D]')
+    if since_midnight % step or len(times) % steps_per_bin:
+        return None
+
+    values = da.values
+    axis = da.get_axis_num('time')
+    shape = (values.shape[:axis] + (len(times) // steps_per_bin, steps_per_bin)
+             + values.shape[axis + 1:])
+    blocks = values.reshape(shape)
+    reduce_axis = axis + 1
+
+    floating = np.issubdtype(values.dtype, np.floating)
+    if op == 'max':
+        out = np.fmax.reduce(blocks, axis = reduce_axis)
+    elif op == 'min':
+        out = np.fmin.reduce(blocks, axis = reduce_axis)
+    elif floating and np.isnan(values.sum()):
+        # Missing values: skip them as resample does
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            out = getattr(np, 'nan' + op)(blocks, axis = reduce_axis)
+    else:
+        out = getattr(np, op)(blocks, axis = reduce_axis)
+
+    coords = {name: c for name, c in da.coords.items() if 'time' not in c.dims}
+    coords['time'] = times[::steps_per_bin]
+    return xr.DataArray(out, dims = da.dims, coords = coords, name = da.name)
+
+
+def _write_downsampled(agg_lst, time_res, output_dir, varnames = None, 
+                       encoding = None):
+    '''
+    Concatenate the downsampled Datasets and write them to one netCDF file 
+    named after the first and last dates. Returns the output file path.
+    '''
+    # Combine aggregate data into one file 
+    if len(agg_lst) > 1:
+        agg = xr.concat(agg_lst, dim = 'time')
+    elif len(agg_lst) == 1:
+        agg = agg_lst[0]
+        
+    # File naming
+    # Get the first and dates in the dataset as a string
+    start_date = str(np.array(agg.isel(time = 0).time.values, 
+                          dtype = 'datetime64[{}]'.format(time_res)).item())
+    edate = str(np.array(agg.isel(time = -1).time.values, 
+                          dtype = 'datetime64[{}]'.format(time_res)).item())
+
+    if start_date == edate:
+        end_date = ''
+    else:
+        end_date = '_' + edate
     
-                else:
-                    # When index > 0, add the new aggregate DataArray to the existing aggregate DataSet
-                    # Resample by time, using selected aggregation method
-                    if op[index] == 'max':
-                        ds_agg[v] = ds[v].resample(time = time_res).max()
-                    elif op[index] == 'sum':
-                        ds_agg[v] = ds[v].resample(time = time_res).sum()
-                    elif op[index] == 'mean':
-                        ds_agg[v] = ds[v].resample(time = time_res).mean()
+    varnames_str = ''
+    if varnames:
+        for i in varnames:
+            varnames_str = varnames_str + '_' + i
     
-                    # Get attributes from original dataset
-                    ds_agg[v].attrs = ds[v].attrs
+    output_filepath = '{}{}{}_ERA5_{}{}.nc'.format(output_dir, start_date, 
+                                                    end_date, time_res, 
+                                                    varnames_str)
     
-            agg_lst.append(ds_agg)
-            del ds_agg
-        # Combine aggregate data into one file 
-        if len(agg_lst) > 1:
-            agg = xr.concat(agg_lst, dim = 'time')
-        elif len(agg_lst) == 1:
-            agg = agg_lst[0]
-            
-        # File naming
-        # Get the first and dates in the dataset as a string
-        start_date = str(np.array(agg.isel(time = 0).time.values, 
-                              dtype = 'datetime64[{}]'.format(time_res)).item())
-        edate = str(np.array(agg.isel(time = -1).time.values, 
-                              dtype = 'datetime64[{}]'.format(time_res)).item())
-
-        if start_date == edate:
-            end_date = ''
-        else:
-            end_date = '_' + edate
-        
-        varnames_str = ''
-        if varnames:
-            for i in varnames:
-                varnames_str = varnames_str + '_' + i
-        
-        output_filepath = '{}{}{}_ERA5_{}{}.nc'.format(output_dir, start_date, 
-                                                        end_date, time_res, 
-                                                        varnames_str)
-        
-        # Write out file
-        agg.to_netcdf(output_filepath, mode = 'w', format = 'NETCDF4')
+    # Write out file
+    with stage('write', file = os.path.basename(output_filepath)) as s:
+        agg.to_netcdf(output_filepath, mode = 'w', format = 'NETCDF4',
+                      encoding = _encoding(agg, encoding))
+        s.add(bytes_written = file_size(output_filepath), files = 1)
+
+    return output_filepath
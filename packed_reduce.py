@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains time reductions computed on the packed integers of a
+variable (ERA5 files store most variables as int16 with scale_factor and
+add_offset), without decoding every value to float first. The raw values
+take a quarter of the memory of the float64 values xarray decodes them to,
+and the decoding pass over the whole array is skipped.
+
+Decoding is an affine map, value = raw * scale_factor + add_offset, so:
+    max, min:  reduced on the integers (swapped for a negative scale) and
+               only the results are decoded, by xarray itself. Decoding is
+               monotonic, so these are bit-for-bit the decoded path's.
+    sum, mean: the integers are summed in int64 accumulators (exactly) and
+               rescaled once: sum = scale * S + n * offset, mean = scale *
+               S / n + offset for the n valid values. These are at least as
+               accurate as summing the decoded floats, but not bit-for-bit
+               the same: they differ by floating point rounding, within a
+               relative PACKED_SUM_RTOL plus an absolute PACKED_SUM_ATOL
+               (checked against the decoded path in test.py).
+Fill values (_FillValue and missing_value) are skipped, as missing values
+are in the decoded path.
+
+"""
+import numpy as np
+import xarray as xr
+
+from reducers import bin_positions
+
+# Reductions computed on packed values
+PACKED_OPS = ('sum', 'max', 'min', 'mean')
+
+# Accepted difference of packed sums and means from the decoded path: the
+# decoded path rounds every value and partial sum to float64, the packed
+# path rounds once
+PACKED_SUM_RTOL = 1e-12
+PACKED_SUM_ATOL = 1e-12
+
+
+def packing(da):
+    '''
+    (scale_factor, add_offset, fill values) of a DataArray of packed
+    integers opened without decoding (mask_and_scale = False), or None if it
+    is not packed.
+    '''
+    attrs = da.attrs
+    if not np.issubdtype(da.dtype, np.integer) or \
+            ('scale_factor' not in attrs and 'add_offset' not in attrs):
+        return None
+    info = np.iinfo(da.dtype)
+    fills = []
+    for name in ('_FillValue', 'missing_value'):
+        for fill in np.atleast_1d(attrs.get(name, [])):
+            if info.min <= fill <= info.max and fill not in fills:
+                fills.append(fill)
+    return (float(attrs.get('scale_factor', 1)),
+            float(attrs.get('add_offset', 0)),
+            np.array(fills, dtype = da.dtype))
+
+
+def packed_resample(raw, ops, time_res):
+    '''
+    Resample a variable of packed integers by time, without decoding it.
+
+    Parameters
+    ----------
+    raw : DataArray
+        The variable as stored, opened with mask_and_scale = False.
+    ops : list of strings
+        Operations, from PACKED_OPS.
+    time_res : str
+        New time resolution (Pandas offset alias).
+
+    Returns
+    -------
+    List of DataArrays, one per operation, like the decoded variable's
+    resample (same bins, dtype and attributes), or None if the variable is
+    not packed or an operation is not in PACKED_OPS.
+
+    '''
+    pack = packing(raw)
+    if pack is None or any(op not in PACKED_OPS for op in ops):
+        return None
+    scale, offset, fills = pack
+    decoded = xr.conventions.decode_cf_variable(raw.name, raw.variable,
+                                                decode_times = False)
+
+    da = raw.transpose('time', ...)
+    values = da.values
+    flat = values.reshape(len(values), -1)
+    swap = {'max': 'min', 'min': 'max'} if scale < 0 else {}
+
+    labels = []
+    results = [[] for _ in ops]
+    for label, start, end in bin_positions(da.time.values, time_res):
+        labels.append(label)
+        block = flat[start:end]
+        sums = counts = None
+        for k, op in enumerate(ops):
+            if op in ('max', 'min'):
+                results[k].append(_extreme(block, swap.get(op, op), fills))
+                continue
+            if sums is None:
+                sums, counts = _sum_count(block, fills)
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                if op == 'sum':
+                    out = scale * sums + offset * counts
+                else:
+                    out = np.where(counts > 0, scale * (sums / counts) + offset,
+                                   np.nan)
+            results[k].append(out.astype(decoded.dtype))
+
+    coords = {name: c for name, c in da.coords.items() if 'time' not in c.dims}
+    coords['time'] = np.array(labels, dtype = 'datetime64[ns]')
+    shape = (len(labels),) + values.shape[1:]
+    out = []
+    for op, result in zip(ops, results):
+        if op in ('max', 'min'):
+            # Decode only the reduced values, the same way xarray decodes
+            packed = xr.Variable(da.dims, np.stack([r for r, _ in result])
+                                 .reshape(shape), raw.attrs)
+            data = xr.conventions.decode_cf_variable(raw.name, packed,
+                                                     decode_times = False)
+            data = np.array(data.values)
+            empty = np.array([e for _, e in result])
+            data[empty] = np.nan
+        else:
+            data = np.stack(result).reshape(shape)
+        out.append(xr.DataArray(data, dims = da.dims, coords = coords,
+                                name = raw.name, attrs = decoded.attrs)
+                   .transpose(*raw.dims))
+    return out
+
+
+def _extreme(block, op, fills):
+    '''
+    Max or min of the packed values of a bin (time on axis 0) skipping the
+    fill values, and whether the bin is empty. Pixels without any valid
+    value are set to a fill value.
+    '''
+    if len(block) == 0:
+        return np.zeros(block.shape[1:], dtype = block.dtype), True
+    out = getattr(np, op)(block, axis = 0)
+    # Where the extreme is not a fill value, it is a valid value and the
+    # extreme of the valid values. Elsewhere, reduce again without fills.
+    redo = np.flatnonzero(np.isin(out, fills))
+    if len(redo):
+        sub = block[:, redo]
+        valid = ~np.isin(sub, fills)
+        info = np.iinfo(block.dtype)
+        masked = np.where(valid, sub, info.min if op == 'max' else info.max)
+        out[redo] = np.where(valid.any(axis = 0),
+                             getattr(np, op)(masked, axis = 0), fills[0])
+    return out, False
+
+
+def _sum_count(block, fills):
+    '''
+    Sum (in int64) and number of the valid packed values of a bin (time on
+    axis 0).
+    '''
+    sums = block.sum(axis = 0, dtype = np.int64)
+    counts = np.full(block.shape[1:], len(block), dtype = np.int64)
+    for fill in fills:
+        n = np.count_nonzero(block == fill, axis = 0)
+        sums -= n * int(fill)
+        counts -= n
+    return sums, counts
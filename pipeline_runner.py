@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains a runner for pipelines described in a TOML (or YAML)
+file instead of a script. The stages download -> downsample -> aggregate ->
+climatology are split into tasks over partitions:
+
+    download/YYYY-MM     download_ERA5_hourly for one month
+    downsample/YYYY-MM   time_downsample of the files holding that month,
+                         keeping the bins of that month only
+    aggregate/YYYY       aggregate_files of the year's downsampled files
+    climatology          ClimatologyStore updated with each year
+
+Each task runs once the tasks it depends on are done, and independent
+partitions run in parallel in a process pool. Like make, a task is skipped
+if it completed before with the same settings, its outputs are still there
+and they are newer than its inputs. Completed tasks are recorded in a sqlite
+file, so a rerun after a failure only runs the failed tasks and those
+depending on them. A failed task does not stop the other partitions.
+
+Every stage is optional (e.g. leave out [download] to downsample files that
+are already on disk). Example spec:
+
+    [pipeline]
+    start_year = 1982
+    end_year = 2019
+    months = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]   # default: all
+    workers = 4
+
+    [download]            # keyword arguments of download_ERA5_hourly
+    output_dir = 'data/00_hourly/'
+    varnames = ['total_precipitation', '10m_u_component_of_wind',
+                '10m_v_component_of_wind']
+    max_fields = 2232
+
+    [downsample]          # keyword arguments of time_downsample
+    input_dir = 'data/00_hourly/'  # only without [download]
+    output_dir = 'data/01_daily/'
+    var = [['u10', 'v10'], 'tp']
+    op = ['max', 'sum']
+    time_res = '1D'
+    varnames = ['windspeed', 'totalprecip']
+    wind_speed = true
+
+    [aggregate]           # keyword arguments of aggregate_files
+    output_dir = 'data/02_yearly/'
+    streaming = true
+
+    [climatology]
+    store = 'data/climatology_store.nc'
+    output = 'data/climatology.nc'
+    var = ['tp']
+    op = ['sum']          # optional: reduce each year to one value first
+
+Run it with:
+
+    python pipeline_runner.py pipeline.toml [--workers 4] [--dry-run]
+
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+import numpy as np
+import xarray as xr
+
+from file_catalog import FileCatalog
+
+STATE_NAME = '.era5_pipeline_state.sqlite'
+
+# Stages in dependency order
+STAGES = ('download', 'downsample', 'aggregate', 'climatology')
+
+
+class PipelineError(RuntimeError):
+    '''
+    Raised by `run_spec` when some tasks failed. The tasks that do not depend
+    on them are completed before this is raised.
+
+    failures: dict of {task: exception}
+    blocked:  list of the tasks not run because a task they need failed.
+    '''
+    def __init__(self, failures, blocked):
+        self.failures = failures
+        self.blocked = blocked
+        msg = '{} task(s) failed ({}), {} task(s) not run'.format(
+            len(failures), ', '.join('{} ({!r})'.format(t, e)
+                                     for t, e in failures.items()),
+            len(blocked))
+        super().__init__(msg)
+
+    def __reduce__(self):
+        return (type(self), (self.failures, self.blocked))
+
+
+def load_spec(path):
+    ''' Read a pipeline spec from a TOML or YAML file. '''
+    if path.endswith(('.yaml', '.yml')):
+        import yaml
+        with open(path) as f:
+            return yaml.safe_load(f)
+    import tomllib
+    with open(path, 'rb') as f:
+        return tomllib.load(f)
+
+
+def partitions(spec):
+    ''' (year, month) partitions of a spec, in time order. '''
+    settings = spec.get('pipeline', {})
+    months = settings.get('months', range(1, 13))
+    return [(year, month)
+            for year in range(settings['start_year'], settings['end_year'] + 1)
+            for month in months]
+
+
+def build_tasks(spec):
+    '''
+    Tasks of a spec, in dependency order, as {task: (stage, partition,
+    [tasks it depends on])}.
+    '''
+    tasks = {}
+    parts = partitions(spec)
+    for year, month in parts:
+        key = '{:04d}-{:02d}'.format(year, month)
+        if 'download' in spec:
+            tasks['download/' + key] = ('download', (year, month), [])
+        if 'downsample' in spec:
+            deps = ['download/' + key] if 'download' in spec else []
+            tasks['downsample/' + key] = ('downsample', (year, month), deps)
+    last = 'downsample' if 'downsample' in spec else 'download'
+    years = sorted({year for year, _ in parts})
+    if 'aggregate' in spec:
+        for year in years:
+            tasks['aggregate/{:04d}'.format(year)] = (
+                'aggregate', year, ['{}/{:04d}-{:02d}'.format(last, y, m)
+                                    for y, m in parts if y == year])
+        last = 'aggregate'
+    if 'climatology' in spec:
+        deps = ['aggregate/{:04d}'.format(y) for y in years] \
+            if last == 'aggregate' else \
+            ['{}/{:04d}-{:02d}'.format(last, y, m) for y, m in parts]
+        tasks['climatology'] = ('climatology', None, deps)
+    return tasks
+
+
+def settings_hash(settings):
+    ''' Hash of a stage's settings, so that changing them reruns the stage. '''
+    text = json.dumps(settings, sort_keys = True, default = str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class PipelineState:
+    '''
+    Record of completed tasks (settings hash and output files), stored in a
+    sqlite file.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                               'task TEXT PRIMARY KEY, settings TEXT, '
+                               'outputs TEXT, completed REAL)')
+
+    def outputs(self, task, settings, inputs):
+        '''
+        Outputs of a task if it is up to date: completed with the same
+        settings, with every output still there and newer than every input.
+        Otherwise None.
+        '''
+        row = self._conn.execute('SELECT settings, outputs FROM tasks WHERE '
+                                 'task = ?', (task,)).fetchone()
+        if row is None or row[0] != settings:
+            return None
+        outputs = json.loads(row[1])
+        if not all(os.path.exists(p) for p in outputs):
+            return None
+        if outputs and inputs:
+            newest_input = max(os.path.getmtime(p) for p in inputs)
+            if min(os.path.getmtime(p) for p in outputs) < newest_input:
+                return None
+        return outputs
+
+    def record(self, task, settings, outputs):
+        with self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO tasks VALUES '
+                               '(?, ?, ?, ?)', (task, settings,
+                                                json.dumps(outputs),
+                                                time.time()))
+
+    def close(self):
+        self._conn.close()
+
+
+def _month_range(year, month):
+    ''' Start (included) and end (excluded) of a month, as datetime64. '''
+    start = np.datetime64('{:04d}-{:02d}'.format(year, month), 'M')
+    return start, start + 1
+
+
+def _month_files(catalog, year, month):
+    '''
+    Files holding time steps of a month, from a directory's catalog. A file
+    crossing the end of a month belongs to both months, each keeping its own
+    bins (see `_clip_output`).
+    '''
+    return [os.path.join(catalog.directory, f)
+            for f in catalog.query(_month_range(year, month), partial = True)]
+
+
+def _task_inputs(spec, stage, partition, dep_outputs, catalog = None):
+    ''' Input files of a task: its dependencies' outputs, or files on disk. '''
+    if stage == 'downsample' and 'download' not in spec:
+        return _month_files(catalog, *partition)
+    return sorted(dep_outputs)
+
+
+def run_task(stage, partition, settings, inputs, client = None):
+    '''
+    Run one task of a pipeline and return the paths of its outputs.
+
+    stage:     'download', 'downsample', 'aggregate' or 'climatology'.
+    partition: (year, month), year, or None, see `build_tasks`.
+    settings:  the stage's section of the spec.
+    inputs:    input file paths, in time order.
+    client:    CDS client for downloads (e.g. a fake one for testing).
+    '''
+    settings = dict(settings)
+    if stage == 'download':
+        from download_ERA5_hourly import download_ERA5_hourly
+        year, month = partition
+        if client is not None:
+            settings['client'] = client
+        return download_ERA5_hourly(years = [str(year)],
+                                    months = ['{:02d}'.format(month)],
+                                    days = ['{:02d}'.format(d)
+                                            for d in range(1, 32)],
+                                    **settings)
+
+    if stage == 'downsample':
+        from netcdf_time_downsample import time_downsample
+        settings.pop('input_dir', None)
+        if not inputs:
+            return []
+        input_dir = os.path.dirname(inputs[0]) + os.sep
+        input_files = [os.path.basename(p) for p in inputs]
+        if settings.get('zarr_store') is not None:
+            output = time_downsample(input_dir = input_dir,
+                                     input_files = input_files, **settings)
+            return [] if output is None else [output]
+        # Written to a directory of the task's own first, as two months 
+        # sharing a file crossing their boundary could write the same name
+        output_dir = settings.pop('output_dir')
+        staging = os.path.join(output_dir, '.downsample-{:04d}-{:02d}'
+                               .format(*partition)) + os.sep
+        os.makedirs(staging, exist_ok = True)
+        try:
+            output = time_downsample(input_dir = input_dir,
+                                     input_files = input_files,
+                                     output_dir = staging, **settings)
+            if output is not None:
+                output = _clip_output(output, _month_range(*partition),
+                                      output_dir, settings)
+        finally:
+            shutil.rmtree(staging, ignore_errors = True)
+        return [] if output is None else [output]
+
+    if stage == 'aggregate':
+        from netcdf_time_downsample import aggregate_files
+        if not inputs:
+            return []
+        output_dir = settings.pop('output_dir')
+        # Named as in test.py: the year followed by the downsampled file name
+        name = '{:04d}_ERA5{}'.format(partition, os.path.basename(inputs[0])
+                                      .split('ERA5')[-1])
+        input_dir = os.path.dirname(inputs[0]) + os.sep
+        aggregate_files(input_dir, [os.path.basename(p) for p in inputs],
+                        output_dir + name, **settings)
+        return [output_dir + name]
+
+    if stage == 'climatology':
+        return _update_climatology(settings, inputs)
+    raise ValueError('Unknown pipeline stage {}'.format(stage))
+
+
+def _clip_output(path, time_range, output_dir, settings):
+    '''
+    Move a downsampled file to output_dir, keeping only its bins inside the
+    partition's time range, so that input files crossing the end of a month
+    are not counted in both months. A clipped file is named after its new
+    dates. Returns the new path, or None if no bin is left.
+    '''
+    from netcdf_time_downsample import _write_downsampled
+
+    start, end = (np.datetime64(t, 'ns') for t in time_range)
+    with xr.open_dataset(path) as ds:
+        times = ds.time.values
+        inside = (times >= start) & (times < end)
+        clipped = None
+        if inside.any() and not inside.all():
+            clipped = ds.isel(time = inside).load()
+    if inside.all():
+        target = output_dir + os.path.basename(path)
+        os.replace(path, target)
+        return target
+    if clipped is None:
+        return None
+    return _write_downsampled([clipped], settings['time_res'], output_dir,
+                              settings.get('varnames'), 
+                              settings.get('encoding'))
+
+
+def _update_climatology(settings, inputs):
+    '''
+    Add to the climatology store the years whose files are not in it or are
+    newer than it, remove the years that have no files any more, then write
+    the summary (mean, std, min, max and count).
+    '''
+    from climatology_store import ClimatologyStore
+
+    # Years of the data in each file, from its time steps
+    by_year = {}
+    for path in inputs:
+        with xr.open_dataset(path) as ds:
+            years = np.unique(ds.time.values.astype('datetime64[Y]'))
+        for year in years.astype(int) + 1970:
+            by_year.setdefault(int(year), []).append(path)
+    store_path = settings['store']
+    store = ClimatologyStore(store_path)
+    stored = os.path.getmtime(store_path) if os.path.exists(store_path) else 0
+    var, op = settings.get('var'), settings.get('op')
+
+    for year in store.years:
+        if year not in by_year:
+            store.remove(year)
+    for year, paths in sorted(by_year.items()):
+        if year in store.years and \
+                max(os.path.getmtime(p) for p in paths) <= stored:
+            continue
+        datasets = [xr.load_dataset(p) for p in paths]
+        ds = xr.concat(datasets, dim = 'time') if len(datasets) > 1 \
+            else datasets[0]
+        ds = ds.isel(time = ds.time.dt.year.values == year)
+        if var is not None:
+            ds = ds[var]
+        if op is not None:
+            # One value per variable for the year (e.g. the annual total)
+            ds = xr.Dataset({v: getattr(ds[v], o)('time', keep_attrs = True)
+                             .expand_dims(time = ds.time.values[:1])
+                             for v, o in zip(var or list(ds.data_vars), op)})
+        store.add(ds, year = year, replace = True)
+    store.save()
+
+    output = settings.get('output')
+    if output is None:
+        return [store_path]
+    store.summary(settings.get('ddof', 0)).to_netcdf(output, mode = 'w',
+                                                      format = 'NETCDF4')
+    return [store_path, output]
+
+
+def run_spec(spec, workers = None, force = False, dry_run = False,
+             state_path = None, client = None):
+    '''
+    Run the tasks of a pipeline spec that are not up to date.
+
+    Parameters
+    ----------
+    spec : dict or str
+        Pipeline spec, or the path of a TOML/YAML file holding one.
+    workers : int (optional)
+        Number of tasks run at the same time, in a process pool. By default
+        [pipeline] workers, or 1 (tasks run one by one in this process).
+    force : boolean
+        Run every task, even if it is up to date.
+    dry_run : boolean
+        Only return the tasks that would run.
+    state_path : str (optional)
+        sqlite file recording the completed tasks. By default
+        STATE_NAME in the directory of the spec file (or the current
+        directory).
+    client : object (optional)
+        CDS client for the downloads, see `download_ERA5_hourly`.
+
+    Returns
+    -------
+    dict of {'run': [...], 'skipped': [...]} task names. PipelineError is
+    raised if any task failed.
+
+    '''
+    spec_dir = '.'
+    if isinstance(spec, str):
+        spec_dir = os.path.dirname(os.path.abspath(spec))
+        spec = load_spec(spec)
+    if workers is None:
+        workers = spec.get('pipeline', {}).get('workers', 1)
+    state = PipelineState(state_path or os.path.join(spec_dir, STATE_NAME))
+    tasks = build_tasks(spec)
+    catalog = None
+    if 'downsample' in spec and 'download' not in spec:
+        # Input files already on disk, found by their time steps
+        catalog = FileCatalog(spec['downsample']['input_dir'])
+        catalog.update()
+    hashes = {stage: settings_hash(spec[stage]) for stage in STAGES
+              if stage in spec}
+
+    done, run, skipped, failures, blocked = {}, [], [], {}, []
+    pending = dict(tasks)
+    pool = concurrent.futures.ProcessPoolExecutor(workers) if workers > 1 \
+        and not dry_run else None
+    running = {}
+    try:
+        while pending or running:
+            for task, (stage, partition, deps) in list(pending.items()):
+                if any(d in failures or d in blocked for d in deps):
+                    blocked.append(task)
+                    del pending[task]
+                    continue
+                if not all(d in done for d in deps):
+                    continue
+                del pending[task]
+                if any(done[d] is None for d in deps):
+                    # Dry run: a dependency would run, so this task would too
+                    run.append(task)
+                    done[task] = None
+                    continue
+                try:
+                    inputs = _task_inputs(spec, stage, partition,
+                                          [p for d in deps for p in done[d]],
+                                          catalog)
+                except Exception as err:
+                    # e.g. input files overlapping in time
+                    failures[task] = err
+                    continue
+                outputs = None if force else \
+                    state.outputs(task, hashes[stage], inputs)
+                if outputs is not None:
+                    skipped.append(task)
+                    done[task] = outputs
+                    continue
+                run.append(task)
+                if dry_run:
+                    done[task] = None
+                elif pool is None:
+                    try:
+                        done[task] = run_task(stage, partition, spec[stage],
+                                              inputs, client)
+                        state.record(task, hashes[stage], done[task])
+                    except Exception as err:
+                        failures[task] = err
+                else:
+                    running[pool.submit(run_task, stage, partition,
+                                        spec[stage], inputs, client)] = task
+
+            if not running:
+                if pending and not any(all(d in done for d in deps) for 
+                                       _, _, deps in pending.values()):
+                    raise ValueError('Tasks with missing dependencies: {}'
+                                     .format(sorted(pending)))
+                continue
+            finished, _ = concurrent.futures.wait(
+                running, return_when = concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                try:
+                    done[task] = future.result()
+                    state.record(task, hashes[tasks[task][0]], done[task])
+                except Exception as err:
+                    failures[task] = err
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if catalog is not None:
+            catalog.close()
+        state.close()
+
+    if failures:
+        raise PipelineError(failures, blocked)
+    return {'run': run, 'skipped': skipped}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run the tasks of a '
+                                     'pipeline spec that are not up to date.')
+    parser.add_argument('spec', help = 'TOML or YAML pipeline spec')
+    parser.add_argument('--workers', type = int,
+                        help = 'tasks run at the same time')
+    parser.add_argument('--force', action = 'store_true',
+                        help = 'run every task')
+    parser.add_argument('--dry-run', action = 'store_true',
+                        help = 'list the tasks that would run')
+    args = parser.parse_args()
+
+    result = run_spec(args.spec, args.workers, args.force, args.dry_run)
+    for task in result['run']:
+        print(('would run ' if args.dry_run else 'ran ') + task)
+    print('{} task(s) up to date'.format(len(result['skipped'])))
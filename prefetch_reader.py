@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains a prefetching reader of netCDF files: the next files are
+opened, read and decoded on background threads while the current one is
+being reduced, so that the CPU is not idle while waiting for slow storage
+(e.g. a network filesystem).
+
+At most `prefetch` files are read ahead, and the decoded files waiting to be
+used stay within a memory budget: a file only starts loading once the
+previous files fit with it in the budget (the file being used counts too,
+until the next one is asked for). A file larger than the budget is still
+read, alone. Reads go through xarray's netCDF lock, so they do not run at
+the same time as each other, but they overlap the reduction of the current
+file.
+
+The reader counts the time the consumer spends waiting for a file (I/O
+wait) and using it (compute), to choose `prefetch` for a storage tier:
+little I/O wait means more prefetching will not help.
+
+"""
+import collections
+import concurrent.futures
+import threading
+import time
+
+import xarray as xr
+
+from instrumentation import stage, file_size
+from spatial_subset import subset_dataset
+
+
+class PrefetchReader:
+    '''
+    Iterate over netCDF files as loaded Datasets, reading ahead on background
+    threads. Yields (path, Dataset) in the order of `paths`.
+
+    Parameters
+    ----------
+    paths : list of strings
+        Input file paths, in the order they are used.
+    prefetch : int
+        Number of files read ahead (and of background threads).
+    memory_budget : int (optional)
+        Bytes of decoded data that can be held by files read ahead and the
+        file in use. No limit by default.
+    variables : list of strings (optional)
+        Only load these variables (and their coordinates).
+    region : list or dict (optional)
+        Only load this region, see `spatial_subset`.
+
+    Counters, updated while iterating (see `stats`):
+        io_wait_s: time the consumer waited for a file to be read.
+        compute_s: time the consumer spent on the files.
+        read_s:    time spent loading and decoding, on the background threads
+                   (not counting the wait for memory).
+        bytes:     decoded bytes read.
+        files:     files read.
+
+    '''
+    def __init__(self, paths, prefetch = 2, memory_budget = None,
+                 variables = None, region = None):
+        if prefetch < 1:
+            raise ValueError('prefetch must be at least 1')
+        self.paths = list(paths)
+        self.prefetch = prefetch
+        self.memory_budget = memory_budget
+        self.variables = variables
+        self.region = region
+        self.io_wait_s = 0.0
+        self.compute_s = 0.0
+        self.read_s = 0.0
+        self.bytes = 0
+        self.files = 0
+        self._held = 0
+        self._next_turn = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def stats(self):
+        '''
+        Counters as a dict, with io_fraction: the fraction of the consumer's
+        time spent waiting for files.
+        '''
+        total = self.io_wait_s + self.compute_s
+        return {'io_wait_s': self.io_wait_s, 'compute_s': self.compute_s,
+                'read_s': self.read_s, 'bytes': self.bytes,
+                'files': self.files,
+                'io_fraction': self.io_wait_s / total if total else 0.0}
+
+    def __iter__(self):
+        pending = collections.deque()
+        remaining = iter(enumerate(self.paths))
+
+        with stage('prefetch', prefetch = self.prefetch) as s, \
+             concurrent.futures.ThreadPoolExecutor(self.prefetch) as pool:
+            def fill():
+                while len(pending) < self.prefetch:
+                    item = next(remaining, None)
+                    if item is None:
+                        return
+                    turn, path = item
+                    pending.append((path, pool.submit(self._read, turn, path)))
+
+            try:
+                fill()
+                while pending:
+                    path, future = pending.popleft()
+                    start = time.perf_counter()
+                    with stage('io_wait', file = path):
+                        ds, nbytes = future.result()
+                    self.io_wait_s += time.perf_counter() - start
+                    fill()
+
+                    start = time.perf_counter()
+                    yield path, ds
+                    self.compute_s += time.perf_counter() - start
+                    self._release(nbytes)
+            finally:
+                # Stop the reads still waiting for memory, e.g. on an error
+                with self._cond:
+                    self._closed = True
+                    self._cond.notify_all()
+                for _, future in pending:
+                    future.cancel()
+                s.add(io_wait_s = self.io_wait_s, compute_s = self.compute_s,
+                      read_s = self.read_s, bytes_decoded = self.bytes,
+                      files_read = self.files)
+
+    def _read(self, turn, path):
+        ''' Open a file, wait for its turn in the memory budget, load it. '''
+        with stage('read', file = path) as s:
+            source = xr.open_dataset(path)
+            try:
+                ds = subset_dataset(source, self.region)
+                if self.variables is not None:
+                    ds = ds[self.variables]
+                nbytes = ds.nbytes
+                self._acquire(turn, nbytes)
+                start = time.perf_counter()
+                ds = ds.load()
+            finally:
+                source.close()
+            s.add(bytes_read = file_size(path), files = 1)
+        with self._cond:
+            self.read_s += time.perf_counter() - start
+            self.bytes += nbytes
+            self.files += 1
+        return ds, nbytes
+
+    def _acquire(self, turn, nbytes):
+        '''
+        Wait until the earlier files have their memory, and this one fits in
+        the budget with the files held (or nothing else is held).
+        '''
+        with self._cond:
+            self._cond.wait_for(lambda: self._closed or (
+                self._next_turn == turn and (
+                    self.memory_budget is None or self._held == 0 or
+                    self._held + nbytes <= self.memory_budget)))
+            if self._closed:
+                raise RuntimeError('PrefetchReader closed')
+            self._held += nbytes
+            self._next_turn += 1
+            self._cond.notify_all()
+
+    def _release(self, nbytes):
+        with self._cond:
+            self._held -= nbytes
+            self._cond.notify_all()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains a per-pixel streaming quantile sketch, for percentiles of
+long hourly records (e.g. p95/p99/p99.9 of hourly wind speed over several
+decades) that do not fit in memory.
+
+The sketch is a fixed-bin histogram per pixel, plus the exact minimum and
+maximum. Values below the first bin edge or above the last one are counted
+in two open-ended bins bounded by the minimum and maximum. Quantiles are
+interpolated linearly inside the bin they fall in, so their error is at most
+one bin width. Memory per pixel is (number of bins + 2) * 4 bytes for the
+histogram plus the minimum and maximum in the dtype of the data (16 bytes
+for float64), whatever the record length, and two sketches with the same
+bins are merged by adding their histograms. Computing a quantile map takes
+another (number of bins + 2) * 4 bytes per pixel for the cumulative counts,
+and a few float64 values per pixel for the bin bounds.
+
+Use `QuantileSketch` for quantiles of a whole record, updated file by file
+and saved to disk between runs, or the `Quantile` reducer to get quantile
+maps at a time resolution with `time_downsample` (e.g. monthly p99).
+
+"""
+import numpy as np
+import xarray as xr
+
+from reducers import Reducer
+
+
+def histogram_state(values, axis, edges):
+    '''
+    Sketch of a block of values along `axis`: dict of 'min', 'max' and
+    'hist' (counts per bin, with the bins along a new last axis).
+    '''
+    edges = np.asarray(edges)
+    rows = np.moveaxis(values, axis, 0)
+    shape = rows.shape[1:]
+    rows = rows.reshape(rows.shape[0], -1)
+    hist = np.zeros((rows.shape[1], len(edges) + 1), dtype = np.uint32)
+    pixels = np.arange(rows.shape[1])
+    for row in rows:
+        # One time step at a time: every pixel is counted once per step
+        valid = ~np.isnan(row)
+        slots = np.searchsorted(edges, row[valid], side = 'right')
+        hist[pixels[valid], slots] += 1
+    return {'min': np.fmin.reduce(values, axis = axis),
+            'max': np.fmax.reduce(values, axis = axis),
+            'hist': hist.reshape(shape + (len(edges) + 1,))}
+
+
+def merge_states(a, b):
+    ''' Merge two sketches with the same bins. '''
+    return {'min': np.fmin(a['min'], b['min']),
+            'max': np.fmax(a['max'], b['max']),
+            'hist': a['hist'] + b['hist']}
+
+
+def state_quantile(state, edges, q):
+    '''
+    Quantile q (between 0 and 1) of each pixel of a sketch. As with 
+    np.quantile, the quantile is interpolated between the order statistics
+    next to rank q * (count - 1), each estimated from the histogram.
+    '''
+    total = state['hist'].sum(axis = -1)
+    cum = np.cumsum(state['hist'], axis = -1, dtype = state['hist'].dtype)
+    rank = q * np.maximum(total - 1, 0)
+    below = np.floor(rank)
+    with np.errstate(invalid = 'ignore'):
+        lower = _order_statistic(state, cum, total, edges, below)
+        upper = _order_statistic(state, cum, total, edges, 
+                                 np.minimum(below + 1, np.maximum(total - 1, 0)))
+        out = lower + (rank - below) * (upper - lower)
+    return np.where(total > 0, out, np.nan)
+
+
+def _order_statistic(state, cum, total, edges, rank):
+    '''
+    Estimate of the order statistic `rank` (0 for the minimum) of each pixel,
+    taking the values of a bin as evenly spread over it. The minimum and 
+    maximum are exact.
+    '''
+    edges = np.asarray(edges, dtype = float)
+    hist, low, high = state['hist'], state['min'], state['max']
+
+    # Bin holding the value, and the value's position inside the bin
+    target = rank + 0.5
+    index = np.minimum((cum < target[..., None]).sum(axis = -1), 
+                       hist.shape[-1] - 1)[..., None]
+    count = np.take_along_axis(hist, index, axis = -1)[..., 0]
+    before = np.take_along_axis(cum, index, axis = -1)[..., 0] - count
+    index = index[..., 0]
+
+    # Bin bounds: the open-ended bins are bounded by the minimum and maximum
+    lower = np.where(index == 0, low, edges[np.maximum(index - 1, 0)])
+    upper = np.where(index == len(edges), high, 
+                     edges[np.minimum(index, len(edges) - 1)])
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        fraction = (target - before) / count
+    out = np.clip(lower + fraction * (upper - lower), low, high)
+    out = np.where(rank <= 0, low, out)
+    return np.where(rank >= total - 1, high, out)
+
+
+class Quantile(Reducer):
+    '''
+    Per-pixel quantile of each bin, from a histogram sketch.
+
+    Parameters
+    ----------
+    q : float
+        Quantile, between 0 and 1 (e.g. 0.99).
+    edges : array
+        Bin edges, in increasing order (e.g. np.arange(0, 50.05, 0.1) for
+        wind speed with 0.1 m/s bins).
+    name : str (optional)
+        Output name suffix; 'p<percentile>' by default (e.g. 'p99').
+
+    '''
+    stats = ('min', 'max', 'hist')
+
+    def __init__(self, q, edges, name = None):
+        self.q = q
+        self.edges = np.asarray(edges, dtype = float)
+        self.name = name or 'p{:g}'.format(100 * q)
+
+    def partial(self, values, axis, times):
+        return histogram_state(values, axis, self.edges)
+
+    def combine(self, a, b):
+        return merge_states(a, b)
+
+    def finalize(self, state):
+        return state_quantile(state, self.edges, self.q)
+
+
+class QuantileSketch:
+    '''
+    Streaming per-pixel quantile sketch of one variable. Update it with the
+    data of each file in turn, then ask for quantile maps.
+
+    Parameters
+    ----------
+    edges : array
+        Bin edges, in increasing order. The quantile error is at most the
+        width of the bin the quantile falls in.
+
+    '''
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype = float)
+        self.state = None
+        self.dims = None
+        self.coords = None
+
+    def update(self, da, block_steps = 24):
+        '''
+        Add the values of a DataArray with a 'time' dimension, reading
+        `block_steps` time steps at a time.
+        '''
+        if self.dims is None:
+            self.dims = tuple(d for d in da.dims if d != 'time')
+            self.coords = {name: c for name, c in da.coords.items()
+                           if 'time' not in c.dims}
+        da = da.transpose('time', *self.dims)
+        for start in range(0, da.sizes['time'], block_steps):
+            values = np.asarray(da.isel(time = slice(start, start + block_steps))
+                                .values)
+            state = histogram_state(values, 0, self.edges)
+            self.state = state if self.state is None else \
+                merge_states(self.state, state)
+        return self
+
+    def merge(self, other):
+        ''' Add the counts of another sketch with the same bins and grid. '''
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError('Sketches with different bins cannot be merged')
+        if other.state is None:
+            return self
+        if self.state is None:
+            self.state = {k: v.copy() for k, v in other.state.items()}
+            self.dims, self.coords = other.dims, other.coords
+        else:
+            self.state = merge_states(self.state, other.state)
+        return self
+
+    def quantile(self, q):
+        '''
+        Quantile map(s). q is a float or a list of floats between 0 and 1;
+        for a list, the maps are stacked along a 'quantile' dimension.
+        '''
+        if self.state is None:
+            raise ValueError('The sketch is empty')
+        if np.ndim(q) == 0:
+            return xr.DataArray(state_quantile(self.state, self.edges, q),
+                                dims = self.dims, coords = self.coords)
+        maps = [state_quantile(self.state, self.edges, x) for x in q]
+        return xr.DataArray(np.stack(maps), dims = ('quantile',) + self.dims,
+                            coords = dict(self.coords, quantile = list(q)))
+
+    def to_dataset(self):
+        ''' The sketch as a Dataset (see `save`). '''
+        ds = xr.Dataset({'hist': (self.dims + ('bin',), self.state['hist']),
+                         'min': (self.dims, self.state['min']),
+                         'max': (self.dims, self.state['max']),
+                         'edges': ('edge', self.edges)},
+                        coords = self.coords)
+        ds.attrs['description'] = ('Per-pixel histogram quantile sketch: bin 0 '
+                                   'counts values below the first edge and the '
+                                   'last bin values above the last edge')
+        return ds
+
+    def save(self, path):
+        ''' Write the sketch to a netCDF file. '''
+        self.to_dataset().to_netcdf(path, mode = 'w', format = 'NETCDF4',
+                                    encoding = {'hist': {'zlib': True}})
+        return path
+
+    @classmethod
+    def load(cls, path):
+        ''' Read a sketch written with `save`. '''
+        with xr.open_dataset(path) as ds:
+            ds = ds.load()
+        sketch = cls(ds['edges'].values)
+        sketch.dims = ds['min'].dims
+        sketch.coords = {name: c for name, c in ds.coords.items()}
+        sketch.state = {'min': ds['min'].values, 'max': ds['max'].values,
+                        'hist': ds['hist'].values.astype(np.uint32)}
+        return sketch
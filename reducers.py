@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains the time reductions used by `time_downsample` and the
+streaming resampler. Each reduction is a Reducer computed from running
+statistics of blocks of time steps (e.g. sum and count for the mean), which
+can be combined between blocks, bins and files. A block of data is read once
+and fed to every reducer requested for its variable, so several statistics
+of one variable are computed in one pass.
+
+Reducers are looked up by name in REDUCERS:
+    'sum', 'max', 'min', 'mean', 'count' (number of valid values),
+    'var', 'std' (population variance and standard deviation, from Welford
+    running moments combined with Chan's formula),
+    'argmax_time' (time step of the maximum),
+    'count_above_<threshold>' (number of values above the threshold, e.g.
+    'count_above_20').
+Other reductions can be added with `register_reducer`.
+
+"""
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+class Reducer:
+    '''
+    Base class of time reductions. Subclasses set `name` and `stats` (names
+    of the running statistics) and implement `partial`, `combine` and
+    `finalize`, which work on NumPy arrays. The first statistic has the 
+    shape of the reduced data; the others may add trailing dimensions (e.g. 
+    the bins of a histogram).
+    '''
+    name = None
+    stats = ()
+
+    def partial(self, values, axis, times):
+        '''
+        Running statistics of one block of values (dict of {stat: array}),
+        reduced along `axis`. `times` holds the block's time steps.
+        '''
+        raise NotImplementedError
+
+    def combine(self, a, b):
+        ''' Combine running statistics of two consecutive blocks. '''
+        raise NotImplementedError
+
+    def finalize(self, state):
+        ''' The reduction, from running statistics. '''
+        raise NotImplementedError
+
+    def empty(self, shape):
+        ''' Result for a bin without any time step. '''
+        return np.full(shape, np.nan)
+
+    def attrs(self, attrs):
+        ''' Attributes of the output, from those of the input variable. '''
+        return dict(attrs)
+
+
+def _count(values, axis):
+    if np.issubdtype(values.dtype, np.floating):
+        return np.count_nonzero(~np.isnan(values), axis = axis)
+    return np.full(np.delete(values.shape, axis), values.shape[axis])
+
+
+class Sum(Reducer):
+    name = 'sum'
+    stats = ('sum',)
+
+    def partial(self, values, axis, times):
+        return {'sum': np.nansum(values, axis = axis)}
+
+    def combine(self, a, b):
+        return {'sum': a['sum'] + b['sum']}
+
+    def finalize(self, state):
+        return state['sum']
+
+    def empty(self, shape):
+        return np.zeros(shape)
+
+
+class Max(Reducer):
+    name = 'max'
+    stats = ('max',)
+
+    def partial(self, values, axis, times):
+        return {'max': np.fmax.reduce(values, axis = axis)}
+
+    def combine(self, a, b):
+        return {'max': np.fmax(a['max'], b['max'])}
+
+    def finalize(self, state):
+        return state['max']
+
+
+class Min(Reducer):
+    name = 'min'
+    stats = ('min',)
+
+    def partial(self, values, axis, times):
+        return {'min': np.fmin.reduce(values, axis = axis)}
+
+    def combine(self, a, b):
+        return {'min': np.fmin(a['min'], b['min'])}
+
+    def finalize(self, state):
+        return state['min']
+
+
+class Mean(Reducer):
+    name = 'mean'
+    stats = ('sum', 'count')
+
+    def partial(self, values, axis, times):
+        return {'sum': np.nansum(values, axis = axis),
+                'count': _count(values, axis)}
+
+    def combine(self, a, b):
+        return {'sum': a['sum'] + b['sum'], 'count': a['count'] + b['count']}
+
+    def finalize(self, state):
+        count = state['count']
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return np.where(count > 0, state['sum'] / count, np.nan)
+
+
+class Count(Reducer):
+    ''' Number of valid (not missing) values. '''
+    name = 'count'
+    stats = ('count',)
+
+    def partial(self, values, axis, times):
+        return {'count': _count(values, axis)}
+
+    def combine(self, a, b):
+        return {'count': a['count'] + b['count']}
+
+    def finalize(self, state):
+        return state['count']
+
+    def empty(self, shape):
+        return np.zeros(shape, dtype = int)
+
+    def attrs(self, attrs):
+        out = {k: v for k, v in attrs.items() if k != 'units'}
+        out['units'] = '1'
+        return out
+
+
+class CountAbove(Count):
+    ''' Number of values above a threshold (e.g. hours of wind above 20 m/s). '''
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.name = 'count_above_{:g}'.format(threshold)
+
+    def partial(self, values, axis, times):
+        return {'count': np.count_nonzero(values > self.threshold, axis = axis)}
+
+
+class Moments(Reducer):
+    '''
+    Variance (or standard deviation with `sqrt`) with `ddof` delta degrees of
+    freedom. Each block's count, mean and sum of squared deviations (M2) are
+    computed directly and blocks are merged with Chan's formula, which stays
+    accurate when the mean is large compared to the spread.
+    '''
+    stats = ('count', 'mean', 'm2')
+
+    def __init__(self, name, sqrt = False, ddof = 0):
+        self.name = name
+        self.sqrt = sqrt
+        self.ddof = ddof
+
+    def partial(self, values, axis, times):
+        count = _count(values, axis)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            mean = np.where(count > 0, np.nansum(values, axis = axis) / count, 0)
+        deviation = values - np.expand_dims(mean, axis)
+        return {'count': count, 'mean': mean,
+                'm2': np.nansum(deviation * deviation, axis = axis)}
+
+    def combine(self, a, b):
+        count = a['count'] + b['count']
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            fraction = np.where(count > 0, b['count'] / count, 0)
+        delta = b['mean'] - a['mean']
+        return {'count': count, 'mean': a['mean'] + delta * fraction,
+                'm2': a['m2'] + b['m2'] + delta * delta * a['count'] * fraction}
+
+    def finalize(self, state):
+        dof = state['count'] - self.ddof
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            out = np.where(dof > 0, state['m2'] / dof, np.nan)
+        return np.sqrt(out) if self.sqrt else out
+
+    def attrs(self, attrs):
+        out = dict(attrs)
+        if 'units' in attrs and not self.sqrt:
+            out['units'] = '({})**2'.format(attrs['units'])
+        return out
+
+
+class ArgmaxTime(Reducer):
+    ''' Time step of the maximum (the first one if it is reached twice). '''
+    name = 'argmax_time'
+    stats = ('max', 'time')
+
+    def partial(self, values, axis, times):
+        filled = np.where(np.isnan(values), -np.inf, values)
+        index = np.argmax(filled, axis = axis)
+        peak = np.fmax.reduce(values, axis = axis)
+        time = np.asarray(times, dtype = 'datetime64[ns]')[index]
+        return {'max': peak, 'time': np.where(np.isnan(peak), np.datetime64('NaT'),
+                                              time)}
+
+    def combine(self, a, b):
+        later = (b['max'] > a['max']) | (np.isnan(a['max']) & ~np.isnan(b['max']))
+        return {'max': np.where(later, b['max'], a['max']),
+                'time': np.where(later, b['time'], a['time'])}
+
+    def finalize(self, state):
+        return state['time']
+
+    def empty(self, shape):
+        return np.full(shape, np.datetime64('NaT'), dtype = 'datetime64[ns]')
+
+    def attrs(self, attrs):
+        return {'long_name': 'time of maximum ' +
+                attrs.get('long_name', '').strip()}
+
+
+REDUCERS = {'sum': Sum(),
+            'max': Max(),
+            'min': Min(),
+            'mean': Mean(),
+            'count': Count(),
+            'var': Moments('var'),
+            'std': Moments('std', sqrt = True),
+            'argmax_time': ArgmaxTime()}
+
+
+def register_reducer(reducer, name = None):
+    ''' Add a Reducer to the registry, under its name unless one is given. '''
+    REDUCERS[name or reducer.name] = reducer
+
+
+def get_reducer(op):
+    ''' The Reducer for an operation name (or the Reducer itself). '''
+    if isinstance(op, Reducer):
+        return op
+    if op in REDUCERS:
+        return REDUCERS[op]
+    if isinstance(op, str) and op.startswith('count_above_'):
+        try:
+            return CountAbove(float(op[len('count_above_'):]))
+        except ValueError:
+            pass
+    raise ValueError('Unknown reduction operation: {}'.format(op))
+
+
+def reduction_specs(var, op):
+    '''
+    Output variables for the variables `var` and their operations `op`, as a
+    list of (output name, input variable, Reducer). An operation is a name or
+    a Reducer, or a list of them to compute several statistics of the same
+    variable; the outputs are then named '<variable>_<reducer name>'.
+    '''
+    specs = []
+    for v, o in zip(var, op):
+        if isinstance(o, (list, tuple)):
+            for x in o:
+                reducer = get_reducer(x)
+                specs.append(('{}_{}'.format(v, reducer.name), v, reducer))
+        else:
+            specs.append((v, v, get_reducer(o)))
+    return specs
+
+
+def bin_positions(times, time_res = None, labels = None):
+    '''
+    (label, first index, end index) of each bin of a sorted time axis. Bins
+    are those of Pandas resample for `time_res` (including empty bins, whose
+    first and end index are equal), or runs of equal `labels`.
+    '''
+    if labels is None:
+        bins = pd.Series(np.arange(len(times)),
+                         index = pd.DatetimeIndex(times)).resample(time_res)
+        end = 0
+        for label, positions in bins:
+            start = positions.values[0] if len(positions) else end
+            end = positions.values[-1] + 1 if len(positions) else end
+            yield np.datetime64(label, 'ns'), start, end
+        return
+    labels = np.asarray(labels)
+    edges = np.flatnonzero(labels[1:] != labels[:-1]) + 1
+    starts = np.concatenate([[0], edges])
+    ends = np.concatenate([edges, [len(labels)]])
+    for start, end in zip(starts, ends):
+        yield labels[start], start, end
+
+
+def bin_states(read, times, reducers, axis, time_res = None, labels = None,
+               block_steps = None):
+    '''
+    Running statistics of every bin, reading the data one block at a time.
+
+    Parameters
+    ----------
+    read : function
+        read(start, end) returns the values of time steps start to end as a
+        NumPy array, with time along `axis`.
+    times : array of datetime64
+        Time steps, in order.
+    reducers : list of Reducers
+        Reductions fed with every block.
+    axis : int
+        Time axis of the blocks.
+    time_res, labels :
+        Bins, see `bin_positions`.
+    block_steps : int (optional)
+        Largest number of time steps read at once; by default one bin.
+
+    Yields
+    ------
+    (label, list of the state of each reducer), with a state of None for
+    empty bins.
+
+    '''
+    times = np.asarray(times, dtype = 'datetime64[ns]')
+    for label, start, end in bin_positions(times, time_res, labels):
+        states = [None] * len(reducers)
+        step = block_steps or max(end - start, 1)
+        for i in range(start, end, step):
+            j = min(i + step, end)
+            values = read(i, j)
+            for k, reducer in enumerate(reducers):
+                state = reducer.partial(values, axis, times[i:j])
+                states[k] = state if states[k] is None else \
+                    reducer.combine(states[k], state)
+        yield label, states
+
+
+def reduce_blocks(read, template, ops, time_res, block_steps = None):
+    '''
+    Resample data read a block at a time with several reductions, in one
+    pass. Bins and labels are those of `template.resample(time = time_res)`.
+
+    read:       function, read(start, end) returns time steps start to end
+                as a NumPy array shaped like template.
+    template:   DataArray giving the dimensions and coordinates.
+    ops:        list of operation names or Reducers.
+
+    Returns a list of DataArrays, one per operation.
+    '''
+    reducers = [get_reducer(o) for o in ops]
+    axis = template.get_axis_num('time')
+    shape = template.shape[:axis] + template.shape[axis + 1:]
+    labels = []
+    results = [[] for _ in reducers]
+    for label, states in bin_states(read, template.time.values, reducers, axis,
+                                    time_res = time_res,
+                                    block_steps = block_steps):
+        labels.append(label)
+        for k, (reducer, state) in enumerate(zip(reducers, states)):
+            results[k].append(reducer.empty(shape) if state is None
+                              else reducer.finalize(state))
+
+    coords = {name: c for name, c in template.coords.items()
+              if 'time' not in c.dims}
+    coords['time'] = np.array(labels, dtype = 'datetime64[ns]')
+    return [xr.DataArray(np.stack(r, axis = axis), dims = template.dims,
+                         coords = coords, name = template.name)
+            for r in results]
+
+
+def resample_reduce(da, ops, time_res, block_steps = None):
+    '''
+    Resample a DataArray by time with several reductions, reading each block
+    of time steps once. Returns a list of DataArrays, one per operation.
+    '''
+    read = lambda start, end: np.asarray(da.isel(time = slice(start, end)).values)
+    return reduce_blocks(read, da, ops, time_res, block_steps)
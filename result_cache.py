@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains a content-addressed cache of the files written by
+`time_downsample` and `aggregate_files`, so that rerunning a script with
+the same inputs and settings returns the stored output without reading or
+reducing any data.
+
+Each result is keyed on the fingerprints of its input files (name, size and
+modification time, or a SHA-256 of their contents), the reduction settings
+(variables, operations, time resolution, encoding, region, ...) and the code
+version, a hash of the source of the reduction modules, so that a code
+change invalidates older results. Results are stored as files in the cache
+directory and indexed in a sqlite file. When the cache grows past its disk
+budget, the least recently used results are removed first.
+
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from download_manifest import file_checksum
+
+INDEX_NAME = 'index.sqlite'
+
+# Modules whose source determines the results
+_CODE_MODULES = ('netcdf_time_downsample', 'streaming_resample', 'reducers',
+                 'derived_variables', 'quantile_sketch', 'spatial_subset',
+                 'netcdf_encoding', 'packed_reduce', 'spatial_coarsen')
+
+_code_version = None
+
+# Caches opened by `ResultCache.resolve`, by (process id, directory)
+_resolved = {}
+_resolved_lock = threading.Lock()
+
+
+def code_version():
+    ''' Hash of the source of the reduction modules. '''
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for module in _CODE_MODULES:
+            path = os.path.join(here, module + '.py')
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+def fingerprint(path, mode = 'stat'):
+    '''
+    Fingerprint of an input file: its name, size and modification time
+    ('stat', fast), or the SHA-256 checksum of its contents ('hash').
+    '''
+    if mode == 'hash':
+        return file_checksum(path)
+    if mode != 'stat':
+        raise ValueError('fingerprint mode must be "stat" or "hash"')
+    st = os.stat(path)
+    return [os.path.basename(path), st.st_size, st.st_mtime_ns]
+
+
+def _describe(obj):
+    ''' JSON form of settings that are not plain JSON (arrays, reducers). '''
+    if isinstance(obj, np.ndarray):
+        return hashlib.sha256(obj.tobytes()).hexdigest()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if hasattr(obj, 'dims') and hasattr(obj, 'values'):
+        # DataArray (e.g. a region mask)
+        return [list(obj.dims), _describe(np.asarray(obj.values)),
+                {str(k): _describe(np.asarray(v.values))
+                 for k, v in obj.coords.items()}]
+    if callable(obj) and hasattr(obj, '__qualname__'):
+        return '{}.{}'.format(obj.__module__, obj.__qualname__)
+    if hasattr(obj, '__dict__'):
+        return [type(obj).__name__, vars(obj)]
+    raise TypeError('Cannot describe {!r} for the result cache'.format(obj))
+
+
+class ResultCache:
+    '''
+    Cache of output files, stored in a directory. Safe to share between
+    threads.
+
+    Parameters
+    ----------
+    directory : str
+        Cache directory. Created if it does not exist.
+    budget : int (optional)
+        Disk budget in bytes. Least recently used results are removed once
+        the cache is larger. No limit by default.
+    fingerprint : str ('stat' or 'hash')
+        How input files are identified, see `fingerprint`.
+
+    '''
+    def __init__(self, directory, budget = None, fingerprint = 'stat'):
+        os.makedirs(directory, exist_ok = True)
+        self.directory = directory
+        self.budget = budget
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, INDEX_NAME),
+                                     check_same_thread = False)
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                               'key TEXT PRIMARY KEY, filename TEXT, '
+                               'size INTEGER, last_used REAL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS counters ('
+                               'name TEXT PRIMARY KEY, value INTEGER)')
+
+    @classmethod
+    def resolve(cls, cache):
+        '''
+        A ResultCache for a cache argument (a ResultCache or directory). A
+        directory gives the same instance on every call in a process, so 
+        its sqlite connection is opened once, and its session counters (see 
+        `stats`) add up over the calls. Close it with `close_resolved`.
+        '''
+        if cache is None or isinstance(cache, ResultCache):
+            return cache
+        key = (os.getpid(), os.path.abspath(cache))
+        with _resolved_lock:
+            if key not in _resolved:
+                _resolved[key] = cls(cache)
+            return _resolved[key]
+
+    @staticmethod
+    def close_resolved():
+        ''' Close the caches opened by `resolve` in this process. '''
+        with _resolved_lock:
+            for key in [k for k in _resolved if k[0] == os.getpid()]:
+                _resolved.pop(key).close()
+
+    def key(self, kind, input_paths, settings):
+        '''
+        Key of a result: a hash of the kind of operation, the input file
+        fingerprints, the settings (a JSON-able dict; arrays, DataArrays and
+        reducers are described by their contents, and a region mask file by
+        its fingerprint) and the code version.
+        '''
+        region = settings.get('region')
+        if isinstance(region, dict) and isinstance(region.get('mask'), str):
+            # Editing the mask file changes the result
+            mask = region['mask']
+            settings = dict(settings, region = dict(
+                region, mask = [mask, fingerprint(mask, self.fingerprint)]))
+        text = json.dumps([kind, [fingerprint(p, self.fingerprint)
+                                  for p in input_paths],
+                           settings, code_version()],
+                          sort_keys = True, default = _describe)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, key, output_dir = None, output_filepath = None):
+        '''
+        Copy the stored result for key to output_filepath (or to output_dir 
+        followed by the name it was stored under) and return its path, or 
+        return None on a miss.
+        '''
+        with self._lock:
+            row = self._conn.execute('SELECT filename FROM results WHERE '
+                                     'key = ?', (key,)).fetchone()
+        stored = None if row is None else self._path(key)
+        if stored is None or not os.path.exists(stored):
+            self._count('misses')
+            return None
+        target = output_filepath or output_dir + row[0]
+        tmp = target + '.cache.part'
+        shutil.copyfile(stored, tmp)
+        os.replace(tmp, target)
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE results SET last_used = ? WHERE key = ?',
+                               (time.time(), key))
+        self._count('hits')
+        return target
+
+    def put(self, key, path, name = None):
+        '''
+        Store a copy of the output file for key, then enforce the budget. 
+        `name` is the name given back by `get` with an output_dir (by 
+        default the file name).
+        '''
+        size = os.path.getsize(path)
+        if self.budget is not None and size > self.budget:
+            return
+        stored = self._path(key)
+        tmp = stored + '.part'
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, stored)
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO results VALUES '
+                               '(?, ?, ?, ?)', 
+                               (key, name or os.path.basename(path), size, 
+                                time.time()))
+        self.evict()
+
+    def evict(self, budget = None):
+        ''' Remove least recently used results until the cache fits budget. '''
+        budget = self.budget if budget is None else budget
+        if budget is None:
+            return
+        with self._lock, self._conn:
+            rows = self._conn.execute('SELECT key, size FROM results ORDER BY '
+                                      'last_used DESC').fetchall()
+            total = 0
+            for key, size in rows:
+                total += size
+                if total > budget:
+                    self._conn.execute('DELETE FROM results WHERE key = ?',
+                                       (key,))
+                    if os.path.exists(self._path(key)):
+                        os.remove(self._path(key))
+
+    def stats(self):
+        '''
+        Counters: hits and misses of this session, total hits and misses of
+        the cache, number of results and their size in bytes.
+        '''
+        with self._lock:
+            counters = dict(self._conn.execute('SELECT name, value FROM '
+                                               'counters').fetchall())
+            entries, size = self._conn.execute('SELECT COUNT(*), '
+                                               'COALESCE(SUM(size), 0) FROM '
+                                               'results').fetchone()
+        return {'hits': self.hits, 'misses': self.misses,
+                'total_hits': counters.get('hits', 0),
+                'total_misses': counters.get('misses', 0),
+                'entries': entries, 'bytes': size}
+
+    def close(self):
+        self._conn.close()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.nc')
+
+    def _count(self, name):
+        setattr(self, name, getattr(self, name) + 1)
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR IGNORE INTO counters VALUES (?, 0)',
+                               (name,))
+            self._conn.execute('UPDATE counters SET value = value + 1 WHERE '
+                               'name = ?', (name,))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains the spatial coarsening applied by `time_downsample` to
+each reduced file, in the same pass as the time reduction (e.g. ERA5-Land at
+0.1 degrees to 1 degree daily means), so the fine-grid output is never
+written or read again. With dask inputs the coarsening is part of the task
+graph and runs chunk by chunk.
+
+A coarsening is:
+    an int:  block factor on both latitude and longitude (e.g. 4 for 0.25 to
+             1 degree).
+    a dict with the keys:
+        factor:   int, or (latitude factor, longitude factor), for blocks.
+        grid:     target grid for area-weighted (conservative) regridding:
+                  (latitudes, longitudes) of the cell centres, or a Dataset
+                  or DataArray on that grid. Use either factor or grid.
+        op:       'mean' (default), 'sum', 'max' or 'min' of the cells of a
+                  block. Regridding only computes means.
+        weighted: boolean, weight block means by cell area (cosine of the
+                  latitude). Default True.
+
+Missing values (e.g. outside a land mask) are skipped: a coarse cell is the
+mean of its valid fine cells, and missing if it has none. Blocks at the end
+of an axis that does not divide by the factor are kept, with the cells
+available. Regridding is separable: the overlap of a fine and a coarse cell
+is the product of their overlaps in sin(latitude) and in longitude, which
+is exact for regular latitude/longitude grids.
+
+"""
+import numpy as np
+import xarray as xr
+
+from spatial_subset import grid_names
+
+COARSEN_OPS = ('mean', 'sum', 'max', 'min')
+
+
+def resolve_coarsening(coarsen):
+    '''
+    Turn a coarsening into a dict with the keys factor ((latitude factor,
+    longitude factor) or None), grid ((latitudes, longitudes) or None), op
+    and weighted. Returns None for no coarsening.
+    '''
+    if coarsen is None:
+        return None
+    if not isinstance(coarsen, dict):
+        coarsen = {'factor': coarsen}
+    factor = coarsen.get('factor')
+    grid = coarsen.get('grid')
+    op = coarsen.get('op', 'mean')
+    if (factor is None) == (grid is None):
+        raise ValueError('A coarsening has either a factor or a grid')
+    if op not in COARSEN_OPS or (grid is not None and op != 'mean'):
+        raise ValueError('Unsupported coarsening op: {}'.format(op))
+    if factor is not None:
+        factor = tuple(int(f) for f in np.broadcast_to(factor, 2))
+        if min(factor) < 1:
+            raise ValueError('Coarsening factors must be at least 1')
+    if isinstance(grid, (xr.Dataset, xr.DataArray)):
+        lat_name, lon_name = grid_names(grid)
+        grid = (grid[lat_name].values, grid[lon_name].values)
+    elif grid is not None:
+        grid = (np.asarray(grid[0], dtype = float),
+                np.asarray(grid[1], dtype = float))
+    return {'factor': factor, 'grid': grid, 'op': op,
+            'weighted': coarsen.get('weighted', True)}
+
+
+def coarsen_dataset(ds, coarsen):
+    '''
+    Coarsen the variables of a Dataset on the latitude/longitude grid (see
+    the module docstring). Other variables are kept as they are.
+    '''
+    coarsen = resolve_coarsening(coarsen)
+    if coarsen is None:
+        return ds
+    lat_name, lon_name = grid_names(ds)
+    on_grid = [name for name, da in ds.data_vars.items()
+               if lat_name in da.dims and lon_name in da.dims]
+    out = ds.drop_vars(on_grid + [lat_name, lon_name])
+    for name in on_grid:
+        out[name] = coarsen_array(ds[name], coarsen)
+    return out
+
+
+def coarsen_array(da, coarsen):
+    ''' Coarsen a DataArray on the latitude/longitude grid. '''
+    coarsen = resolve_coarsening(coarsen)
+    if coarsen is None:
+        return da
+    lat_name, lon_name = grid_names(da)
+    if coarsen['grid'] is not None:
+        out = _regrid(da, lat_name, lon_name, *coarsen['grid'])
+    else:
+        out = _coarsen_blocks(da, lat_name, lon_name, coarsen['factor'],
+                              coarsen['op'], coarsen['weighted'])
+    out.attrs = dict(da.attrs)
+    out.name = da.name
+    return out
+
+
+def _coarsen_blocks(da, lat_name, lon_name, factor, op, weighted):
+    ''' Reduce blocks of factor[0] x factor[1] grid cells. '''
+    windows = {lat_name: factor[0], lon_name: factor[1]}
+    coord_func = {lat_name: 'mean', lon_name: _block_lon}
+    def blocks(x):
+        return x.coarsen(windows, boundary = 'pad', coord_func = coord_func)
+
+    if op != 'mean' or not weighted:
+        return getattr(blocks(da), op)()
+    # Area-weighted mean of the valid cells
+    weights = np.cos(np.deg2rad(da[lat_name])).clip(0)
+    total = blocks(da.fillna(0) * weights).sum()
+    area = blocks(da.notnull() * weights).sum()
+    return total / area.where(area > 0)
+
+
+def _block_lon(lon, axis):
+    ''' Centre longitude of a block, across the 0/360 wrap too. '''
+    angle = np.deg2rad(lon)
+    centre = np.rad2deg(np.arctan2(np.nanmean(np.sin(angle), axis = axis),
+                                   np.nanmean(np.cos(angle), axis = axis)))
+    # Keep the convention of the input (0 to 360, or -180 to 180)
+    return np.mod(centre, 360) if np.nanmin(lon) >= 0 else centre
+
+
+def _edges(centres, lo = None, hi = None):
+    ''' Cell edges, halfway between the centres (ascending). '''
+    c = np.sort(np.asarray(centres, dtype = float))
+    if len(c) == 1:
+        raise ValueError('A grid axis needs at least two cells')
+    edges = np.concatenate([[c[0] - (c[1] - c[0]) / 2], (c[1:] + c[:-1]) / 2,
+                            [c[-1] + (c[-1] - c[-2]) / 2]])
+    return np.clip(edges, lo, hi) if lo is not None else edges
+
+
+def _axis_weights(src, dst, transform, period = None):
+    '''
+    Overlap weights between the cells of two grid axes (given by their
+    centres, in any order), as (dst index, src index, weight) arrays sorted
+    by dst index. The weight of an overlap [a, b] is transform(b) -
+    transform(a). With a period (360 for longitudes), cells overlap modulo
+    the period.
+    '''
+    bounds = dict(lo = -90.0, hi = 90.0) if period is None else {}
+    se, de = _edges(src, **bounds), _edges(dst, **bounds)
+    src_order, dst_order = np.argsort(src), np.argsort(dst)
+    lo, hi = se[:-1], se[1:]
+    shifts = [0.0] if period is None else \
+        [k * period + np.floor((de[0] - lo[0]) / period) * period
+         for k in (-1, 0, 1, 2)]
+
+    d_idx, s_idx, weights = [], [], []
+    for shift in shifts:
+        a, b = lo + shift, hi + shift
+        first = np.clip(np.searchsorted(de, a, 'right') - 1, 0, len(dst) - 1)
+        last = np.clip(np.searchsorted(de, b, 'left') - 1, 0, len(dst) - 1)
+        for k in range(int((last - first).max()) + 1 if len(src) else 0):
+            j = np.minimum(first + k, last)
+            top = np.minimum(b, de[j + 1])
+            bottom = np.maximum(a, de[j])
+            keep = (first + k <= last) & (top > bottom)
+            d_idx.append(dst_order[j[keep]])
+            s_idx.append(src_order[np.flatnonzero(keep)])
+            weights.append(transform(top[keep]) - transform(bottom[keep]))
+    d_idx, s_idx = np.concatenate(d_idx), np.concatenate(s_idx)
+    weights = np.concatenate(weights)
+    order = np.argsort(d_idx, kind = 'stable')
+    return d_idx[order], s_idx[order], weights[order]
+
+
+def _apply_weights(values, axis, mapping, n):
+    ''' Weighted sums of values along an axis into n cells. '''
+    d_idx, s_idx, weights = mapping
+    shape = [1] * values.ndim
+    shape[axis] = len(weights)
+    taken = np.take(values, s_idx, axis = axis) * weights.reshape(shape)
+    out_shape = list(values.shape)
+    out_shape[axis] = n
+    out = np.zeros(out_shape, dtype = taken.dtype)
+    if len(d_idx):
+        starts = np.flatnonzero(np.r_[True, d_idx[1:] != d_idx[:-1]])
+        index = [slice(None)] * values.ndim
+        index[axis] = d_idx[starts]
+        out[tuple(index)] = np.add.reduceat(taken, starts, axis = axis)
+    return out
+
+
+def _regrid(da, lat_name, lon_name, lat, lon):
+    ''' Area-weighted mean of the valid cells overlapping each target cell. '''
+    lat_map = _axis_weights(da[lat_name].values, lat,
+                            lambda x: np.sin(np.deg2rad(x)))
+    lon_map = _axis_weights(da[lon_name].values, lon, lambda x: x,
+                            period = 360.0)
+
+    def regrid(values):
+        # values have latitude and longitude as their last two axes
+        valid = ~np.isnan(values)
+        if valid.all():
+            valid = np.ones(values.shape[-2:])
+        area = _apply_weights(_apply_weights(valid, -2, lat_map, len(lat)),
+                              -1, lon_map, len(lon))
+        total = _apply_weights(_apply_weights(np.where(np.isnan(values), 0,
+                                                       values),
+                                              -2, lat_map, len(lat)),
+                               -1, lon_map, len(lon))
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return np.where(area > 0, total / area, np.nan)
+
+    out = xr.apply_ufunc(regrid, da,
+                         input_core_dims = [[lat_name, lon_name]],
+                         output_core_dims = [['__lat', '__lon']],
+                         dask = 'parallelized',
+                         output_dtypes = [np.result_type(da.dtype, float)],
+                         dask_gufunc_kwargs = {
+                             'output_sizes': {'__lat': len(lat),
+                                              '__lon': len(lon)},
+                             'allow_rechunk': True})
+    out = out.rename({'__lat': lat_name, '__lon': lon_name})
+    out = out.assign_coords({lat_name: np.asarray(lat),
+                             lon_name: np.asarray(lon)})
+    return out.transpose(*da.dims)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains the spatial subset used by the download and reduction
+functions, so that a study of one region only transfers, reads and reduces
+the grid cells of that region.
+
+A region is a bounding box [north, west, south, east] (the order of the CDS
+'area' parameter), or a dict with the keys:
+    area:      [north, west, south, east] (optional if a mask is given).
+    mask:      DataArray over latitude/longitude, or path to a netCDF file
+               holding one; cells where the mask is above `threshold` are
+               kept, the others are set to missing.
+    mask_var:  variable of the mask file (default: its first variable).
+    threshold: float, default 0.5 (e.g. for a fractional land-sea mask).
+
+The same region is passed as the CDS 'area' at download time (`cds_area`)
+and applied at open time as a lazy slice of the latitude/longitude axes
+(`subset_dataset`), before any data is read or decoded. Latitudes may be
+ascending or descending, and longitudes may run 0 to 360 or -180 to 180; a
+box may cross the antimeridian or the prime meridian (west > east).
+
+"""
+import numpy as np
+import xarray as xr
+
+LAT_NAMES = ('latitude', 'lat')
+LON_NAMES = ('longitude', 'lon')
+
+
+def resolve_region(region):
+    '''
+    Turn a region into (area, mask): area as [north, west, south, east] or
+    None, and mask as a boolean DataArray or None.
+    '''
+    if region is None:
+        return None, None
+    if not isinstance(region, dict):
+        return _check_area(region), None
+
+    mask = region.get('mask')
+    if isinstance(mask, str):
+        with xr.open_dataset(mask) as ds:
+            name = region.get('mask_var') or list(ds.data_vars)[0]
+            mask = ds[name].load()
+    if mask is not None:
+        mask = mask.squeeze(drop = True) > region.get('threshold', 0.5)
+    area = region.get('area')
+    if area is None and mask is not None:
+        area = _mask_area(mask)
+    return (None if area is None else _check_area(area)), mask
+
+
+def cds_area(region):
+    ''' CDS 'area' request parameter for a region (None for no region). '''
+    area, _ = resolve_region(region)
+    if area is None:
+        return None
+    north, west, south, east = area
+    if east - west >= 360:
+        return [north, -180.0, south, 180.0]
+    # CDS expects longitudes between -180 and 180
+    return [north, _lon180(west), south, _lon180(east)]
+
+
+def subset_indexers(lat, lon, area):
+    '''
+    Indexers of the latitude and longitude values inside the area: a slice
+    for a contiguous run of indices, else an integer array (e.g. a box that
+    wraps around the end of the longitude axis).
+    '''
+    north, west, south, east = area
+    lat = np.asarray(lat)
+    lat_index = np.flatnonzero((lat >= south) & (lat <= north))
+
+    lon360 = np.mod(np.asarray(lon), 360)
+    if east - west >= 360:
+        inside = np.ones(len(lon360), dtype = bool)
+    else:
+        w, e = west % 360, east % 360
+        inside = (lon360 >= w) & (lon360 <= e) if w <= e else \
+            (lon360 >= w) | (lon360 <= e)
+    lon_index = np.flatnonzero(inside)
+    # West to east from the western edge of the box
+    lon_index = lon_index[np.argsort(np.mod(lon360[lon_index] - west, 360),
+                                     kind = 'stable')]
+
+    if not len(lat_index) or not len(lon_index):
+        raise ValueError('No grid cells in the area {}'.format(list(area)))
+    return _as_slice(lat_index), _as_slice(lon_index)
+
+
+def subset_dataset(ds, region):
+    '''
+    Subset a Dataset to a region. The slice is lazy: with a Dataset opened
+    with `xr.open_dataset`, only the region is read from disk. Variables on
+    the grid are set to missing outside the mask, if there is one.
+    '''
+    area, mask = resolve_region(region)
+    if area is None and mask is None:
+        return ds
+    lat_name, lon_name = grid_names(ds)
+    if area is not None:
+        lat_index, lon_index = subset_indexers(ds[lat_name].values,
+                                               ds[lon_name].values, area)
+        ds = ds.isel({lat_name: lat_index, lon_name: lon_index})
+    if mask is not None:
+        keep = align_mask(mask, ds[lat_name].values, ds[lon_name].values)
+        keep = xr.DataArray(keep, dims = (lat_name, lon_name))
+        for name, da in ds.data_vars.items():
+            if lat_name in da.dims and lon_name in da.dims:
+                ds[name] = da.where(keep)
+    return ds
+
+
+def align_mask(mask, lat, lon):
+    ''' Boolean mask values at the given latitudes and longitudes. '''
+    lat_name, lon_name = grid_names(mask)
+    mask = mask.assign_coords({lon_name: np.mod(mask[lon_name].values, 360)})
+    mask = mask.sortby(lon_name)
+    values = mask.sel({lat_name: xr.DataArray(np.asarray(lat), dims = 'y'),
+                       lon_name: xr.DataArray(np.mod(np.asarray(lon), 360),
+                                              dims = 'x')},
+                      method = 'nearest')
+    return values.transpose('y', 'x').values.astype(bool)
+
+
+def grid_names(ds):
+    '''
+    Names of the latitude and longitude coordinates of a Dataset or 
+    DataArray (or in a dict of variables, e.g. of a netCDF4 Dataset).
+    '''
+    names = getattr(ds, 'coords', ds)
+    lat = [n for n in LAT_NAMES if n in names]
+    lon = [n for n in LON_NAMES if n in names]
+    if not lat or not lon:
+        raise ValueError('No latitude/longitude coordinates found')
+    return lat[0], lon[0]
+
+
+def _check_area(area):
+    area = [float(x) for x in area]
+    if len(area) != 4:
+        raise ValueError('An area is [north, west, south, east]')
+    if area[0] < area[2]:
+        raise ValueError('The north of the area is below its south: {}'
+                         .format(area))
+    return area
+
+
+def _mask_area(mask):
+    ''' Smallest box around the cells of a mask that are kept. '''
+    lat_name, lon_name = grid_names(mask)
+    kept = mask.transpose(lat_name, lon_name).values
+    lat = mask[lat_name].values[kept.any(axis = 1)]
+    lon = np.mod(mask[lon_name].values[kept.any(axis = 0)], 360)
+    if not len(lat):
+        raise ValueError('The mask does not keep any grid cell')
+    # Box around the longitudes, leaving out the widest gap between them
+    lon = np.sort(lon)
+    gaps = np.diff(np.concatenate([lon, [lon[0] + 360]]))
+    widest = int(np.argmax(gaps))
+    west = lon[(widest + 1) % len(lon)]
+    east = lon[widest]
+    return [lat.max(), west, lat.min(), east if east >= west else east + 360]
+
+
+def _lon180(lon):
+    return (lon + 180) % 360 - 180 if lon != 180 else lon
+
+
+def _as_slice(index):
+    if len(index) > 1 and (np.diff(index) == 1).all():
+        return slice(int(index[0]), int(index[-1]) + 1)
+    if len(index) == 1:
+        return slice(int(index[0]), int(index[0]) + 1)
+    return index
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains a streaming resampler for time down-sampling a sequence of
+netCDF files. Files are read in time order and a running sum/max/min/count is
+kept only for the bin that is still open at the end of the last file, so a
+bin (day, month, year) that spans several input files is reduced exactly once
+and memory does not grow with the number of files. The running statistics
+are those of the Reducers in `reducers`.
+
+"""
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from derived_variables import derived_attrs, derived_reader
+from reducers import reduction_specs, bin_states, bin_positions
+
+
+def _state_name(v, stat):
+    return '{}__{}'.format(v, stat)
+
+
+def fixed_step(time_res):
+    ''' Bin width as a timedelta64 for fixed-length resolutions, else None. '''
+    offset = pd.tseries.frequencies.to_offset(time_res)
+    if isinstance(offset, pd.offsets.Day):
+        return np.timedelta64(offset.n, 'D').astype('timedelta64[ns]')
+    if isinstance(offset, pd.offsets.Tick):
+        return pd.Timedelta(offset).to_timedelta64().astype('timedelta64[ns]')
+    return None
+
+
+def bin_origin(times):
+    '''
+    Origin of fixed-length bins for data starting at times[0]: midnight of 
+    its first day, as Pandas/xarray resample does by default ('start_day').
+    '''
+    return np.datetime64(np.asarray(times, dtype = 'datetime64[ns]')[0], 'D')
+
+
+def bin_labels(times, time_res, origin = None):
+    '''
+    Label of the bin each time step falls in. Fixed-length bins (hours, days)
+    start at `origin` (by default `bin_origin(times)`, as in resample); pass
+    the origin of the first file so that bins line up between files. 
+    Calendar bins (months, years) use the Pandas resample labels.
+    '''
+    step = fixed_step(time_res)
+    if step is None:
+        index = pd.DatetimeIndex(times)
+        labels = np.empty(len(index), dtype = 'datetime64[ns]')
+        for label, group in pd.Series(np.arange(len(index)), 
+                                      index = index).resample(time_res):
+            labels[group.values] = label
+        return labels
+    if origin is None:
+        origin = bin_origin(times)
+    start = np.datetime64(origin, 'ns').astype('int64')
+    t = np.asarray(times, dtype = 'datetime64[ns]').astype('int64') - start
+    width = step.astype('int64')
+    return ((t // width) * width + start).astype('datetime64[ns]')
+
+
+def partial_state(ds, var, op, time_res, origin = None, derived = None):
+    '''
+    Reduce a Dataset to per-bin running statistics.
+
+    Parameters
+    ----------
+    ds : xarray Dataset
+        Data with a 'time' dimension.
+    var : list of strings
+        Variables to reduce.
+    op : list
+        Reduction operation(s) for each variable (see 
+        `reducers.reduction_specs`).
+    time_res : str
+        New time resolution in Pandas datetime syntax.
+    origin : datetime64 (optional)
+        Start of the fixed-length bins, see `bin_labels`.
+    derived : dict (optional)
+        Variables of var derived from variables of ds, as {name: (kind, 
+        [input names], attrs)} (see `derived_variables`). They are 
+        evaluated one bin at a time while reducing, so the derived field of
+        the whole Dataset is never held in memory.
+
+    Returns
+    -------
+    Dataset with one '<output>__<stat>' variable per running statistic.
+
+    '''
+    labels = bin_labels(ds.time.values, time_res, origin)
+    specs = reduction_specs(var, op)
+    state = xr.Dataset()
+    for v in dict.fromkeys(v for _, v, _ in specs):
+        # Every reducer of a variable is fed from the same read of each bin
+        outputs = [(name, reducer) for name, source, reducer in specs 
+                   if source == v]
+        if derived and v in derived:
+            kind, inputs, _ = derived[v]
+            da = ds[inputs[0]]
+            read = derived_reader(ds, kind, inputs)
+        else:
+            da = ds[v]
+            read = lambda start, end: np.asarray(da.isel(time = slice(start, end)).values)
+        bins = list(bin_states(read, ds.time.values, [r for _, r in outputs], 
+                               da.get_axis_num('time'), labels = labels))
+        times = np.array([label for label, _ in bins], dtype = 'datetime64[ns]')
+        for k, (name, reducer) in enumerate(outputs):
+            for stat in reducer.stats:
+                state[_state_name(name, stat)] = _stack(
+                    da, times, [states[k][stat] for _, states in bins], 
+                    _state_name(name, stat))
+    return state
+
+
+def _stack(template, times, arrays, name):
+    '''
+    DataArray of per-bin arrays, with the other coordinates of template. 
+    Statistics with more dimensions than the data (e.g. histograms) get 
+    trailing dimensions named after the statistic.
+    '''
+    axis = template.get_axis_num('time')
+    coords = {c: coord for c, coord in template.coords.items() 
+              if 'time' not in coord.dims and set(coord.dims) <= set(template.dims)}
+    coords['time'] = times
+    extra = np.ndim(arrays[0]) - (template.ndim - 1)
+    dims = template.dims + tuple('{}_{}'.format(name, i) for i in range(extra))
+    return xr.DataArray(np.stack(arrays, axis = axis), dims = dims, 
+                        coords = coords)
+
+
+def _reducer_state(state, name, reducer, index = None):
+    ''' Running statistics of one output as a dict of NumPy arrays. '''
+    out = {}
+    for stat in reducer.stats:
+        da = state[_state_name(name, stat)]
+        out[stat] = da.values if index is None else da.isel(time = index).values
+    return out
+
+
+def regroup_state(state, var, op, time_res, origin = None):
+    '''
+    Reduce running statistics of fine bins (e.g. days) to coarser bins (e.g. 
+    months), as if they had been computed from the original data.
+    '''
+    labels = bin_labels(state.time.values, time_res, origin)
+    bins = list(bin_positions(state.time.values, labels = labels))
+    times = np.array([label for label, _, _ in bins], dtype = 'datetime64[ns]')
+    regrouped = xr.Dataset()
+    for name, _, reducer in reduction_specs(var, op):
+        template = state[_state_name(name, reducer.stats[0])]
+        merged = []
+        for _, start, end in bins:
+            acc = _reducer_state(state, name, reducer, start)
+            for i in range(start + 1, end):
+                acc = reducer.combine(acc, _reducer_state(state, name, reducer, i))
+            merged.append(acc)
+        for stat in reducer.stats:
+            regrouped[_state_name(name, stat)] = _stack(
+                template, times, [m[stat] for m in merged], 
+                _state_name(name, stat))
+    return regrouped
+
+
+def combine_states(a, b, var, op):
+    ''' Combine two partial states covering the same bins. '''
+    combined = xr.Dataset()
+    for name, _, reducer in reduction_specs(var, op):
+        merged = reducer.combine(_reducer_state(a, name, reducer), 
+                                 _reducer_state(b, name, reducer))
+        for stat in reducer.stats:
+            template = a[_state_name(name, stat)]
+            combined[_state_name(name, stat)] = template.copy(data = merged[stat])
+    return combined
+
+
+class StreamingResampler:
+    '''
+    Resample a sequence of Datasets, given in time order, to a new time
+    resolution. Call `update` with each Dataset; it returns the bins that
+    are closed by that Dataset. Call `flush` after the last Dataset to get
+    the remaining bin.
+
+    Parameters
+    ----------
+    var : list of strings
+        Variables to reduce.
+    op : list
+        Reduction operation for each variable: a name in `reducers.REDUCERS`
+        (e.g. 'sum', 'max', 'mean', 'std') or a Reducer, or a list of them 
+        for several outputs named '<variable>_<operation>'.
+    time_res : str
+        New time resolution in Pandas datetime syntax (e.g. '1D', '1M').
+        Fixed-length bins start at midnight of the first day of the first
+        Dataset, as with resample on the whole data (see `bin_labels`).
+    derived : dict (optional)
+        Variables of var derived from the Datasets' variables, evaluated one
+        bin at a time (see `partial_state`).
+
+    '''
+    def __init__(self, var, op, time_res, derived = None):
+        self.var = list(var)
+        self.op = list(op)
+        self.time_res = time_res
+        self.derived = dict(derived or {})
+        self.specs = reduction_specs(self.var, self.op)
+        self.attrs = {}
+        self.origin = None
+        self._open = None
+
+    def update(self, ds):
+        '''
+        Add the next Dataset. Returns a Dataset with the bins that closed,
+        or None if every bin seen so far may still continue.
+        '''
+        self._keep_attrs(ds)
+        self._set_origin(ds)
+        state = partial_state(ds, self.var, self.op, self.time_res, 
+                              self.origin, self.derived).load()
+        return self.finalize(self._push(state))
+
+    def update_state(self, state):
+        '''
+        Add running statistics of finer bins, such as the closed states of a
+        StreamingResampler with the same variables and operations at a finer
+        resolution. Returns the running statistics of the bins that closed,
+        or None.
+        '''
+        self._set_origin(state)
+        return self._push(regroup_state(state, self.var, self.op, 
+                                        self.time_res, self.origin))
+
+    def flush(self):
+        ''' Return the bin that is still open (or None), and reset. '''
+        return self.finalize(self.flush_state())
+
+    def flush_state(self):
+        ''' Return the running statistics of the open bin (or None), and reset. '''
+        state = self._open
+        self._open = None
+        return state
+
+    def finalize(self, state):
+        ''' Turn running statistics into the requested reductions. '''
+        if state is None:
+            return None
+        out = xr.Dataset()
+        for name, v, reducer in self.specs:
+            template = state[_state_name(name, reducer.stats[0])]
+            out[name] = template.copy(
+                data = reducer.finalize(_reducer_state(state, name, reducer)))
+            out[name].attrs = reducer.attrs(self.attrs.get(v, {}))
+        return out
+
+    def _set_origin(self, ds):
+        ''' Fix the bin origin on the first data seen. '''
+        if self.origin is None:
+            self.origin = bin_origin(ds.time.values)
+
+    def _keep_attrs(self, ds):
+        for v in self.var:
+            if v in self.derived:
+                kind, _, attrs = self.derived[v]
+                self.attrs[v] = dict(derived_attrs(kind), **attrs)
+            else:
+                self.attrs[v] = ds[v].attrs
+
+    def _push(self, state):
+        ''' Merge per-bin statistics with the open bin; return closed bins. '''
+        if self._open is not None:
+            open_time = self._open.time.values[0]
+            first_time = state.time.values[0]
+            if first_time < open_time:
+                raise ValueError('Input is not in time order: {} follows {}'
+                                 .format(first_time, open_time))
+            if first_time == open_time:
+                # The open bin continues into this Dataset
+                head = combine_states(self._open, state.isel(time = [0]), 
+                                      self.var, self.op)
+                state = xr.concat([head, state.isel(time = slice(1, None))],
+                                  dim = 'time')
+            else:
+                state = xr.concat([self._open, state], dim = 'time')
+
+        # Only the last bin can continue into the next Dataset
+        self._open = state.isel(time = [-1])
+        closed = state.isel(time = slice(None, -1))
+        if closed.sizes['time'] == 0:
+            return None
+        return closed
+
+
+class ReductionTree:
+    '''
+    Reduce one stream of Datasets to several time resolutions at once. Each
+    level is a StreamingResampler; the bins closed at one level are fed to 
+    the next, coarser level, so every input value is read once.
+
+    Parameters
+    ----------
+    var : list of strings
+        Variables to reduce.
+    op : list
+        Reduction operation(s) for each variable (see StreamingResampler), 
+        used at every level.
+    time_res : list of strings
+        Time resolutions from finest to coarsest (e.g. ['1D', '1M', '1Y']).
+        Each resolution's bins must nest in the next one's.
+    derived : dict (optional)
+        Variables of var derived from the Datasets' variables, evaluated one
+        bin at a time (see `partial_state`).
+
+    '''
+    def __init__(self, var, op, time_res, derived = None):
+        self.time_res = list(time_res)
+        self.levels = [StreamingResampler(var, op, tr, derived) 
+                       for tr in self.time_res]
+
+    def update(self, ds):
+        '''
+        Add the next Dataset. Returns a dict of {time_res: Dataset of the bins 
+        that closed} for the levels where bins closed.
+        '''
+        first = self.levels[0]
+        for level in self.levels:
+            level._keep_attrs(ds)
+            level._set_origin(ds)
+        state = first._push(partial_state(ds, first.var, first.op, 
+                                          first.time_res, first.origin,
+                                          first.derived).load())
+        closed = {}
+        for index, level in enumerate(self.levels):
+            if index > 0 and state is not None:
+                state = level.update_state(state)
+            if state is None:
+                break
+            closed[level.time_res] = level.finalize(state)
+        return closed
+
+    def flush(self):
+        ''' Return a dict of {time_res: Dataset} with every open bin, and reset. '''
+        closed = {}
+        state = None
+        for level in self.levels:
+            parts = []
+            if state is not None:
+                parts.append(level.update_state(state))
+            parts.append(level.flush_state())
+            parts = [p for p in parts if p is not None]
+            if not parts:
+                state = None
+                continue
+            state = xr.concat(parts, dim = 'time') if len(parts) > 1 else parts[0]
+            closed[level.time_res] = level.finalize(state)
+        return closed
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains a generator of synthetic ERA5-like hourly netCDF files,
+for testing and benchmarking the reduction functions without CDS downloads.
+
+The files look like the CDS downloads: one file per day (or per group of
+days) named '<date>_ERA5_hourly.nc', hourly time steps in 'hours since
+1900-01-01', latitude from north to south, longitude from 0 to 360, and
+variables packed as int16 with a per-file scale_factor and add_offset. The
+fields have a smooth large-scale pattern, a diurnal cycle and noise, so that
+packing and compression behave roughly as on real data. The same seed always
+gives the same files.
+
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from cds_request_plan import _date_span
+
+
+def _wind(rng, lat, lon, hours):
+    ''' 10 m wind component (m s**-1): westerlies plus a moving wave. '''
+    phase = 2 * np.pi * (lon / 360 - hours / 240)
+    return (8 * np.sin(np.deg2rad(2 * lat)) ** 2 * np.sign(lat) +
+            4 * np.sin(phase) + rng.normal(0, 2.5, phase.shape))
+
+
+def _temperature(rng, lat, lon, hours):
+    ''' 2 m temperature (K): latitude gradient and diurnal cycle. '''
+    local_hour = hours + lon / 15
+    return (300 - 40 * np.sin(np.deg2rad(lat)) ** 2 +
+            6 * np.cos(2 * np.pi * (local_hour - 15) / 24) +
+            rng.normal(0, 1, np.broadcast(lat, lon, hours).shape))
+
+
+def _precipitation(rng, lat, lon, hours):
+    ''' Hourly total precipitation (m): dry most of the time. '''
+    shape = np.broadcast(lat, lon, hours).shape
+    wet = rng.random(shape) < 0.3 * np.cos(np.deg2rad(lat)) + 0.05
+    return np.where(wet, rng.gamma(0.6, 0.0008, shape), 0)
+
+
+def _gust(rng, lat, lon, hours):
+    ''' 10 m wind gust since the previous post-processing (m s**-1). '''
+    shape = np.broadcast(lat, lon, hours).shape
+    return np.abs(rng.normal(7, 4, shape)) * 1.4
+
+
+def _pressure(rng, lat, lon, hours):
+    ''' Surface pressure (Pa): mountains and moving weather systems. '''
+    relief = 1500 * np.sin(np.deg2rad(3 * lon)) ** 8 * np.cos(np.deg2rad(lat))
+    wave = 1500 * np.sin(2 * np.pi * (lon / 90 - hours / 120))
+    return 101325 - relief + wave + rng.normal(0, 80, wave.shape)
+
+
+# Variables that can be generated: {name: (function, attributes)}
+SYNTHETIC_VARIABLES = {
+    'u10': (_wind, {'units': 'm s**-1',
+                    'long_name': '10 metre U wind component'}),
+    'v10': (_wind, {'units': 'm s**-1',
+                    'long_name': '10 metre V wind component'}),
+    't2m': (_temperature, {'units': 'K', 'long_name': '2 metre temperature'}),
+    'tp': (_precipitation, {'units': 'm', 'long_name': 'Total precipitation'}),
+    'i10fg': (_gust, {'units': 'm s**-1', 'long_name':
+                      'Instantaneous 10 metre wind gust'}),
+    'sp': (_pressure, {'units': 'Pa', 'long_name': 'Surface pressure'}),
+}
+
+
+def packing(values):
+    '''
+    int16 packing of an array, as in the CDS netCDF files: the scale_factor
+    and add_offset that map its range onto -32766..32766, with -32767 as the
+    fill value.
+    '''
+    low, high = float(np.nanmin(values)), float(np.nanmax(values))
+    scale = (high - low) / (2 ** 16 - 4) or 1.0
+    return {'dtype': 'int16', 'scale_factor': scale,
+            'add_offset': (high + low) / 2, '_FillValue': -32767}
+
+
+def synthetic_dataset(times, nlat = 181, nlon = 360, var = ('u10', 'v10', 'tp'),
+                      seed = 0):
+    '''
+    Dataset of synthetic hourly data at the given times, on a regular global
+    grid of nlat x nlon cells (north to south, and 0 to 360 degrees east).
+    '''
+    times = pd.DatetimeIndex(times)
+    lat = np.linspace(90, -90, nlat)
+    lon = np.linspace(0, 360, nlon, endpoint = False)
+    hours = ((times - pd.Timestamp('1900-01-01')) / pd.Timedelta('1h')).values
+    grid = (hours[:, None, None], lat[None, :, None], lon[None, None, :])
+
+    ds = xr.Dataset(coords = {'longitude': ('longitude', lon.astype('f4'),
+                                            {'units': 'degrees_east'}),
+                              'latitude': ('latitude', lat.astype('f4'),
+                                           {'units': 'degrees_north'}),
+                              'time': times})
+    for v in var:
+        if v not in SYNTHETIC_VARIABLES:
+            raise ValueError('No synthetic variable {}; choose from {}'
+                             .format(v, sorted(SYNTHETIC_VARIABLES)))
+        function, attrs = SYNTHETIC_VARIABLES[v]
+        rng = np.random.default_rng([seed, int(hours[0]),
+                                     sorted(SYNTHETIC_VARIABLES).index(v)])
+        h, la, lo = grid
+        values = np.broadcast_to(function(rng, la, lo, h),
+                                 (len(times), nlat, nlon))
+        ds[v] = (('time', 'latitude', 'longitude'), values.astype('f4'),
+                 dict(attrs))
+    ds.attrs = {'Conventions': 'CF-1.6',
+                'history': 'Synthetic ERA5-like data (synthetic_era5.py)'}
+    return ds
+
+
+def generate_era5(output_dir, n_days = 3, nlat = 181, nlon = 360,
+                  var = ('u10', 'v10', 'tp'), start = '2000-01-01',
+                  days_per_file = 1, packed = True, chunks = None,
+                  zlib = False, file_format = None, seed = 0):
+    '''
+    Write synthetic ERA5-like hourly netCDF files.
+
+    Parameters
+    ----------
+    output_dir : str
+        Directory for the files. Created if it does not exist.
+    n_days : int
+        Number of days of hourly data.
+    nlat, nlon : int
+        Grid size (181 x 360 is a 1 degree global grid, 721 x 1440 the
+        ERA5 0.25 degree grid).
+    var : list of strings
+        Variables, from SYNTHETIC_VARIABLES.
+    start : str
+        First day.
+    days_per_file : int
+        Days in each file.
+    packed : boolean
+        Pack the variables as int16 with a scale_factor and add_offset, as
+        in the CDS files. Otherwise write float32.
+    chunks : dict (optional)
+        netCDF chunk size of each dimension (e.g. {'time': 24, 'latitude':
+        91, 'longitude': 180}). Contiguous storage by default.
+    zlib : boolean
+        Compress the variables.
+    file_format : str (optional)
+        netCDF format. By default 'NETCDF3_64BIT' like the CDS files, or
+        'NETCDF4' when chunks or zlib are set.
+    seed : int
+        Random seed. A file's data only depends on the seed and its dates.
+
+    Returns
+    -------
+    List of the file names, in time order.
+
+    '''
+    os.makedirs(output_dir, exist_ok = True)
+    if file_format is None:
+        file_format = 'NETCDF4' if chunks or zlib else 'NETCDF3_64BIT'
+    days = pd.date_range(start, periods = n_days, freq = 'D')
+
+    files = []
+    for i in range(0, n_days, days_per_file):
+        group = days[i:i + days_per_file]
+        times = pd.date_range(group[0], periods = 24 * len(group), freq = 'h')
+        ds = synthetic_dataset(times, nlat, nlon, var, seed)
+
+        encoding = {'time': {'units': 'hours since 1900-01-01 00:00:00.0',
+                             'calendar': 'gregorian', 'dtype': 'int32'}}
+        for v in var:
+            settings = packing(ds[v].values) if packed else \
+                {'dtype': 'float32', '_FillValue': np.float32(-32767)}
+            if chunks:
+                settings['chunksizes'] = tuple(min(chunks.get(d, n), n) for d, n
+                                               in ds[v].sizes.items())
+            if zlib:
+                settings['zlib'] = True
+            encoding[v] = settings
+
+        filename = '{}_ERA5_hourly.nc'.format(
+            _date_span([d.date() for d in group]))
+        ds.to_netcdf(os.path.join(output_dir, filename), mode = 'w',
+                     format = file_format, encoding = encoding)
+        files.append(filename)
+    return files
@@ -8,8 +8,17 @@ Created on Fri Sep 11 12:22:54 2020
 This file tests the output data for bugs. Run whenever script is changed!
 """
 import os
+import tempfile
+import tracemalloc
+
+import netCDF4
+import numpy as np
+import xarray as xr
+
 from download_ERA5_hourly import download_ERA5_hourly
 from netcdf_time_downsample import windspeed, aggregate_files, time_downsample
+from packed_reduce import PACKED_SUM_RTOL, PACKED_SUM_ATOL
+from synthetic_era5 import generate_era5
 
 def test_downsample_daily_yearly():
     '''
@@ -138,4 +147,77 @@ def test_downsample_daily_yearly():
     
     
 
+def test_packed_matches_decoded():
+    '''
+    Reductions on packed int16 values (packed = True) against the decoded
+    path, on synthetic files with fill values (a pixel without any data on
+    the first day, and scattered missing values). Max and min must be 
+    identical; sum and mean may differ by floating point rounding, within
+    PACKED_SUM_RTOL and PACKED_SUM_ATOL.
+    '''
+    with tempfile.TemporaryDirectory() as tmp:
+        input_dir = tmp + '/in/'
+        generate_era5(input_dir, n_days = 2, nlat = 19, nlon = 36, 
+                      var = ('u10', 'tp'))
+        files = sorted(os.listdir(input_dir))
+        with netCDF4.Dataset(input_dir + files[0], 'a') as nc:
+            for name in ('u10', 'tp'):
+                v = nc.variables[name]
+                v.set_auto_maskandscale(False)
+                values = v[:]
+                values[:, 0, 0] = v._FillValue
+                values[::5, 3, ::4] = v._FillValue
+                v[:] = values
+
+        ops = ['max', 'min', 'sum', 'mean']
+        for time_res in ('1D', '6h'):
+            decoded = xr.load_dataset(time_downsample(
+                input_dir, files, ['u10', 'tp'], [ops, ops], time_res, 
+                tmp + '/decoded_'))
+            packed = xr.load_dataset(time_downsample(
+                input_dir, files, ['u10', 'tp'], [ops, ops], time_res, 
+                tmp + '/packed_', packed = True))
+            for name in ('u10', 'tp'):
+                for op in ops:
+                    a = decoded[name + '_' + op]
+                    b = packed[name + '_' + op]
+                    assert a.dtype == b.dtype
+                    if op in ('max', 'min'):
+                        assert a.identical(b), (name, op, time_res)
+                    else:
+                        np.testing.assert_allclose(
+                            b.values, a.values, rtol = PACKED_SUM_RTOL, 
+                            atol = PACKED_SUM_ATOL, 
+                            err_msg = '{}_{} {}'.format(name, op, time_res))
+            assert np.isnan(packed['u10_max'].values[0, 0, 0])
+    
+
+def test_streaming_derived_memory():
+    '''
+    Streaming with a derived variable (wind speed) evaluates it one bin at a
+    time: the peak memory stays below one hourly field of the input file 
+    (8 days), where the derived field of the whole file alone would take
+    as much.
+    '''
+    with tempfile.TemporaryDirectory() as tmp:
+        input_dir = tmp + '/in/'
+        generate_era5(input_dir, n_days = 8, nlat = 91, nlon = 180, 
+                      var = ('u10', 'v10'), days_per_file = 8)
+        files = sorted(f for f in os.listdir(input_dir) if f.endswith('.nc'))
+        with xr.open_dataset(input_dir + files[0]) as ds:
+            field = ds['u10'].nbytes
+        
+        tracemalloc.start()
+        try:
+            time_downsample(input_dir, files, [['u10', 'v10']], [['max']], 
+                            '1D', tmp + '/', wind_speed = True, 
+                            streaming = True)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert peak < field, (peak, field)
+    
+
+test_packed_matches_decoded()
+test_streaming_derived_memory()
 test_downsample_daily_yearly()
\ No newline at end of file
@@ -11,11 +11,15 @@ Inputs:
         An example input is the output from downsample_monthly_to_yearly.py
 Output:
     (1) One file with the mean of all yearly values.
+    (2) A climatology store (see climatology_store.py), so that a new year is
+        added without reading the other yearly files again.
 """
 
-import os
+import numpy as np
 import xarray as xr
-from netcdf_time_downsample import aggregate_files
+from climatology_store import ClimatologyStore
+from file_catalog import FileCatalog
+from netcdf_encoding import build_encoding
     
 def mean_annual():
     # Inputs:
@@ -26,7 +30,8 @@ def mean_annual():
     start_year = 1982
     end_year = 2019
     
-    aggregate_filepath = '/Users/jashvina/jashvina/GoogleDrive/My Drive/2019_2020_wind_extremes/Data/ERA5/monthly_to_yearly/{}_{}_yearly_aggregate.nc'.format(start_year, end_year)    
+    # Per-pixel sums, counts and extremes of the yearly values already read
+    store_filepath = '/Users/jashvina/jashvina/GoogleDrive/My Drive/2019_2020_wind_extremes/Data/ERA5/monthly_to_yearly/yearly_climatology_store.nc'
     
     # Variable name(s) in input file:
     var = ['tp']
@@ -35,6 +40,9 @@ def mean_annual():
     var_name = 'precip'    
 
     output_dir = '/Users/jashvina/jashvina/GoogleDrive/My Drive/2019_2020_wind_extremes/Data/ERA5/'  
+    
+    # On-disk encoding of the output (see netcdf_encoding.ENCODING_PRESETS)
+    encoding = 'map'
                   
     ############################                  
     
@@ -42,24 +50,33 @@ def mean_annual():
     for i in range(start_year, end_year+1):
         years.append(str(i))
     
-    filepaths= []
-    
-    for file in os.listdir(yearly_dir):
-        for year in years:
-            if file.startswith(year):
-                filepaths.append('{}{}'.format(yearly_dir,file))
-    
+    # Find the yearly files by their time steps, from the directory's catalog
+    catalog = FileCatalog(yearly_dir)
+    catalog.update()
+    filepaths = {}
+    for file in catalog.query((years[0], str(end_year + 1)), var):
+        first = np.datetime64(catalog.metadata(file)['first'], 'ns')
+        filepaths[first.astype('datetime64[Y]').astype(int) + 1970] = \
+            '{}{}'.format(yearly_dir, file)
+    catalog.close()
     
-    aggregate_files(filepaths, aggregate_filepath)
+    # Update the store with the years it does not hold yet
+    store = ClimatologyStore(store_filepath)
+    for year in store.years:
+        if year not in filepaths:
+            store.remove(year)
+    for year, filepath in sorted(filepaths.items()):
+        if year not in store.years:
+            with xr.open_dataset(filepath) as ds:
+                store.add(ds, year = year, var = var)
+    store.save()
     
     #Compute longterm mean
-    agg = xr.open_dataset(aggregate_filepath)
-    longterm_mean = agg.mean(dim = 'time')
-    for v in var:
-        longterm_mean[v].attrs = agg[v].attrs
+    longterm_mean = store.mean()
     
     longterm_mean.to_netcdf(path = '{}{}_{}_ERA5_mean_annual_{}.nc'.format(output_dir, years[0], years[-1], var_name), 
-                            mode = 'w', format = 'NETCDF4', engine = 'netcdf4')
+                            mode = 'w', format = 'NETCDF4', engine = 'netcdf4',
+                            encoding = build_encoding(longterm_mean, encoding))
  
 
 mean_annual()
\ No newline at end of file
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+@author: jashvina
+
+This file contains a Zarr output backend for `time_downsample` and
+`aggregate_files`. A store is created once for the full time axis with
+`init_zarr_store`, with consolidated metadata so that it opens instantly.
+Each writer (e.g. one process per year or month) then writes its own time
+region of the store, and writers of different regions can run at the same
+time. Writers never create the store themselves, since a store sized for one
+writer's time steps would not hold the others, and two writers creating it
+at the same time would overwrite each other.
+
+Every time step has its own chunk along the time dimension, so different
+regions never share a chunk. A `region_written` flag records which time steps
+have been written, so that a rerun can skip the regions that are done.
+
+"""
+
+import os
+
+import dask.array
+import numpy as np
+import xarray as xr
+import zarr
+
+WRITTEN_FLAG = 'region_written'
+
+# Default format written by the installed zarr package
+_ZARR_FORMAT = 3 if int(zarr.__version__.split('.')[0]) >= 3 else 2
+
+
+def init_zarr_store(store, template, times, overwrite = False):
+    '''
+    Create a Zarr store covering `times`, with the variables, grid and
+    attributes of `template`, without writing any data.
+
+    Parameters
+    ----------
+    store : str
+        Path of the Zarr store.
+    template : xarray Dataset
+        Dataset with the output variables (e.g. the result for one file).
+        Only its structure is used.
+    times : array of datetime64
+        Every time step of the full output, in order.
+    overwrite : boolean
+        Replace an existing store. Otherwise an existing store raises an
+        error.
+
+    Time steps that are not written read as missing: NaN for floats, NaT
+    for datetimes (e.g. argmax_time), and the variable's _FillValue (or the
+    smallest integer of its dtype) for integers, e.g. counts. Other dtypes
+    raise a TypeError.
+
+    Returns
+    -------
+    The store path.
+
+    '''
+    times = np.asarray(times, dtype = 'datetime64[ns]')
+    ds = xr.Dataset(attrs = template.attrs)
+    for name, da in template.data_vars.items():
+        if 'time' not in da.dims:
+            ds[name] = da
+            continue
+        shape = tuple(len(times) if d == 'time' else da.sizes[d] for d in da.dims)
+        chunks = tuple(1 if d == 'time' else da.sizes[d] for d in da.dims)
+        fill = _fill_value(da)
+        ds[name] = (da.dims, dask.array.full(shape, fill, dtype = da.dtype,
+                                             chunks = chunks), da.attrs)
+        if da.dtype.kind in 'mM' or np.issubdtype(da.dtype, np.integer):
+            # Unwritten chunks read as the Zarr fill_value, which is the 
+            # _FillValue in Zarr format 2 but a separate setting in format 3.
+            # Datetimes are stored as int64, with NaT as the smallest value.
+            stored = np.iinfo(np.int64).min if da.dtype.kind in 'mM' else fill
+            if '_FillValue' not in da.attrs:
+                ds[name].encoding['_FillValue'] = stored
+            if _ZARR_FORMAT == 3:
+                ds[name].encoding['fill_value'] = stored
+    ds[WRITTEN_FLAG] = ('time', dask.array.zeros(len(times), dtype = 'i1',
+                                                  chunks = 1))
+    ds = ds.assign_coords({name: coord for name, coord in template.coords.items()
+                           if 'time' not in coord.dims})
+    ds = ds.assign_coords(time = times)
+    ds.to_zarr(store, mode = 'w' if overwrite else 'w-', compute = False, 
+               consolidated = True)
+    return store
+
+
+def _fill_value(da):
+    '''
+    Value of the time steps not written yet, for the dtype of da: NaN for
+    floats, NaT for datetimes and timedeltas (e.g. argmax_time), else the
+    variable's _FillValue or the smallest integer.
+    '''
+    if np.issubdtype(da.dtype, np.floating):
+        return np.nan
+    if da.dtype.kind in 'mM':
+        return np.array('NaT', dtype = da.dtype)
+    if not np.issubdtype(da.dtype, np.integer):
+        raise TypeError('No fill value for variable {} of dtype {}'
+                        .format(da.name, da.dtype))
+    fill = da.encoding.get('_FillValue', da.attrs.get('_FillValue'))
+    if fill is None:
+        fill = np.iinfo(da.dtype).min
+    return np.asarray(fill, dtype = da.dtype).item()
+
+
+def write_region(ds, store):
+    '''
+    Write a Dataset into the region of the store that matches its time steps,
+    and flag the region as written. The time steps must be consecutive time
+    steps of the store, created with `init_zarr_store`.
+    '''
+    if not os.path.exists(store):
+        raise FileNotFoundError('Zarr store {} does not exist: create it for '
+                                'the full time axis with init_zarr_store '
+                                'before writing regions'.format(store))
+    store_times = xr.open_zarr(store, consolidated = True).time.values
+    times = np.asarray(ds.time.values, dtype = store_times.dtype)
+    start = int(np.searchsorted(store_times, times[0]))
+    region = slice(start, start + len(times))
+    if not np.array_equal(store_times[region], times):
+        raise ValueError('Time steps {} to {} are not a region of the store {}'
+                         .format(times[0], times[-1], store))
+
+    drop = [v for v in ds.variables if 'time' not in ds[v].dims]
+    out = ds.drop_vars(drop)
+    out[WRITTEN_FLAG] = ('time', np.ones(len(times), dtype = 'i1'))
+    out.to_zarr(store, region = {'time': region}, consolidated = True)
+    return region
+
+
+def written_times(store):
+    ''' Time steps of the store that have been written. '''
+    if not os.path.exists(store):
+        return np.array([], dtype = 'datetime64[ns]')
+    ds = xr.open_zarr(store, consolidated = True)
+    return ds.time.values[ds[WRITTEN_FLAG].values.astype(bool)]
+
+
+def missing_times(store):
+    ''' Time steps of the store that have not been written yet. '''
+    ds = xr.open_zarr(store, consolidated = True)
+    return ds.time.values[~ds[WRITTEN_FLAG].values.astype(bool)]